@@ -0,0 +1,183 @@
+# app/analytics.py
+#
+# Portfolio analytics over column arrays instead of Loan objects.
+#
+# Loans are loaded once as NumPy integer columns (cents, basis points,
+# months) and the figures behind Loan.monthly_payment_value, .interest,
+# .balance and .progress_percent are computed for every loan in one pass.
+# Everything except the amortized monthly payment is exact integer
+# arithmetic; that payment is computed in float64 and the few loans within
+# rounding noise of a half cent are recomputed with the model's Decimal
+# formula. `reconcile` checks the results against the model properties.
+#
+# Requires NumPy.
+
+from decimal import Decimal
+
+import numpy as np
+
+# Units of the integer columns
+CENTS = 100  # amount, paid, monthly_payment
+BASIS_POINTS = 100  # interest_rate, in hundredths of a percent
+MICROS = 10 ** 6  # interest and balance: amount (2 dp) x rate (2 dp) / 100 has 6 dp
+HUNDREDTHS = 100  # progress percent, rounded to 2 dp like the model
+
+# A float payment this close to a half cent is settled with Decimal instead
+_HALF_CENT_TOLERANCE = 1e-6
+
+_LOAN_FIELDS = ("id", "amount", "interest_rate", "duration", "paid_amount")
+
+
+class LoanColumns:
+    """The loan fields analytics needs, one int64 array per field."""
+    __slots__ = ("ids", "amount", "rate", "duration", "paid")
+
+    def __init__(self, ids, amount, rate, duration, paid):
+        self.ids = ids
+        self.amount = amount  # cents
+        self.rate = rate  # basis points
+        self.duration = duration  # months
+        self.paid = paid  # cents
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from (id, amount, interest_rate, duration, paid_amount) tuples."""
+        rows = list(rows)
+        if not rows:
+            empty = np.zeros(0, dtype=np.int64)
+            return cls(empty, empty, empty, empty, empty)
+        ids, amount, rate, duration, paid = zip(*rows)
+        return cls(
+            np.array(ids, dtype=np.int64),
+            _to_units(amount, CENTS),
+            _to_units(rate, BASIS_POINTS),
+            np.array(duration, dtype=np.int64),
+            _to_units(paid, CENTS),
+        )
+
+    @classmethod
+    def from_queryset(cls, loans):
+        """One query; the Loan rows are never instantiated."""
+        return cls.from_rows(loans.order_by().values_list(*_LOAN_FIELDS).iterator(chunk_size=10000))
+
+    @classmethod
+    def from_loans(cls, loans):
+        return cls.from_rows(
+            (loan.pk, loan.amount, loan.interest_rate, loan.duration, loan.paid_amount) for loan in loans
+        )
+
+
+def _to_units(values, scale):
+    # Two-decimal values up to 10**12 survive float64 exactly once rounded back to integers
+    return np.rint(np.array(values, dtype=np.float64) * scale).astype(np.int64)
+
+
+class LoanMetrics:
+    """Per-loan results, aligned with the LoanColumns they came from."""
+    __slots__ = ("ids", "monthly_payment", "interest", "balance", "progress", "decimal_fallbacks")
+
+    def __init__(self, ids, monthly_payment, interest, balance, progress, decimal_fallbacks):
+        self.ids = ids
+        self.monthly_payment = monthly_payment  # cents, as Loan.monthly_payment_value
+        self.interest = interest  # micros, as Loan.interest
+        self.balance = balance  # micros, as Loan.balance
+        self.progress = progress  # hundredths of a percent, as Loan.progress_percent
+        self.decimal_fallbacks = decimal_fallbacks  # payments recomputed with Decimal
+
+    def row(self, index):
+        """The metrics of one loan as the model properties would return them."""
+        return {
+            "monthly_payment_value": Decimal(int(self.monthly_payment[index])).scaleb(-2),
+            "interest": Decimal(int(self.interest[index])).scaleb(-6),
+            "balance": Decimal(int(self.balance[index])).scaleb(-6),
+            "progress_percent": float(Decimal(int(self.progress[index])).scaleb(-2)),
+        }
+
+    def totals(self):
+        """Portfolio sums as Decimals (int64 sums, exact for any realistic book)."""
+        return {
+            "loans": len(self.ids),
+            "monthly_payments": Decimal(int(self.monthly_payment.sum())).scaleb(-2),
+            "interest": Decimal(int(self.interest.sum())).scaleb(-6),
+            "outstanding": Decimal(int(self.balance.sum())).scaleb(-6),
+        }
+
+
+def compute(columns):
+    """Compute LoanMetrics for every loan in `columns` in one vectorized pass."""
+    amount, rate, duration, paid = columns.amount, columns.rate, columns.duration, columns.paid
+
+    # interest = amount * rate / 100 -> cents * basis points is in micros
+    interest = amount * rate
+    balance = amount * (MICROS // CENTS) + interest - paid * (MICROS // CENTS)
+    progress = _round_half_even_div(paid * 100 * HUNDREDTHS, amount)
+
+    monthly_payment, fallbacks = _monthly_payments(amount, rate, duration)
+    return LoanMetrics(columns.ids, monthly_payment, interest, balance, progress, fallbacks)
+
+
+def _round_half_even_div(numerator, denominator):
+    """numerator / denominator rounded half-even like Decimal, 0 where the denominator is 0."""
+    safe = np.where(denominator == 0, 1, denominator)
+    quotient, remainder = np.divmod(numerator, safe)
+    twice = remainder * 2
+    round_up = (twice > safe) | ((twice == safe) & (quotient % 2 == 1))
+    return np.where(denominator == 0, 0, quotient + round_up)
+
+
+def _monthly_payments(amount, rate, duration):
+    monthly_rate = rate / (BASIS_POINTS * 100 * 12)
+    months = np.maximum(duration, 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        annuity = monthly_rate * amount / (1 - (1 + monthly_rate) ** -months)
+    annuity = np.where(rate == 0, 0.0, annuity)  # 0/0 for interest-free loans
+    # rint rounds half to even, like round() on a Decimal
+    payment = np.where(rate == 0, _round_half_even_div(amount, months), np.rint(annuity).astype(np.int64))
+    payment = np.where(duration == 0, 0, payment)
+
+    # Too close to a half cent for float64 to decide: redo those with Decimal
+    ambiguous = np.flatnonzero(
+        (rate != 0) & (duration != 0) & (np.abs(annuity - np.floor(annuity) - 0.5) < _HALF_CENT_TOLERANCE)
+    )
+    for i in ambiguous:
+        payment[i] = _decimal_payment(int(amount[i]), int(rate[i]), int(duration[i]))
+    return payment, len(ambiguous)
+
+
+def _decimal_payment(amount_cents, rate_bp, duration):
+    """Loan.monthly_payment_value in cents, with the model's Decimal formula."""
+    if duration == 0:
+        return 0
+    pv = Decimal(amount_cents).scaleb(-2)
+    monthly_rate = (Decimal(rate_bp).scaleb(-2) / 100) / 12
+    if monthly_rate == 0:
+        payment = pv / duration
+    else:
+        payment = (monthly_rate * pv) / (1 - (1 + monthly_rate) ** -duration)
+    return int(round(payment, 2).scaleb(2))
+
+
+def analyze(loans):
+    """LoanMetrics for a Loan queryset, e.g. Loan.objects.filter(lender=user)."""
+    return compute(LoanColumns.from_queryset(loans))
+
+
+def reconcile(loans, metrics):
+    """
+    Compare `metrics` with the model properties of the same loans (an
+    iterable of Loan objects, in any order). Returns a list of
+    (loan id, property, model value, vectorized value); empty when every
+    figure matches exactly.
+    """
+    index = {int(loan_id): i for i, loan_id in enumerate(metrics.ids)}
+    mismatches = []
+    for loan in loans:
+        row = metrics.row(index[loan.pk])
+        for name, value in row.items():
+            expected = getattr(loan, name)
+            if expected != value:
+                mismatches.append((loan.pk, name, expected, value))
+    return mismatches
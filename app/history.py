@@ -0,0 +1,253 @@
+# app/history.py
+#
+# A lender's money history: wallet transactions, the loans they funded and
+# the repayments on those loans, newest first.
+#
+# The three sources are read as one UNION ALL query ordered by (time,
+# source, id). Every branch seeks its own (lender, time) index to the keyset
+# position and stops after one page, so page N costs the same as page 1.
+# Running balances are a SUM() OVER window across the page, offset by the
+# balance at the position; that balance and the all-time totals come from
+# one aggregate over the same union.
+
+import datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from app.pagination import encode_cursor, make_page, page_request
+
+# Source ranks break ties between rows of different sources at the same time
+WALLET, FUNDING, REPAYMENT = 0, 1, 2
+# ?type= filter values
+SOURCE_NAMES = {"wallet": WALLET, "funding": FUNDING, "repayment": REPAYMENT}
+
+CENT = Decimal("0.01")
+
+# (source, SELECT for one lender's rows, time column, id column). Every branch
+# has the same columns; signed is + for inflow and - for outflow.
+_SOURCES = (
+    (
+        WALLET,
+        "SELECT 0 AS source, t.id AS id, t.timestamp AS occurred_at, t.amount AS amount, t.amount AS signed,"
+        " t.type AS label, 'Completed' AS status, NULL AS first_name, NULL AS last_name, NULL AS username"
+        " FROM app_transaction t WHERE t.lender_id = %s",
+        "t.timestamp", "t.id",
+    ),
+    (
+        FUNDING,
+        "SELECT 1, l.id, l.funded_date, l.amount, -l.amount, NULL, l.status, u.first_name, u.last_name, u.username"
+        " FROM app_loan l JOIN app_user u ON u.id = l.user_id"
+        " WHERE l.lender_id = %s AND l.funded_date IS NOT NULL",
+        "l.funded_date", "l.id",
+    ),
+    (
+        REPAYMENT,
+        "SELECT 2, p.id, p.created_at, p.amount, p.amount, NULL, 'Completed', u.first_name, u.last_name, u.username"
+        " FROM app_loanpayment p JOIN app_loan l ON l.id = p.loan_id JOIN app_user u ON u.id = p.user_id"
+        " WHERE l.lender_id = %s",
+        "p.created_at", "p.id",
+    ),
+)
+
+_COLUMNS = ("source", "id", "occurred_at", "amount", "signed", "label", "status",
+            "first_name", "last_name", "username", "balance")
+
+
+def _keyset(time_column, id_column, source, position, older):
+    """
+    SQL condition (and params) for the rows of `source` strictly past
+    `position` (time, source, id) in the (time, source, id) DESC order, or
+    before it when not `older`.
+    """
+    when, position_source, pk = position
+    when = connection.ops.adapt_datetimefield_value(when)
+    lt, lte = ("<", "<=") if older else (">", ">=")
+    if source == position_source:
+        return f"{time_column} {lte} %s AND ({time_column} {lt} %s OR {id_column} {lt} %s)", [when, when, pk]
+    # At the same time a lower-ranked source sorts after the position, a higher one before it
+    if (source < position_source) == older:
+        return f"{time_column} {lte} %s", [when]
+    return f"{time_column} {lt} %s", [when]
+
+
+def _union(lender, position=None, older=True, limit=None):
+    """
+    The UNION ALL of every source (SQL, params). With `limit` each branch is
+    cut to its first `limit` rows past `position`, read from its index.
+    """
+    order = "DESC" if older else "ASC"
+    branches, params = [], []
+    for source, select, time_column, id_column in _SOURCES:
+        sql, branch_params = select, [lender.pk]
+        if position is not None:
+            condition, condition_params = _keyset(time_column, id_column, source, position, older)
+            sql += f" AND {condition}"
+            branch_params += condition_params
+        if limit is not None:
+            sql = (f"SELECT * FROM ({sql} ORDER BY {time_column} {order}, {id_column} {order}"
+                   f" LIMIT {int(limit)}) b{source}")
+        branches.append(sql)
+        params += branch_params
+    return " UNION ALL ".join(branches), params
+
+
+def _rows(lender, position, older, limit, opening):
+    """
+    Up to `limit` rows past `position`, nearest first, each with its running
+    balance. `opening` is the balance of the nearest row's predecessor in
+    reading order: through the first row older than `position` (or the
+    newest row) when walking back in time, through `position` itself when
+    walking forward.
+    """
+    order = "DESC" if older else "ASC"
+    union, params = _union(lender, position, older, limit)
+    window = (f"SUM(h.signed) OVER (ORDER BY h.occurred_at {order}, h.source {order}, h.id {order}"
+              f" ROWS UNBOUNDED PRECEDING)")
+    # Walking back in time a row's balance is the opening less what came after it
+    balance = f"%s - {window} + h.signed" if older else f"%s + {window}"
+    sql = (
+        f"SELECT h.*, {balance} AS balance FROM ({union}"
+        f" ORDER BY occurred_at {order}, source {order}, id {order} LIMIT {int(limit)}) h"
+        f" ORDER BY h.occurred_at {order}, h.source {order}, h.id {order}"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [opening] + params)
+        return [_row(dict(zip(_COLUMNS, values))) for values in cursor.fetchall()]
+
+
+def _row(values):
+    source = values["source"]
+    when = _moment(values["occurred_at"])
+    if source == WALLET:
+        kind, who = f"Wallet {(values['label'] or '').title()}", "Self"
+    else:
+        kind = "Loan Funded" if source == FUNDING else "Loan Repayment"
+        who = " ".join(filter(None, (values["first_name"], values["last_name"]))).strip() or values["username"]
+    return {
+        "source": source,
+        "id": values["id"],
+        "type": kind,
+        "borrower": who,
+        "status": values["status"],
+        "amount": _money(values["amount"]),
+        "positive": source != FUNDING,
+        "balance": _money(values["balance"]),
+        "timestamp": when,
+        "date": when.strftime("%b %d, %Y"),
+        "time": when.strftime("%I:%M %p"),
+    }
+
+
+def _money(value):
+    # SQLite hands back REAL for decimal columns, MySQL and PostgreSQL a Decimal
+    return (value if isinstance(value, Decimal) else Decimal(repr(value))).quantize(CENT)
+
+
+def _moment(value):
+    # Raw cursors skip Django's converters: SQLite returns text, MySQL naive UTC
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    if settings.USE_TZ and timezone.is_naive(value):
+        value = timezone.make_aware(value, datetime.timezone.utc)
+    return value
+
+
+def _cursor(row):
+    return encode_cursor(row["timestamp"], row["source"], row["id"])
+
+
+def _position(values):
+    if values is None or len(values) != 3:
+        return None
+    when = parse_datetime(values[0]) if isinstance(values[0], str) else None
+    if when is None or values[1] not in (WALLET, FUNDING, REPAYMENT):
+        return None
+    try:
+        return when, values[1], int(values[2])
+    except (TypeError, ValueError):
+        return None
+
+
+def totals(lender, through=None, inclusive=True):
+    """
+    Row count, rows this month, inflow and outflow over the whole history,
+    plus "balance": inflow minus outflow over every row older than position
+    `through`, and the row at it when `inclusive` (all rows when None). One
+    aggregate query.
+    """
+    month = timezone.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    union, params = _union(lender)
+    settled, settled_params = "1 = 1", []
+    if through is not None:
+        when, source, pk = through
+        when = connection.ops.adapt_datetimefield_value(when)
+        settled = ("h.occurred_at < %s OR (h.occurred_at = %s"
+                   f" AND (h.source < %s OR (h.source = %s AND h.id {'<=' if inclusive else '<'} %s)))")
+        settled_params = [when, when, source, source, pk]
+    sql = (
+        "SELECT COUNT(*),"
+        " COUNT(CASE WHEN h.occurred_at >= %s THEN 1 END),"
+        f" COALESCE(SUM(CASE WHEN h.source <> {FUNDING} THEN h.amount END), 0),"
+        f" COALESCE(SUM(CASE WHEN h.source = {FUNDING} THEN h.amount END), 0),"
+        f" COALESCE(SUM(CASE WHEN {settled} THEN h.signed END), 0)"
+        f" FROM ({union}) h"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [connection.ops.adapt_datetimefield_value(month)] + settled_params + params)
+        count, this_month, inflow, outflow, balance = cursor.fetchone()
+    return {
+        "count": count,
+        "this_month": this_month,
+        "inflow": _money(inflow),
+        "outflow": _money(outflow),
+        "balance": _money(balance),
+    }
+
+
+def history(request, lender, page_size=None):
+    """
+    (Page, totals) for `lender`: one Page of history rows at the request's
+    cursor, each with its running balance, and the history totals.
+    """
+    size = page_size or settings.LIST_PAGE_SIZE
+    direction, values = page_request(request)
+    position = _position(values)
+    if position is None:
+        direction = "after"
+
+    older = direction == "after"
+    figures = totals(lender, through=position, inclusive=not older)
+    rows = _rows(lender, position, older, size + 1, figures.pop("balance"))
+    page = make_page(rows, size, direction, position, _cursor)
+    for row in page:
+        row["balance"] = f"{row['balance']:,.2f}"
+    return page, figures
+
+
+def history_rows(lender, since=None, until=None, sources=None, chunk_size=2000):
+    """
+    `lender`'s history rows newest first with running balances, read
+    `chunk_size` rows at a time so memory stays flat however long it is.
+    Optionally only rows at or after `since`, before `until` and from the
+    given `sources`; balances stay those of the whole account.
+    """
+    # A position at `until` that every row at that moment sorts before
+    position = None if until is None else (until, WALLET - 1, 0)
+    opening = totals(lender, through=position, inclusive=False)["balance"]
+    while True:
+        rows = _rows(lender, position, True, chunk_size, opening)
+        for row in rows:
+            if since is not None and row["timestamp"] < since:
+                return
+            if sources is None or row["source"] in sources:
+                yield row
+        if len(rows) < chunk_size:
+            return
+        last = rows[-1]
+        position = (last["timestamp"], last["source"], last["id"])
+        # The next chunk opens with the balance just before the last row
+        opening = last["balance"] - (last["amount"] if last["positive"] else -last["amount"])
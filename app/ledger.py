@@ -0,0 +1,200 @@
+# app/ledger.py
+#
+# Append-only double-entry journal for wallets and loans.
+#
+# Every money movement is a LedgerTransfer whose LedgerPostings sum to zero.
+# Account balances are materialized on LedgerAccount (and mirrored on
+# LenderWallet.balance for wallet accounts) in the same transaction as the
+# postings. `manage.py ledger_verify` re-derives them from the journal.
+#
+#   deposit       external:deposits -> wallet:<lender>
+#   loan funding  wallet:<lender> -> loan:<loan> (principal)
+#                 income:interest -> loan:<loan> (interest, accrued up front)
+#   repayment     loan:<loan> -> wallet:<lender>
+#
+# so a loan account's balance is what the borrower still owes.
+
+import logging
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, When
+
+from app.models import LedgerAccount, LedgerPosting, LedgerTransfer, LenderWallet
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal("0.01")
+
+EXTERNAL_DEPOSITS = "external:deposits"
+OPENING_BALANCES = "external:opening"
+INTEREST_INCOME = "income:interest"
+# Repayments on loans that have no lender (created before lenders were recorded)
+UNALLOCATED = "external:unallocated"
+
+
+class LedgerError(Exception):
+    pass
+
+
+class UnbalancedTransfer(LedgerError):
+    pass
+
+
+class InsufficientFunds(LedgerError):
+    pass
+
+
+def wallet_account(user_id):
+    return f"wallet:{user_id}"
+
+
+def loan_account(loan_id):
+    return f"loan:{loan_id}"
+
+
+def loan_interest(loan):
+    """Loan.interest rounded to cents, as it is posted to the journal."""
+    return (loan.amount * loan.interest_rate / 100).quantize(CENT)
+
+
+def get_accounts(names):
+    """
+    Return {name: LedgerAccount} for the given names, creating missing ones.
+    The kind and owner come from the name ("wallet:<user id>", "loan:<loan id>", ...).
+    """
+    names = set(names)
+    accounts = {account.name: account for account in LedgerAccount.objects.filter(name__in=names)}
+    missing = names - accounts.keys()
+    if missing:
+        new_accounts = [_new_account(name) for name in missing]
+        # ignore_conflicts: another transaction may be creating the same account
+        LedgerAccount.objects.bulk_create(new_accounts, ignore_conflicts=True)
+        LenderWallet.objects.bulk_create(
+            [LenderWallet(lender_id=account.user_id) for account in new_accounts if account.kind == "wallet"],
+            ignore_conflicts=True,
+        )
+        accounts.update(
+            (account.name, account) for account in LedgerAccount.objects.filter(name__in=missing)
+        )
+    return accounts
+
+
+def _new_account(name):
+    kind, _, key = name.partition(":")
+    if kind == "wallet":
+        return LedgerAccount(name=name, kind=kind, user_id=int(key))
+    if kind == "loan":
+        return LedgerAccount(name=name, kind=kind, loan_id=int(key))
+    if kind in ("external", "income"):
+        return LedgerAccount(name=name, kind=kind)
+    raise LedgerError(f"Unknown account {name!r}")
+
+
+def post_transfer(kind, entries, description="", accounts=None):
+    """
+    Append one transfer. `entries` is a list of (account name, signed amount)
+    that must sum to zero; amounts for the same account are combined.
+    `accounts` may pass in the get_accounts() result the caller already has.
+
+    Postings go in with one INSERT and every touched balance is updated with
+    one UPDATE ... CASE using F() increments, so concurrent transfers on the
+    same account never lose an update.
+    """
+    totals = defaultdict(Decimal)
+    for name, amount in entries:
+        totals[name] += Decimal(amount).quantize(CENT)
+    totals = {name: amount for name, amount in totals.items() if amount}
+
+    if sum(totals.values(), Decimal("0")) != 0:
+        raise UnbalancedTransfer(f"{kind} transfer does not balance: {totals}")
+
+    if not totals:
+        return None
+
+    with transaction.atomic():
+        if accounts is None or not accounts.keys() >= totals.keys():
+            accounts = get_accounts(totals)
+        transfer = LedgerTransfer.objects.create(kind=kind, description=description[:255])
+        LedgerPosting.objects.bulk_create([
+            LedgerPosting(transfer=transfer, account=accounts[name], amount=amount)
+            for name, amount in totals.items()
+        ])
+        _add_to_balances(
+            LedgerAccount.objects, "pk",
+            {accounts[name].pk: amount for name, amount in totals.items()},
+        )
+        _add_to_balances(
+            LenderWallet.objects, "lender_id",
+            {accounts[name].user_id: amount for name, amount in totals.items() if accounts[name].kind == "wallet"},
+        )
+    return transfer
+
+
+def _add_to_balances(manager, key, deltas):
+    if not deltas:
+        return
+    manager.filter(**{f"{key}__in": deltas}).update(balance=Case(
+        *[When(**{key: pk}, then=F("balance") + amount) for pk, amount in deltas.items()],
+        default=F("balance"),
+        output_field=DecimalField(max_digits=14, decimal_places=2),
+    ))
+
+
+def balance(name):
+    """Current balance of an account, a single indexed row read."""
+    value = LedgerAccount.objects.filter(name=name).values_list("balance", flat=True).first()
+    return value if value is not None else Decimal("0.00")
+
+
+def deposit(lender, amount):
+    """Money a lender adds to their wallet from outside."""
+    return post_transfer(
+        "deposit",
+        [(EXTERNAL_DEPOSITS, -amount), (wallet_account(lender.pk), amount)],
+        f"Wallet deposit by {lender.username}",
+    )
+
+
+def fund_loan(loan):
+    """
+    Debit the lender's wallet for the principal and open the loan's
+    receivable (principal + interest). Raises InsufficientFunds if the
+    wallet cannot cover it.
+    """
+    interest = loan_interest(loan)
+    wallet = wallet_account(loan.lender_id)
+    with transaction.atomic():
+        accounts = get_accounts([wallet, INTEREST_INCOME, loan_account(loan.pk)])
+        # Lock the wallet so two fundings cannot both pass the balance check
+        available = (
+            LedgerAccount.objects.select_for_update().values_list("balance", flat=True).get(pk=accounts[wallet].pk)
+        )
+        if available < loan.amount:
+            raise InsufficientFunds(f"Wallet balance {available} is less than {loan.amount}")
+
+        return post_transfer(
+            "loan_funding",
+            [
+                (wallet, -loan.amount),
+                (INTEREST_INCOME, -interest),
+                (loan_account(loan.pk), loan.amount + interest),
+            ],
+            f"Funding of loan #{loan.pk}",
+            accounts,
+        )
+
+
+def record_repayments(repayments, description="Loan repayments"):
+    """
+    Journal repayments as one transfer: each loan's receivable goes down and
+    its lender's wallet goes up. `repayments` is a list of
+    (loan_id, lender_id, amount); lender_id may be None.
+    """
+    entries = []
+    for loan_id, lender_id, amount in repayments:
+        entries.append((loan_account(loan_id), -amount))
+        entries.append((wallet_account(lender_id) if lender_id else UNALLOCATED, amount))
+    return post_transfer("repayment", entries, description)
+
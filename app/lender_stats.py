@@ -0,0 +1,205 @@
+# app/lender_stats.py
+#
+# Incrementally maintained lender dashboard figures (LenderStats,
+# LenderPurposeStats, LenderDailyStats).
+#
+# Every hook adds deltas with F() increments in the transaction that
+# changed the loans, so concurrent fundings and payments never lose an
+# update. A lender funding their first loan starts from a zero row
+# (migration 0023 filled in the loans funded before the tables existed); a
+# payment reaching a lender with no row rebuilds just that lender, since
+# their fundings were never counted. `manage.py rebuild_lender_stats`
+# recomputes everyone and fixes any drift.
+
+import datetime
+import logging
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, DecimalField, F, IntegerField, Q, Sum, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from app.models import LenderDailyStats, LenderPurposeStats, LenderStats, Loan, interest_due
+
+logger = logging.getLogger(__name__)
+
+
+def record_funding(loan):
+    """A lender funded `loan` (already saved, in the current transaction)."""
+    if not loan.lender_id:
+        return
+    stats = LenderStats.objects.filter(lender_id=loan.lender_id)
+    changes = {
+        "loan_count": F("loan_count") + 1,
+        "active_count": F("active_count") + (1 if loan.status == "Active" and not loan.closed else 0),
+        "total_invested": F("total_invested") + loan.amount,
+        "expected_earnings": F("expected_earnings") + loan.interest,
+        "updated_at": timezone.now(),
+    }
+    with transaction.atomic():
+        if not stats.update(**changes):
+            # First stats for this lender
+            ensure_rows([loan.lender_id])
+            stats.update(**changes)
+        _increment(
+            LenderPurposeStats, {"lender_id": loan.lender_id, "purpose": loan.purpose},
+            loan_count=1, total_amount=loan.amount,
+        )
+        _increment(
+            LenderDailyStats, {"lender_id": loan.lender_id, "day": _funding_day(loan.funded_date)},
+            invested=loan.amount,
+        )
+
+
+def record_payments(paid, closed):
+    """
+    Payments reached lenders' loans: `paid` is {lender_id: amount} and
+    `closed` is {lender_id: loans these payments closed}. One UPDATE for
+    every lender involved.
+    """
+    paid = {lender_id: amount for lender_id, amount in paid.items() if lender_id}
+    if not paid:
+        return
+    stats = LenderStats.objects.filter(lender_id__in=paid)
+    changes = {
+        "total_paid": Case(
+            *[When(lender_id=lender_id, then=F("total_paid") + amount) for lender_id, amount in paid.items()],
+            default=F("total_paid"),
+            output_field=DecimalField(max_digits=14, decimal_places=2),
+        ),
+        "active_count": Case(
+            *[When(lender_id=lender_id, then=F("active_count") - count)
+              for lender_id, count in closed.items() if lender_id and count],
+            default=F("active_count"),
+            output_field=IntegerField(),
+        ),
+        "updated_at": timezone.now(),
+    }
+    with transaction.atomic():
+        if stats.update(**changes) < len(paid):
+            # Payments on loans whose funding was never recorded: applying the
+            # deltas to a zero row would count repayments as the whole of
+            # those lenders' figures, so recompute them from their loans (which
+            # already include these payments). The zero rows come first so
+            # concurrent payments for the same lender queue on the row lock
+            missing = set(paid) - set(stats.values_list("lender_id", flat=True))
+            logger.warning("No stats rows for lenders %s; rebuilding them", sorted(missing))
+            ensure_rows(missing)
+            rebuild(missing)
+
+
+def ensure_rows(lender_ids):
+    """
+    Create zero LenderStats rows for the lenders that have none. INSERT ...
+    ON CONFLICT DO NOTHING (INSERT IGNORE on MySQL), so concurrent first
+    requests for the same lender cannot fail on the primary key.
+    """
+    LenderStats.objects.bulk_create(
+        [LenderStats(lender_id=lender_id) for lender_id in lender_ids], ignore_conflicts=True,
+    )
+
+
+def _increment(model, key, **deltas):
+    """Add `deltas` to the row identified by `key`, creating it if needed."""
+    changes = {field: F(field) + delta for field, delta in deltas.items()}
+    if model.objects.filter(**key).update(**changes):
+        return
+    try:
+        # Savepoint: a concurrent first increment may create the row first
+        with transaction.atomic():
+            model.objects.create(**key, **deltas)
+    except IntegrityError:
+        model.objects.filter(**key).update(**changes)
+
+
+def _funding_day(funded_date):
+    if funded_date is None:
+        return timezone.localdate()
+    if isinstance(funded_date, datetime.datetime):
+        if timezone.is_aware(funded_date):
+            return timezone.localtime(funded_date).date()
+        return funded_date.date()
+    return funded_date
+
+
+def top_purposes(lender, limit=5):
+    return LenderPurposeStats.objects.filter(lender=lender).order_by("-total_amount")[:limit]
+
+
+def rebuild(lender_ids=None):
+    """
+    Recompute stats from the loans for the given lenders (every lender with
+    a stats row or a funded loan when None). Returns {lender_id: (old, new)}
+    for the LenderStats rows whose figures changed.
+    """
+    loans = Loan.objects.filter(lender__isnull=False)
+    stats = LenderStats.objects.all()
+    purposes = LenderPurposeStats.objects.all()
+    days = LenderDailyStats.objects.all()
+    if lender_ids is not None:
+        lender_ids = list(lender_ids)
+        loans = loans.filter(lender_id__in=lender_ids)
+        stats = stats.filter(lender_id__in=lender_ids)
+        purposes = purposes.filter(lender_id__in=lender_ids)
+        days = days.filter(lender_id__in=lender_ids)
+
+    now = timezone.now()
+    with transaction.atomic():
+        fresh = {
+            row["lender_id"]: LenderStats(updated_at=now, **row)
+            for row in loans.values("lender_id").order_by().annotate(
+                loan_count=Count("id"),
+                active_count=Count("id", filter=Q(status="Active", closed=False)),
+                total_invested=Sum("amount"),
+                expected_earnings=Sum(interest_due(), output_field=DecimalField()),
+                total_paid=Sum("paid_amount"),
+            )
+        }
+        if lender_ids is not None:
+            for lender_id in lender_ids:
+                fresh.setdefault(lender_id, LenderStats(lender_id=lender_id, updated_at=now))
+
+        old = {row.lender_id: row for row in stats.select_for_update()}
+        drift = {
+            lender_id: (old.get(lender_id), new)
+            for lender_id, new in fresh.items()
+            if lender_id in old and _figures(old[lender_id]) != _figures(new)
+        }
+
+        stats.delete()
+        purposes.delete()
+        days.delete()
+        LenderStats.objects.bulk_create(fresh.values(), batch_size=1000)
+        LenderPurposeStats.objects.bulk_create(
+            [
+                LenderPurposeStats(**row)
+                for row in loans.values("lender_id", "purpose").order_by().annotate(
+                    loan_count=Count("id"), total_amount=Sum("amount"),
+                )
+            ],
+            batch_size=1000,
+        )
+        LenderDailyStats.objects.bulk_create(
+            [
+                LenderDailyStats(**row)
+                for row in loans.filter(funded_date__isnull=False)
+                .annotate(day=TruncDate("funded_date")).values("lender_id", "day").order_by()
+                .annotate(invested=Sum("amount"))
+            ],
+            batch_size=1000,
+        )
+
+    if drift:
+        logger.warning("Lender stats drifted for %s lenders; rebuilt", len(drift))
+    return drift
+
+
+def _figures(stats):
+    return (
+        stats.loan_count,
+        stats.active_count,
+        Decimal(stats.total_invested).quantize(Decimal("0.01")),
+        Decimal(stats.expected_earnings).quantize(Decimal("0.000001")),
+        Decimal(stats.total_paid).quantize(Decimal("0.01")),
+    )
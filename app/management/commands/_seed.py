@@ -0,0 +1,59 @@
+import random
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+
+from app.models import Loan, LoanApplication, LoanPayment, Notification, Transaction
+
+
+def seed_dataset(user_count, loan_count):
+    """
+    Bulk-insert throwaway users, loans, payments, notifications, applications
+    and wallet transactions; callers run it inside a rolled-back transaction.
+    Returns (lender, borrower), both with plenty of rows.
+    """
+    User = get_user_model()
+    tag = f"plan{random.randint(0, 10 ** 6)}"
+    User.objects.bulk_create(
+        [User(username=f"{tag}-b{i}", role="borrower") for i in range(user_count)]
+        + [User(username=f"{tag}-l{i}", role="lender") for i in range(user_count)]
+    )
+    borrowers = list(User.objects.filter(username__startswith=f"{tag}-b"))
+    lenders = list(User.objects.filter(username__startswith=f"{tag}-l"))
+    now = timezone.now()
+
+    Loan.objects.bulk_create([
+        Loan(
+            user=random.choice(borrowers),
+            lender=random.choice(lenders),
+            amount=Decimal(random.randint(100, 100000)),
+            purpose=random.choice(["business", "school", "medical", "rent"]),
+            duration=random.randint(1, 24),
+            status=random.choice(["Active", "Active", "Completed"]),
+            funded_date=now - timezone.timedelta(days=random.randint(0, 700)),
+        )
+        for _ in range(loan_count)
+    ], batch_size=1000)
+    loans = list(Loan.objects.filter(user__in=borrowers).values_list("pk", "user_id"))
+    LoanPayment.objects.bulk_create([
+        LoanPayment(loan_id=loan_id, user_id=user_id, amount=Decimal("100.00"), payment_method="M-Pesa")
+        for loan_id, user_id in random.choices(loans, k=loan_count * 2)
+    ], batch_size=1000)
+    Notification.objects.bulk_create([
+        Notification(user=user, role=user.role, message="Seeded", read=random.random() < 0.8)
+        for user in random.choices(borrowers + lenders, k=loan_count)
+    ], batch_size=1000)
+    LoanApplication.objects.bulk_create([
+        LoanApplication(
+            user=random.choice(borrowers), amount=Decimal(1000), purpose="business", duration=12,
+            monthly_income=Decimal(5000), employment_status="employed",
+            status=random.choice(["pending", "approved", "approved", "rejected"]),
+        )
+        for _ in range(loan_count // 2)
+    ], batch_size=1000)
+    Transaction.objects.bulk_create([
+        Transaction(lender=random.choice(lenders), amount=Decimal(500), type="deposit")
+        for _ in range(loan_count // 2)
+    ], batch_size=1000)
+    return lenders[0], borrowers[0]
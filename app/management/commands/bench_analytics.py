@@ -0,0 +1,72 @@
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.models import Loan
+
+PROPERTIES = ("monthly_payment_value", "interest", "balance", "progress_percent")
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the vectorized portfolio analytics against the per-object Loan "
+        "properties on a synthetic in-memory book, and reconcile the two exactly"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loans", type=int, default=100000, help="Synthetic loans to generate")
+        parser.add_argument("--repeat", type=int, default=3, help="Runs per path; the best one is reported")
+        parser.add_argument("--seed", type=int, default=1, help="Random seed, for repeatable runs")
+
+    def handle(self, *args, **options):
+        try:
+            from app import analytics
+        except ImportError:
+            raise CommandError("Portfolio analytics needs NumPy: pip install numpy")
+
+        random.seed(options["seed"])
+        loans = [self.synthetic_loan(pk) for pk in range(1, options["loans"] + 1)]
+        count = len(loans)
+
+        per_object = self.best_of(options["repeat"], lambda: [
+            [getattr(loan, name) for name in PROPERTIES] for loan in loans
+        ])
+        columns_time = self.best_of(options["repeat"], lambda: analytics.LoanColumns.from_loans(loans))
+        columns = analytics.LoanColumns.from_loans(loans)
+        compute_time = self.best_of(options["repeat"], lambda: analytics.compute(columns))
+        metrics = analytics.compute(columns)
+
+        self.stdout.write(f"{count} loans, best of {options['repeat']}")
+        self.stdout.write(f"per-object properties   {per_object * 1000:9.1f}ms  {per_object / count * 1e6:7.2f}us/loan")
+        self.stdout.write(f"build columns           {columns_time * 1000:9.1f}ms")
+        self.stdout.write(f"vectorized compute      {compute_time * 1000:9.1f}ms  {compute_time / count * 1e6:7.2f}us/loan")
+        self.stdout.write(f"speedup (compute only)  {per_object / compute_time:9.1f}x")
+        self.stdout.write(f"speedup (with columns)  {per_object / (compute_time + columns_time):9.1f}x")
+        self.stdout.write(f"decimal fallbacks       {metrics.decimal_fallbacks}")
+
+        mismatches = analytics.reconcile(loans, metrics)
+        for loan_id, name, expected, value in mismatches[:20]:
+            self.stdout.write(f"  loan #{loan_id} {name}: model {expected}, vectorized {value}")
+        if mismatches:
+            raise CommandError(f"{len(mismatches)} figures differ from the model properties")
+        self.stdout.write(self.style.SUCCESS("Reconciled: every figure matches the model properties exactly"))
+
+    def synthetic_loan(self, pk):
+        amount = Decimal(random.randint(100_00, 5_000_000_00)).scaleb(-2)
+        return Loan(
+            pk=pk,
+            amount=amount,
+            interest_rate=Decimal(random.choice([0, random.randint(100, 3600)])).scaleb(-2),
+            duration=random.randint(1, 60),
+            paid_amount=(amount * Decimal(random.random() * 1.2)).quantize(Decimal("0.01")),
+        )
+
+    def best_of(self, repeat, func):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        return min(timings)
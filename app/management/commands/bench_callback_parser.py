@@ -0,0 +1,57 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from app.mpesa import callbacks
+from app.mpesa.callbacks import parse_stk_callback
+
+SUCCESS = json.dumps({"Body": {"stkCallback": {
+    "MerchantRequestID": "29115-34620561-1",
+    "CheckoutRequestID": "ws_CO_191220191020363925",
+    "ResultCode": 0,
+    "ResultDesc": "The service request is processed successfully.",
+    "CallbackMetadata": {"Item": [
+        {"Name": "Amount", "Value": 1.00},
+        {"Name": "MpesaReceiptNumber", "Value": "NLJ7RT61SV"},
+        {"Name": "TransactionDate", "Value": 20191219102115},
+        {"Name": "PhoneNumber", "Value": 254708374149},
+    ]},
+}}}).encode()
+
+CANCELLED = json.dumps({"Body": {"stkCallback": {
+    "MerchantRequestID": "29115-34620561-1",
+    "CheckoutRequestID": "ws_CO_191220191020363925",
+    "ResultCode": 1032,
+    "ResultDesc": "Request cancelled by user",
+}}}).encode()
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmark parse_stk_callback with each available JSON decoder"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=100000)
+
+    def handle(self, *args, **options):
+        decoders = {"json": json.loads}
+        try:
+            import orjson
+            decoders["orjson"] = orjson.loads
+        except ImportError:
+            self.stdout.write("orjson not installed, timing the stdlib decoder only")
+
+        default = callbacks._loads
+        try:
+            for name, loads in decoders.items():
+                callbacks._loads = loads
+                for label, body in (("success", SUCCESS), ("cancelled", CANCELLED)):
+                    self.stdout.write(f"{name:<7} {label:<10} {self.time(body, options['iterations']):.2f} us/callback")
+        finally:
+            callbacks._loads = default
+
+    def time(self, body, iterations):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            parse_stk_callback(body)
+        return (time.perf_counter() - started) / iterations * 1e6
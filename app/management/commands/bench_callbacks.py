@@ -0,0 +1,198 @@
+import json
+import logging
+import random
+import statistics
+import time
+import uuid
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from app.models import CallbackInbox, Loan
+from app.mpesa.inbox import drain_inbox
+from app.mpesa.reconcile import track_checkout
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive synthetic STK callbacks (successes, cancellations, duplicates, malformed "
+        "bodies) through mpesa_stk_callback and the inbox drain, report throughput, "
+        "latency and SQL per callback, and fail if the query budget is exceeded. "
+        "Everything runs in one transaction that is rolled back at the end, and only "
+        "the benchmark's own inbox rows are drained. "
+        "Use --settings=project.settings_bench to run it on SQLite."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--callbacks", type=int, default=2000, help="Callbacks to send")
+        parser.add_argument("--loans", type=int, default=50, help="Loans the payments are spread over")
+        parser.add_argument("--cancel-rate", type=float, default=0.15, help="Share of cancelled (1032) callbacks")
+        parser.add_argument("--duplicate-rate", type=float, default=0.05, help="Share of callbacks sent twice")
+        parser.add_argument("--malformed-rate", type=float, default=0.02, help="Share of invalid bodies")
+        parser.add_argument("--batch-size", type=int, default=500, help="Inbox drain batch size")
+        parser.add_argument("--max-endpoint-queries", type=float, default=1.0,
+                            help="Fail if mpesa_stk_callback averages more queries than this per callback")
+        parser.add_argument("--max-drain-queries", type=float, default=0.5,
+                            help="Fail if draining the inbox averages more queries than this per callback")
+        parser.add_argument("--seed", type=int, default=1, help="Random seed, for repeatable runs")
+        parser.add_argument("--with-logging", action="store_true", help="Keep INFO logging during the run")
+
+    def handle(self, *args, **options):
+        random.seed(options["seed"])
+        if not options["with_logging"]:
+            logging.disable(logging.INFO)
+        setup_test_environment()
+        try:
+            # Fixtures, callbacks and payments never outlive the run
+            with transaction.atomic():
+                try:
+                    self.run(options)
+                finally:
+                    transaction.set_rollback(True)
+        finally:
+            teardown_test_environment()
+            logging.disable(logging.NOTSET)
+
+    def run(self, options):
+        first_inbox_id = (CallbackInbox.objects.order_by("-id").values_list("id", flat=True).first() or 0) + 1
+        loans = self.create_fixtures(options["loans"])
+        bodies = self.build_callbacks(loans, options)
+        endpoint = self.send(bodies)
+        # Real callbacks may arrive meanwhile; the drain must leave them alone
+        inbox_ids = list(
+            CallbackInbox.objects.filter(id__gte=first_inbox_id, body__in=set(bodies)).values_list("id", flat=True)
+        )
+        drain = self.drain(options["batch_size"], inbox_ids)
+        self.report(len(bodies), endpoint, drain, options)
+
+    def create_fixtures(self, count):
+        User = get_user_model()
+        user = User.objects.create(username=f"bench-{uuid.uuid4().hex[:8]}", role="borrower")
+        lender = User.objects.create(username=f"bench-lender-{uuid.uuid4().hex[:8]}", role="lender")
+        loans = [
+            Loan.objects.create(
+                user=user,
+                lender=lender,
+                amount=Decimal("1000000.00"),
+                purpose="Callback benchmark",
+                duration=12,
+                status="Active",
+            )
+            for _ in range(count)
+        ]
+        return loans
+
+    def build_callbacks(self, loans, options):
+        bodies = []
+        for _ in range(options["callbacks"]):
+            if random.random() < options["malformed_rate"]:
+                bodies.append(random.choice(['{"Body": {', '{"Body": {}}', "not json"]))
+                continue
+
+            loan = random.choice(loans)
+            amount = Decimal(random.randint(10, 5000))
+            checkout_id = f"ws_CO_bench_{uuid.uuid4().hex[:16]}"
+            track_checkout({"CheckoutRequestID": checkout_id}, loan.pk, loan.user_id, amount, "254708374149")
+
+            callback = {
+                "MerchantRequestID": f"bench-{uuid.uuid4().hex[:8]}",
+                "CheckoutRequestID": checkout_id,
+            }
+            if random.random() < options["cancel_rate"]:
+                callback["ResultCode"] = 1032
+                callback["ResultDesc"] = "Request cancelled by user"
+            else:
+                callback["ResultCode"] = 0
+                callback["ResultDesc"] = "The service request is processed successfully."
+                callback["CallbackMetadata"] = {"Item": [
+                    {"Name": "Amount", "Value": float(amount)},
+                    {"Name": "MpesaReceiptNumber", "Value": uuid.uuid4().hex[:10].upper()},
+                    {"Name": "TransactionDate", "Value": 20250131235959},
+                    {"Name": "PhoneNumber", "Value": 254708374149},
+                ]}
+
+            body = json.dumps({"Body": {"stkCallback": callback}})
+            bodies.append(body)
+            if random.random() < options["duplicate_rate"]:
+                bodies.append(body)
+
+        random.shuffle(bodies)
+        return bodies
+
+    def send(self, bodies):
+        client = Client()
+        url = reverse("mpesa_callback")
+        latencies = []
+
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            for body in bodies:
+                request_started = time.perf_counter()
+                response = client.post(url, body, content_type="application/json")
+                latencies.append(time.perf_counter() - request_started)
+                if response.status_code != 200:
+                    raise CommandError(f"mpesa_stk_callback returned HTTP {response.status_code}")
+            elapsed = time.perf_counter() - started
+
+        return {
+            "elapsed": elapsed,
+            "latencies": latencies,
+            "queries": len(queries),
+            "sql_time": sum(float(query["time"]) for query in queries.captured_queries),
+        }
+
+    def drain(self, batch_size, inbox_ids):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            batches = 0
+            while drain_inbox(batch_size, ids=inbox_ids):
+                batches += 1
+            elapsed = time.perf_counter() - started
+
+        return {
+            "elapsed": elapsed,
+            "batches": batches,
+            "queries": len(queries),
+            "sql_time": sum(float(query["time"]) for query in queries.captured_queries),
+        }
+
+    def report(self, count, endpoint, drain, options):
+        latencies = endpoint["latencies"]
+        endpoint_qpc = endpoint["queries"] / count
+        drain_qpc = drain["queries"] / count
+
+        self.stdout.write(f"Database: {connection.vendor}, {count} callbacks")
+        self.stdout.write(
+            f"mpesa_stk_callback: {count / endpoint['elapsed']:.0f} req/s, "
+            f"p50 {percentile(latencies, 50) * 1000:.2f}ms, p99 {percentile(latencies, 99) * 1000:.2f}ms, "
+            f"mean {statistics.mean(latencies) * 1000:.2f}ms"
+        )
+        self.stdout.write(
+            f"  SQL: {endpoint_qpc:.2f} queries/callback, "
+            f"{endpoint['sql_time'] / count * 1000:.3f}ms/callback"
+        )
+        self.stdout.write(
+            f"Inbox drain: {count / drain['elapsed']:.0f} callbacks/s in {drain['batches']} batches"
+        )
+        self.stdout.write(
+            f"  SQL: {drain_qpc:.2f} queries/callback, {drain['sql_time'] / count * 1000:.3f}ms/callback"
+        )
+
+        failures = []
+        if endpoint_qpc > options["max_endpoint_queries"]:
+            failures.append(f"endpoint {endpoint_qpc:.2f} > {options['max_endpoint_queries']} queries/callback")
+        if drain_qpc > options["max_drain_queries"]:
+            failures.append(f"drain {drain_qpc:.2f} > {options['max_drain_queries']} queries/callback")
+        if failures:
+            raise CommandError("Query budget exceeded: " + "; ".join(failures))
+        self.stdout.write(self.style.SUCCESS("Within query budget"))
@@ -0,0 +1,88 @@
+import logging
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from app.lender_stats import rebuild
+from app.management.commands._seed import seed_dataset
+from app.middleware import QueryBudgetExceeded
+
+BORROWER_VIEWS = ("borrower", "my_loans", "bnotifications")
+LENDER_VIEWS = ("lender", "approved_loans", "loan_requests", "transaction_history", "lnotifications")
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway dataset and request every dashboard with the SQL "
+        "instrumentation in test mode: fails if a view goes over its "
+        "SQL_QUERY_BUDGETS entry or repeats a query shape (N+1). Rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=20, help="Borrowers and lenders to seed (each)")
+        parser.add_argument("--loans", type=int, default=1000, help="Loans to seed")
+        parser.add_argument("--seed", type=int, default=1, help="Random seed, for repeatable runs")
+
+    def handle(self, *args, **options):
+        random.seed(options["seed"])
+        recorder = RepeatedShapes()
+        middleware_logger = logging.getLogger("app.middleware")
+        middleware_logger.addHandler(recorder)
+        # Over-budget views are reported below; skip Django's 500 tracebacks
+        request_logger = logging.getLogger("django.request")
+        request_logger.disabled = True
+        setup_test_environment()
+        failures = []
+        try:
+            with override_settings(SQL_INSTRUMENTATION=True, SQL_QUERY_BUDGET_ENFORCE=True), transaction.atomic():
+                lender, borrower = seed_dataset(options["users"], options["loans"])
+                rebuild([lender.pk])
+                for user, views in ((borrower, BORROWER_VIEWS), (lender, LENDER_VIEWS)):
+                    client = Client()
+                    client.force_login(user)
+                    for view in views:
+                        failures += self.check_view(client, view, recorder)
+                transaction.set_rollback(True)
+        finally:
+            teardown_test_environment()
+            middleware_logger.removeHandler(recorder)
+            request_logger.disabled = False
+
+        if failures:
+            raise CommandError("; ".join(failures))
+        self.stdout.write(self.style.SUCCESS("Every view is within its query budget with no repeated queries"))
+
+    def check_view(self, client, view, recorder):
+        recorder.messages.clear()
+        try:
+            response = client.get(reverse(view))
+        except QueryBudgetExceeded as e:
+            self.stdout.write(self.style.ERROR(f"OVER BUDGET  {e}"))
+            return [str(e)]
+
+        self.stdout.write(
+            f"{view:<20} {response['X-SQL-Queries']:>3} queries  {response['X-SQL-Time-Ms']:>6}ms  "
+            f"{response['X-SQL-Repeated']} repeated shapes"
+        )
+        for message in recorder.messages:
+            self.stdout.write(self.style.WARNING(f"  {message}"))
+        if response.status_code != 200:
+            return [f"{view} returned HTTP {response.status_code}"]
+        if response["X-SQL-Repeated"] != "0":
+            return [f"{view} repeats queries (N+1)"]
+        return []
+
+
+class RepeatedShapes(logging.Handler):
+    """Collects the middleware's N+1 warnings so they can be printed per view."""
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
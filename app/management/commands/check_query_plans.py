@@ -0,0 +1,120 @@
+import random
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from django.utils import timezone
+
+from app.management.commands._seed import seed_dataset
+from app.models import Loan, LoanApplication, LoanPayment, Notification, Transaction
+from app.pagination import beyond
+
+
+def hot_queries(lender, borrower):
+    """The dashboard and list queries that must stay on an index, by name."""
+    cutoff = timezone.now() - timezone.timedelta(days=180)
+    return {
+        "borrower loans": Loan.objects.filter(user=borrower).order_by("-created_at"),
+        "borrower active loans": Loan.objects.filter(user=borrower, status="Active", closed=False)
+        .order_by("-funded_date"),
+        "borrower recent payments": LoanPayment.objects.filter(user=borrower).order_by("-created_at")[:5],
+        "borrower notifications": Notification.objects.filter(user=borrower, role="borrower")
+        .order_by("-created_at"),
+        "borrower unread count": Notification.objects.filter(user=borrower, role="borrower", read=False),
+        "lender funded loans": Loan.objects.filter(lender=lender).order_by("-funded_date"),
+        "lender recent loans": Loan.objects.filter(lender=lender).order_by("-funded_date")[:5],
+        "lender active loans": Loan.objects.filter(lender=lender, status="Active", closed=False),
+        "lender repayments": LoanPayment.objects.filter(loan__lender=lender).order_by("-created_at"),
+        "lender wallet transactions": Transaction.objects.filter(lender=lender).order_by("-timestamp"),
+        "lender notifications": Notification.objects.filter(user=lender, role="lender").order_by("-created_at"),
+        "pending loan requests": LoanApplication.objects.filter(status="pending").order_by("-created_at"),
+        # Keyset pages deep into the lists must seek, not scan
+        "borrower loans page": Loan.objects.filter(user=borrower).filter(beyond("created_at", cutoff, 0))
+        .order_by("-created_at", "-id")[:21],
+        "lender funded loans page": Loan.objects.filter(lender=lender).filter(beyond("funded_date", cutoff, 0))
+        .order_by("-funded_date", "-id")[:21],
+        "lender notifications page": Notification.objects.filter(user=lender, role="lender")
+        .filter(beyond("created_at", cutoff, 0)).order_by("-created_at", "-id")[:21],
+        "pending loan requests page": LoanApplication.objects.filter(status="pending")
+        .filter(beyond("created_at", cutoff, 0)).order_by("-created_at", "-id")[:21],
+        "lender repayments page": LoanPayment.objects.filter(loan__lender=lender)
+        .filter(beyond("created_at", cutoff, 0)).order_by("-created_at", "-id")[:21],
+        "lender wallet transactions page": Transaction.objects.filter(lender=lender)
+        .filter(beyond("timestamp", cutoff, 0)).order_by("-timestamp", "-id")[:21],
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway dataset, EXPLAIN every hot dashboard query and fail if any "
+        "of them plans a full table scan. Everything is rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=200, help="Borrowers and lenders to seed (each)")
+        parser.add_argument("--loans", type=int, default=5000, help="Loans to seed")
+        parser.add_argument("--verbose-plans", action="store_true", help="Print every plan")
+        parser.add_argument("--seed", type=int, default=1, help="Random seed, for repeatable runs")
+
+    def handle(self, *args, **options):
+        random.seed(options["seed"])
+        failures = []
+        with transaction.atomic():
+            lender, borrower = seed_dataset(options["users"], options["loans"])
+            self.analyze()
+            for name, queryset in hot_queries(lender, borrower).items():
+                plan, scans = self.explain(queryset)
+                if options["verbose_plans"] or scans:
+                    self.stdout.write(f"-- {name}")
+                    for line in plan:
+                        self.stdout.write(f"   {line}")
+                if scans:
+                    failures.append(f"{name} ({', '.join(sorted(scans))})")
+                    self.stdout.write(self.style.ERROR(f"FULL SCAN  {name}: {', '.join(sorted(scans))}"))
+                else:
+                    self.stdout.write(f"index      {name}")
+            transaction.set_rollback(True)
+
+        if failures:
+            raise CommandError("Full table scans in: " + "; ".join(failures))
+        self.stdout.write(self.style.SUCCESS(f"No full scans on {connection.vendor}"))
+
+    def analyze(self):
+        """Refresh planner statistics so the seeded sizes are what the planner sees."""
+        tables = [model._meta.db_table for model in (Loan, LoanApplication, LoanPayment, Notification, Transaction)]
+        with connection.cursor() as cursor:
+            if connection.vendor == "mysql":
+                cursor.execute("ANALYZE TABLE " + ", ".join(tables))
+                cursor.fetchall()
+            elif connection.vendor in ("postgresql", "sqlite"):
+                for table in tables:
+                    cursor.execute(f"ANALYZE {table}")
+
+    def explain(self, queryset):
+        """(plan lines, tables read with a full scan)"""
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            if connection.vendor == "sqlite":
+                cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+                plan = [row[-1] for row in cursor.fetchall()]
+                scans = {
+                    match.group(1) for line in plan
+                    if (match := re.match(r"SCAN (\w+)", line)) and "USING" not in line
+                }
+            elif connection.vendor == "mysql":
+                cursor.execute("EXPLAIN " + sql, params)
+                columns = [column[0] for column in cursor.description]
+                rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+                plan = [
+                    f"{row['table']}: type={row['type']} key={row['key']} rows={row['rows']} {row['Extra'] or ''}"
+                    for row in rows
+                ]
+                scans = {row["table"] for row in rows if row["type"] == "ALL"}
+            elif connection.vendor == "postgresql":
+                cursor.execute("EXPLAIN " + sql, params)
+                plan = [row[0] for row in cursor.fetchall()]
+                scans = {match.group(1) for line in plan if (match := re.search(r"Seq Scan on (\w+)", line))}
+            else:
+                raise CommandError(f"No plan checks for {connection.vendor}")
+        return plan, scans
@@ -0,0 +1,81 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.models import LedgerAccount, LedgerPosting, LenderWallet
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-derive every ledger balance from the journal and compare it with the "
+        "materialized balances on LedgerAccount and LenderWallet"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=5000, help="Postings read per database round trip")
+        parser.add_argument("--show", type=int, default=20, help="Mismatches to print per check")
+
+    def handle(self, *args, **options):
+        derived = defaultdict(Decimal)
+        unbalanced = []
+        postings = 0
+        current_transfer, transfer_total = None, Decimal("0")
+
+        # Streamed in transfer order so each transfer's sum is checked with O(1) memory
+        rows = (
+            LedgerPosting.objects
+            .order_by("transfer_id", "id")
+            .values_list("transfer_id", "account_id", "amount")
+            .iterator(chunk_size=options["chunk_size"])
+        )
+        for transfer_id, account_id, amount in rows:
+            if transfer_id != current_transfer:
+                if transfer_total:
+                    unbalanced.append((current_transfer, transfer_total))
+                current_transfer, transfer_total = transfer_id, Decimal("0")
+            transfer_total += amount
+            derived[account_id] += amount
+            postings += 1
+        if transfer_total:
+            unbalanced.append((current_transfer, transfer_total))
+
+        account_mismatches = []
+        wallet_balances = {}
+        stored_total = Decimal("0")
+        accounts = LedgerAccount.objects.values_list("id", "name", "kind", "user_id", "balance")
+        for account_id, name, kind, user_id, stored in accounts.iterator(chunk_size=options["chunk_size"]):
+            expected = derived.pop(account_id, Decimal("0"))
+            stored_total += stored
+            if stored != expected:
+                account_mismatches.append(f"{name}: stored {stored}, journal {expected}")
+            if kind == "wallet":
+                wallet_balances[user_id] = expected
+
+        wallet_mismatches = []
+        for lender_id, stored in LenderWallet.objects.values_list("lender_id", "balance").iterator(
+            chunk_size=options["chunk_size"]
+        ):
+            expected = wallet_balances.get(lender_id, Decimal("0"))
+            if stored != expected:
+                wallet_mismatches.append(f"LenderWallet of user #{lender_id}: stored {stored}, journal {expected}")
+
+        self.stdout.write(f"{postings} postings, {len(wallet_balances)} wallets checked")
+        problems = 0
+        for title, lines in (
+            ("Transfers that do not sum to zero", [f"transfer #{pk}: {total}" for pk, total in unbalanced]),
+            ("Postings on missing accounts", [f"account #{pk}: {total}" for pk, total in derived.items()]),
+            ("Account balances that differ from the journal", account_mismatches),
+            ("Account balances that do not sum to zero", [f"total {stored_total}"] if stored_total else []),
+            ("Wallet balances that differ from the journal", wallet_mismatches),
+        ):
+            if not lines:
+                continue
+            problems += len(lines)
+            self.stdout.write(self.style.ERROR(f"{title}: {len(lines)}"))
+            for line in lines[:options["show"]]:
+                self.stdout.write(f"  {line}")
+
+        if problems:
+            raise CommandError(f"Ledger verification failed with {problems} problems")
+        self.stdout.write(self.style.SUCCESS("Ledger balances match the journal"))
@@ -0,0 +1,40 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from app.models import Loan
+from app.schedule import create_schedule, due_between
+
+
+class Command(BaseCommand):
+    help = "List installments coming due across all loans, and build schedules for loans funded before they existed"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=7, help="Show unpaid installments due within this many days")
+        parser.add_argument("--overdue", action="store_true", help="Include installments already past due")
+        parser.add_argument("--backfill", action="store_true",
+                            help="Build schedules for active loans that have none")
+
+    def handle(self, *args, **options):
+        if options["backfill"]:
+            built = 0
+            for loan in Loan.objects.filter(status="Active", closed=False, installments__isnull=True).iterator():
+                create_schedule(loan)
+                built += 1
+            self.stdout.write(f"Built schedules for {built} loans")
+
+        today = timezone.localdate()
+        start = datetime.date.min if options["overdue"] else today
+        end = today + datetime.timedelta(days=options["days"])
+
+        count = 0
+        for installment in due_between(start, end).iterator(chunk_size=500):
+            loan = installment.loan
+            marker = " OVERDUE" if installment.due_date < today else ""
+            self.stdout.write(
+                f"{installment.due_date}  loan #{loan.pk} ({loan.user.username})  "
+                f"installment {installment.number}/{loan.duration}  {installment.amount}{marker}"
+            )
+            count += 1
+        self.stdout.write(f"{count} unpaid installments due by {end}")
@@ -0,0 +1,31 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.mpesa.breaker import breakers
+
+
+class Command(BaseCommand):
+    help = "Show the Daraja circuit breakers, or close one by hand with --reset"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reset", metavar="NAME", help=f"Close a breaker ({', '.join(breakers)})")
+
+    def handle(self, *args, **options):
+        name = options["reset"]
+        if name:
+            if name not in breakers:
+                raise CommandError(f"Unknown breaker {name!r}; choose from {', '.join(breakers)}")
+            breakers[name].reset()
+            self.stdout.write(self.style.SUCCESS(f"Circuit breaker {name} closed"))
+
+        for name, breaker in breakers.items():
+            stats = breaker.stats()
+            opened = stats["last_opened_at"]
+            opened = datetime.fromtimestamp(opened).strftime("%Y-%m-%d %H:%M:%S") if opened else "never"
+            line = (
+                f"{name:<10} {stats['state']:<10} failures {stats['failures']}, "
+                f"trips {stats['trips']}, recoveries {stats['recoveries']}, last opened {opened}"
+            )
+            style = self.style.SUCCESS if stats["state"] == "closed" else self.style.WARNING
+            self.stdout.write(style(line))
@@ -0,0 +1,52 @@
+import logging
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from app.mpesa.inbox import drain_inbox
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Drain the M-Pesa callback inbox in batches and credit the payments"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Callbacks processed per transaction")
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds to sleep when the inbox is empty")
+        parser.add_argument("--once", action="store_true", help="Process a single batch and exit")
+
+    def handle(self, *args, **options):
+        self.stdout.write("M-Pesa callback worker started")
+        try:
+            self.run(options)
+        except KeyboardInterrupt:
+            self.stdout.write("M-Pesa callback worker stopped")
+
+    def run(self, options):
+        while True:
+            started = time.monotonic()
+            try:
+                rows = drain_inbox(options["batch_size"])
+            except Exception:
+                # Database hiccups and the like: log, back off and try again
+                logger.exception("Draining the M-Pesa callback inbox failed")
+                close_old_connections()
+                if options["once"]:
+                    raise
+                time.sleep(options["poll_interval"])
+                continue
+
+            if rows:
+                counts = Counter(row.status for row in rows)
+                summary = ", ".join(f"{count} {status}" for status, count in sorted(counts.items()))
+                self.stdout.write(
+                    f"Drained {len(rows)} callbacks in {time.monotonic() - started:.2f}s ({summary})"
+                )
+
+            if options["once"]:
+                return
+            if len(rows) < options["batch_size"]:
+                time.sleep(options["poll_interval"])
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from app.models import CallbackInbox, PendingCheckout
+from app.mpesa.reconcile import expire_checkouts
+
+
+class Command(BaseCommand):
+    help = "Summarize STK checkouts: how many are still waiting for a result, and unmatched callbacks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--expire", action="store_true",
+                            help="Mark checkouts older than MPESA_CHECKOUT_EXPIRY as expired first")
+
+    def handle(self, *args, **options):
+        if options["expire"]:
+            self.stdout.write(f"Expired {expire_checkouts()} checkouts")
+
+        counts = dict(PendingCheckout.objects.values_list("status").annotate(Count("pk")))
+        for status, _ in PendingCheckout.CHECKOUT_STATUS:
+            self.stdout.write(f"{status:<10} {counts.get(status, 0)}")
+
+        oldest = PendingCheckout.objects.filter(status="pending").aggregate(oldest=Min("created_at"))["oldest"]
+        if oldest:
+            self.stdout.write(f"Oldest unmatched checkout is {timezone.now() - oldest} old")
+
+        unknown = CallbackInbox.objects.filter(status="ignored", error="Unknown CheckoutRequestID").count()
+        self.stdout.write(f"Callbacks with no matching checkout: {unknown}")
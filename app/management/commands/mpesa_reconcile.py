@@ -0,0 +1,44 @@
+import asyncio
+import time
+from collections import Counter
+
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand
+
+from app.models import PendingCheckout
+from app.mpesa.reconcile import claim_due_checkouts, reconcile_batch
+
+
+class Command(BaseCommand):
+    help = "Poll the STK Query API for pending checkouts whose callback never arrived"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=200, help="Checkouts claimed per round")
+        parser.add_argument("--concurrency", type=int, default=20, help="Status queries in flight at once")
+        parser.add_argument("--poll-interval", type=float, default=5.0, help="Seconds to sleep when nothing is due")
+        parser.add_argument("--once", action="store_true", help="Process a single batch and exit")
+
+    def handle(self, *args, **options):
+        self.stdout.write("M-Pesa reconciler started")
+        try:
+            asyncio.run(self.run(options))
+        except KeyboardInterrupt:
+            self.stdout.write("M-Pesa reconciler stopped")
+
+    async def run(self, options):
+        while True:
+            checkouts = await sync_to_async(claim_due_checkouts)(options["batch_size"])
+
+            if checkouts:
+                started = time.monotonic()
+                outcomes = Counter(await reconcile_batch(checkouts, options["concurrency"]))
+                open_count = await PendingCheckout.objects.filter(status="pending").acount()
+                self.stdout.write(
+                    f"Polled {len(checkouts)} checkouts in {time.monotonic() - started:.2f}s: "
+                    f"{dict(outcomes)} - {open_count} still pending"
+                )
+
+            if options["once"]:
+                return
+            if len(checkouts) < options["batch_size"]:
+                await asyncio.sleep(options["poll_interval"])
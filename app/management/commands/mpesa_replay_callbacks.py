@@ -0,0 +1,40 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from app.models import CallbackInbox
+from app.mpesa.callbacks import CallbackError, parse_stk_callback
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-check inbox callbacks that ended as error/ignored and, with --requeue, "
+        "send the ones that now parse back to mpesa_callbacks"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--status", nargs="+", default=["error", "ignored"], help="Inbox statuses to replay")
+        parser.add_argument("--id", type=int, nargs="+", help="Only these inbox rows")
+        parser.add_argument("--requeue", action="store_true", help="Mark valid callbacks as received again")
+
+    def handle(self, *args, **options):
+        rows = CallbackInbox.objects.filter(status__in=options["status"]).order_by("id")
+        if options["id"]:
+            rows = rows.filter(id__in=options["id"])
+
+        valid = []
+        errors = Counter()
+        for row in rows.only("id", "body").iterator():
+            try:
+                parse_stk_callback(row.body)
+            except CallbackError as e:
+                errors[type(e).__name__] += 1
+                self.stdout.write(f"#{row.id}: {e}")
+                continue
+            valid.append(row.id)
+
+        self.stdout.write(f"{len(valid)} parse cleanly, {sum(errors.values())} do not {dict(errors) or ''}")
+
+        if options["requeue"] and valid:
+            requeued = CallbackInbox.objects.filter(id__in=valid).update(status="received", error="", processed_at=None)
+            self.stdout.write(self.style.SUCCESS(f"Requeued {requeued} callbacks"))
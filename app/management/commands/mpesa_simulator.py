@@ -0,0 +1,43 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from app.mpesa.simulator import DarajaSimulator
+
+
+class Command(BaseCommand):
+    help = "Run a local Daraja stand-in (OAuth, STK push, STK query) that sends simulated callbacks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8900)
+        parser.add_argument("--callback-url", help="Override the CallBackURL sent in each STK push, "
+                                                   "e.g. http://127.0.0.1:8000/mpesa/callback/")
+        parser.add_argument("--callback-delay", type=float, default=3.0, help="Seconds before the callback is sent")
+        parser.add_argument("--failure-rate", type=float, default=0.1, help="Share of pushes the customer cancels")
+        parser.add_argument("--duplicate-rate", type=float, default=0.05, help="Share of callbacks delivered twice")
+        parser.add_argument("--latency", type=float, default=0.0, help="Extra seconds added to every API response")
+
+    def handle(self, *args, **options):
+        simulator = DarajaSimulator(
+            callback_url=options["callback_url"],
+            callback_delay=options["callback_delay"],
+            failure_rate=options["failure_rate"],
+            duplicate_rate=options["duplicate_rate"],
+            latency=options["latency"],
+        )
+        server = simulator.serve(options["host"], options["port"])
+        self.stdout.write(
+            f"Daraja simulator listening on http://{options['host']}:{options['port']} "
+            f"(set MPESA_ENV = \"simulator\")"
+        )
+
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            while True:
+                time.sleep(10)
+                self.stdout.write(f"Counters: {simulator.counters}")
+        except KeyboardInterrupt:
+            server.shutdown()
+            self.stdout.write(f"Simulator stopped. Counters: {simulator.counters}")
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from app.mpesa.auth import token_manager
+
+
+class Command(BaseCommand):
+    help = "Show the shared Daraja access token cache counters, or drop the token with --invalidate"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--invalidate", action="store_true", help="Drop the cached token so the next call fetches one")
+
+    def handle(self, *args, **options):
+        if options["invalidate"]:
+            token_manager.invalidate()
+            self.stdout.write(self.style.SUCCESS("Access token dropped"))
+
+        stats = token_manager.stats()
+        lookups = stats["hits"] + stats["misses"]
+        hit_rate = f"{stats['hits'] / lookups:.1%}" if lookups else "n/a"
+        expires = f"refreshed in {stats['expires_in']:.0f}s" if stats["expires_in"] is not None else "none cached"
+        self.stdout.write(
+            f"Access token {expires}: {stats['hits']} hits, {stats['misses']} misses ({hit_rate} hit rate), "
+            f"{stats['refreshes']} refreshes"
+        )
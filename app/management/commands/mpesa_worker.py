@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+from asgiref.sync import sync_to_async
+from django.core.management.base import BaseCommand
+
+from app.mpesa.breaker import breakers
+from app.mpesa.client import get_daraja_client
+from app.mpesa.jobs import claim_jobs, process_batch
+from app.mpesa.ratelimit import dispatcher
+
+
+class Command(BaseCommand):
+    help = "Claim queued M-Pesa STK push jobs in batches and send them to Daraja"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=50, help="Jobs claimed per round")
+        parser.add_argument("--concurrency", type=int, default=20, help="STK pushes in flight at once")
+        parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds to sleep when the queue is empty")
+        parser.add_argument("--once", action="store_true", help="Process a single batch and exit")
+
+    def handle(self, *args, **options):
+        self.stdout.write("M-Pesa worker started")
+        try:
+            asyncio.run(self.run(options))
+        except KeyboardInterrupt:
+            self.stdout.write("M-Pesa worker stopped")
+
+    async def run(self, options):
+        while True:
+            jobs = await sync_to_async(claim_jobs)(options["batch_size"])
+
+            if jobs:
+                started = time.monotonic()
+                await process_batch(jobs, options["concurrency"])
+                sent = sum(1 for job in jobs if job.status == "sent")
+                rate = await sync_to_async(dispatcher.stats)(get_daraja_client().config.shortcode)
+                self.stdout.write(
+                    f"Processed {len(jobs)} jobs ({sent} sent) in {time.monotonic() - started:.2f}s - "
+                    f"rate limit queue depth {rate['queue_depth']}, "
+                    f"avg wait {rate['avg_wait']:.2f}s, max wait {rate['max_wait']:.2f}s"
+                )
+                states = await sync_to_async(self.breaker_states)()
+                if states:
+                    self.stdout.write(self.style.WARNING(f"Circuit breakers: {states}"))
+
+            if options["once"]:
+                return
+            if len(jobs) < options["batch_size"]:
+                await asyncio.sleep(options["poll_interval"])
+
+    def breaker_states(self):
+        return ", ".join(
+            f"{name} {breaker.state()}" for name, breaker in breakers.items()
+            if breaker.state() != "closed"
+        )
@@ -0,0 +1,33 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from app.lender_stats import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recompute the lender dashboard stats from the loans and report any drift it fixed"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lender", help="Only rebuild this username")
+        parser.add_argument("--check", action="store_true",
+                            help="Exit with an error if any lender's stats had drifted")
+
+    def handle(self, *args, **options):
+        lender_ids = None
+        if options["lender"]:
+            lender = get_user_model().objects.filter(username=options["lender"]).first()
+            if lender is None:
+                raise CommandError(f"No user named {options['lender']!r}")
+            lender_ids = [lender.pk]
+
+        drift = rebuild(lender_ids)
+        for lender_id, (old, new) in drift.items():
+            self.stdout.write(
+                f"lender #{lender_id}: loans {old.loan_count}->{new.loan_count}, "
+                f"active {old.active_count}->{new.active_count}, "
+                f"invested {old.total_invested}->{new.total_invested}, "
+                f"paid {old.total_paid}->{new.total_paid}"
+            )
+        self.stdout.write(f"Rebuilt lender stats, {len(drift)} lenders had drifted")
+        if drift and options["check"]:
+            raise CommandError("Lender stats had drifted")
@@ -0,0 +1,115 @@
+# app/middleware.py
+
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# "IN (%s, %s, %s)" and "VALUES (...), (...)" vary with the batch size, not the query
+_IN_LIST = re.compile(r"IN \((?:%s, )*%s\)")
+_VALUES_LIST = re.compile(r"(VALUES \((?:%s, )*%s\))(?:, \((?:%s, )*%s\))+")
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_shape(sql):
+    """The SQL with parameter lists collapsed, so one loop's queries share a shape."""
+    return _VALUES_LIST.sub(r"\1, ...", _IN_LIST.sub("IN (...)", sql))
+
+
+class QueryRecorder:
+    """connection.execute_wrapper that counts and times every query."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.shapes[query_shape(sql)] += 1
+
+    def repeated(self, threshold):
+        """{shape: executions} for shapes run at least `threshold` times: likely N+1 loops."""
+        return {shape: count for shape, count in self.shapes.items() if count >= threshold}
+
+
+class QueryInstrumentationMiddleware:
+    """
+    Records the SQL each request runs (enabled by SQL_INSTRUMENTATION).
+
+    Adds X-SQL-Queries, X-SQL-Time-Ms and X-SQL-Repeated headers and logs one
+    line per request; repeated query shapes and budget overruns are logged
+    as warnings. With SQL_QUERY_BUDGET_ENFORCE (for test runs) a view over
+    its SQL_QUERY_BUDGETS entry raises QueryBudgetExceeded instead.
+
+    Async requests (under ASGI) pass through unrecorded, so the middleware
+    does not force Django to run the whole stack synchronously.
+    """
+
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, "SQL_INSTRUMENTATION", False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.budgets = getattr(settings, "SQL_QUERY_BUDGETS", {})
+        self.threshold = getattr(settings, "SQL_REPEATED_QUERY_THRESHOLD", 3)
+        self.enforce = getattr(settings, "SQL_QUERY_BUDGET_ENFORCE", False)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        recorder = QueryRecorder()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(recorder))
+            response = self.get_response(request)
+
+        match = getattr(request, "resolver_match", None)
+        view = (match.url_name or match.view_name) if match else request.path
+        repeated = recorder.repeated(self.threshold)
+        budget = self.budgets.get(view, self.budgets.get("default"))
+
+        response["X-SQL-Queries"] = str(recorder.count)
+        response["X-SQL-Time-Ms"] = f"{recorder.duration * 1000:.1f}"
+        response["X-SQL-Repeated"] = str(len(repeated))
+
+        extra = {"view": view, "queries": recorder.count, "sql_ms": round(recorder.duration * 1000, 1)}
+        logger.info("%s ran %s queries in %.1fms", view, recorder.count, recorder.duration * 1000, extra=extra)
+        for shape, count in sorted(repeated.items(), key=lambda item: -item[1]):
+            logger.warning("Possible N+1 in %s: %s x %s", view, count, shape[:300], extra=extra)
+
+        if budget is not None and recorder.count > budget:
+            message = f"{view} ran {recorder.count} queries, over its budget of {budget}"
+            if self.enforce:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message, extra=extra)
+        return response
+
+    async def __acall__(self, request):
+        # execute_wrapper() pushes onto and pops from the connection's wrapper
+        # list, and connections are shared across sync_to_async calls, so
+        # interleaved requests would record each other's queries and unwind
+        # each other's wrappers. The sync path (test client, WSGI,
+        # check_query_budgets) keeps the numbers.
+        return await self.get_response(request)
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:55
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0015_mpesapaymentjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingCheckout',
+            fields=[
+                ('checkout_request_id', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('merchant_request_id', models.CharField(blank=True, max_length=100)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('phone', models.CharField(max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('completed', 'Completed'), ('failed', 'Failed'), ('expired', 'Expired')], default='pending', max_length=20)),
+                ('result_code', models.CharField(blank=True, max_length=20)),
+                ('result_desc', models.CharField(blank=True, max_length=255)),
+                ('poll_count', models.PositiveIntegerField(default=0)),
+                ('next_poll_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('resolved_at', models.DateTimeField(blank=True, null=True)),
+                ('loan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pending_checkouts', to='app.loan')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pending_checkouts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'next_poll_at'], name='checkout_status_poll_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0016_pendingcheckout'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mpesapaymentjob',
+            name='correlation_id',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='pendingcheckout',
+            name='correlation_id',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0017_mpesapaymentjob_correlation_id_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MpesaReceipt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('receipt_number', models.CharField(blank=True, max_length=30, null=True, unique=True)),
+                ('checkout_request_id', models.CharField(max_length=100, unique=True)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('phone', models.CharField(blank=True, max_length=20)),
+                ('transaction_date', models.CharField(blank=True, max_length=14)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('loan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mpesa_receipts', to='app.loan')),
+                ('payment', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='mpesa_receipt', to='app.loanpayment')),
+            ],
+        ),
+    ]
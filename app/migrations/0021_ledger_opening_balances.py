@@ -0,0 +1,59 @@
+from decimal import Decimal
+
+from django.db import migrations
+
+CENT = Decimal("0.01")
+
+
+def post_opening_balances(apps, schema_editor):
+    """
+    Open the journal with one transfer that moves the existing wallet
+    balances and outstanding loan balances in from external:opening.
+    """
+    LedgerAccount = apps.get_model("app", "LedgerAccount")
+    LedgerTransfer = apps.get_model("app", "LedgerTransfer")
+    LedgerPosting = apps.get_model("app", "LedgerPosting")
+    LenderWallet = apps.get_model("app", "LenderWallet")
+    Loan = apps.get_model("app", "Loan")
+
+    accounts = []
+    for lender_id, balance in LenderWallet.objects.exclude(balance=0).values_list("lender_id", "balance"):
+        accounts.append(LedgerAccount(
+            name=f"wallet:{lender_id}", kind="wallet", user_id=lender_id, balance=balance,
+        ))
+    for loan_id, amount, interest_rate, paid_amount in Loan.objects.values_list(
+        "id", "amount", "interest_rate", "paid_amount"
+    ).iterator(chunk_size=2000):
+        owed = amount + (amount * interest_rate / 100).quantize(CENT) - paid_amount
+        if owed > 0:
+            accounts.append(LedgerAccount(name=f"loan:{loan_id}", kind="loan", loan_id=loan_id, balance=owed))
+    if not accounts:
+        return
+
+    total = sum((account.balance for account in accounts), Decimal("0"))
+    accounts.append(LedgerAccount(name="external:opening", kind="external", balance=-total))
+
+    LedgerAccount.objects.bulk_create(accounts, batch_size=1000)
+    transfer = LedgerTransfer.objects.create(kind="opening", description="Opening balances")
+    ids = dict(LedgerAccount.objects.values_list("name", "id"))
+    LedgerPosting.objects.bulk_create(
+        [LedgerPosting(transfer=transfer, account_id=ids[account.name], amount=account.balance) for account in accounts],
+        batch_size=1000,
+    )
+
+
+def remove_journal(apps, schema_editor):
+    apps.get_model("app", "LedgerPosting").objects.all().delete()
+    apps.get_model("app", "LedgerTransfer").objects.all().delete()
+    apps.get_model("app", "LedgerAccount").objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0020_ledger'),
+    ]
+
+    operations = [
+        migrations.RunPython(post_opening_balances, remove_journal),
+    ]
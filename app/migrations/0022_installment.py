@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0021_ledger_opening_balances'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Installment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveSmallIntegerField()),
+                ('due_date', models.DateField()),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('principal', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('interest', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('remaining_balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('cumulative_due', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('paid_at', models.DateTimeField(blank=True, null=True)),
+                ('loan', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='installments', to='app.loan')),
+            ],
+            options={
+                'ordering': ['loan', 'number'],
+                'indexes': [models.Index(fields=['due_date', 'paid_at'], name='installment_due_idx')],
+                'constraints': [models.UniqueConstraint(fields=('loan', 'number'), name='installment_loan_number_uniq')],
+            },
+        ),
+    ]
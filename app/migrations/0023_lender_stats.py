@@ -0,0 +1,103 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:17
+
+import django.db.models.deletion
+import django.utils.timezone
+from collections import defaultdict
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def fill_lender_stats(apps, schema_editor):
+    """
+    Stats for the loans funded so far; from here on app/lender_stats.py
+    keeps them up to date, so the dashboard never rebuilds them on a request.
+    """
+    Loan = apps.get_model("app", "Loan")
+    LenderStats = apps.get_model("app", "LenderStats")
+    LenderPurposeStats = apps.get_model("app", "LenderPurposeStats")
+    LenderDailyStats = apps.get_model("app", "LenderDailyStats")
+
+    stats, purposes, days = {}, defaultdict(lambda: [0, Decimal("0")]), defaultdict(Decimal)
+    loans = Loan.objects.filter(lender__isnull=False).values_list(
+        "lender_id", "amount", "interest_rate", "paid_amount", "status", "closed", "purpose", "funded_date",
+    )
+    now = timezone.now()
+    for lender_id, amount, interest_rate, paid_amount, status, closed, purpose, funded_date in loans.iterator(
+        chunk_size=2000
+    ):
+        row = stats.setdefault(lender_id, LenderStats(lender_id=lender_id, updated_at=now))
+        row.loan_count += 1
+        row.active_count += status == "Active" and not closed
+        row.total_invested += amount
+        row.expected_earnings += amount * (interest_rate / 100)
+        row.total_paid += paid_amount
+        purposes[lender_id, purpose][0] += 1
+        purposes[lender_id, purpose][1] += amount
+        if funded_date is not None:
+            if timezone.is_aware(funded_date):
+                funded_date = timezone.localtime(funded_date)
+            days[lender_id, funded_date.date()] += amount
+
+    LenderStats.objects.bulk_create(stats.values(), batch_size=1000)
+    LenderPurposeStats.objects.bulk_create(
+        [
+            LenderPurposeStats(lender_id=lender_id, purpose=purpose, loan_count=count, total_amount=total)
+            for (lender_id, purpose), (count, total) in purposes.items()
+        ],
+        batch_size=1000,
+    )
+    LenderDailyStats.objects.bulk_create(
+        [LenderDailyStats(lender_id=lender_id, day=day, invested=total) for (lender_id, day), total in days.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0022_installment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LenderStats',
+            fields=[
+                ('lender', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='lender_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('loan_count', models.PositiveIntegerField(default=0)),
+                ('active_count', models.IntegerField(default=0)),
+                ('total_invested', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('expected_earnings', models.DecimalField(decimal_places=6, default=Decimal('0'), max_digits=18)),
+                ('total_paid', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='LenderDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('invested', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('lender', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lender_daily_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('lender', 'day'), name='lender_daily_stats_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LenderPurposeStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('purpose', models.CharField(max_length=100)),
+                ('loan_count', models.PositiveIntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('lender', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lender_purpose_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['lender', '-total_amount'], name='lender_purpose_amount_idx')],
+                'constraints': [models.UniqueConstraint(fields=('lender', 'purpose'), name='lender_purpose_stats_uniq')],
+            },
+        ),
+        migrations.RunPython(fill_lender_stats, migrations.RunPython.noop),
+    ]
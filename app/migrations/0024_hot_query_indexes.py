@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0023_lender_stats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['lender', 'status', 'closed', 'funded_date'], name='loan_lender_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['lender', 'funded_date'], name='loan_lender_funded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['user', 'created_at'], name='loan_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['user', 'status', 'closed', 'funded_date'], name='loan_user_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loanapplication',
+            index=models.Index(fields=['status', 'created_at'], name='application_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loanpayment',
+            index=models.Index(fields=['user', 'created_at'], name='payment_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loanpayment',
+            index=models.Index(fields=['loan', 'created_at'], name='payment_loan_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'role', 'read', 'created_at'], name='notification_inbox_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(condition=models.Q(('read', False)), fields=['user', 'role'], name='notification_unread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['lender', 'timestamp'], name='transaction_lender_time_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0024_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'role', 'created_at'], name='notification_list_idx'),
+        ),
+    ]
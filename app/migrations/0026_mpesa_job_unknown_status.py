@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0025_notification_list_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mpesapaymentjob',
+            name='status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('processing', 'Processing'), ('sent', 'Sent'), ('unknown', 'Outcome unknown'), ('failed', 'Failed')], default='queued', max_length=20),
+        ),
+    ]
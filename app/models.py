@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import F, Q, Value
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
 from decimal import Decimal, ROUND_HALF_UP
@@ -27,6 +28,15 @@ class Notification(models.Model):
     read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "role", "read", "created_at"], name="notification_inbox_idx"),
+            # The paginated inbox, read and unread together, newest first
+            models.Index(fields=["user", "role", "created_at"], name="notification_list_idx"),
+            # Unread badge counts; skipped on MySQL, where notification_inbox_idx serves them
+            models.Index(fields=["user", "role"], condition=Q(read=False), name="notification_unread_idx"),
+        ]
+
     def __str__(self):
         return self.message
 
@@ -41,6 +51,11 @@ class Transaction(models.Model):
     type = models.CharField(max_length=20) # deposit, funding
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["lender", "timestamp"], name="transaction_lender_time_idx"),
+        ]
+
 # LOAN_STATUS = (
 #     ('pending', 'Pending'),
 #     ('approved', 'Approved'),
@@ -78,9 +93,23 @@ class LoanApplication(models.Model):
     )
     created_at = models.DateTimeField(default=timezone.now)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "created_at"], name="application_status_idx"),
+        ]
+
     def __str__(self):
         return f"Application #{self.pk} - {self.user} - {self.purpose} - {self.duration}- {self.monthly_income} - {self.employment_status} - {self.description} - {self.status}"
 
+def interest_due():
+    """
+    Loan.interest as a database expression. Multiplies by 0.01 instead of
+    dividing by 100: SQLite keeps whole-number decimals as integers, and
+    amount * rate / 100 would be truncated to whole units there.
+    """
+    return F("amount") * F("interest_rate") * Value(Decimal("0.01"))
+
+
 class Loan(models.Model):
     LOAN_STATUS = (
         ("Active", "Active"),  # MUST MATCH EXACTLY
@@ -118,6 +147,12 @@ class Loan(models.Model):
 
     class Meta:
         ordering = ['-funded_date']
+        indexes = [
+            models.Index(fields=["lender", "status", "closed", "funded_date"], name="loan_lender_status_idx"),
+            models.Index(fields=["lender", "funded_date"], name="loan_lender_funded_idx"),
+            models.Index(fields=["user", "created_at"], name="loan_user_created_idx"),
+            models.Index(fields=["user", "status", "closed", "funded_date"], name="loan_user_status_idx"),
+        ]
 
     def __str__(self):
         return f"Loan #{self.pk} - {self.user.username} - ${self.amount}"
@@ -158,8 +193,20 @@ class Loan(models.Model):
 
     @property
     def next_payment(self):
-        # TODO: implement logic to calculate next payment date if needed
-        return "N/A"
+        """
+        Due date of the first unpaid installment, or None when the loan is
+        closed, has no schedule or it is fully paid. Uses
+        `unpaid_installments` when the caller prefetched it (see
+        schedule.prefetch_unpaid).
+        """
+        if self.closed:
+            return None
+        if hasattr(self, "unpaid_installments"):
+            return self.unpaid_installments[0].due_date if self.unpaid_installments else None
+        return (
+            self.installments.filter(paid_at__isnull=True)
+            .order_by("number").values_list("due_date", flat=True).first()
+        )
 
 
 class LoanPayment(models.Model):
@@ -169,6 +216,13 @@ class LoanPayment(models.Model):
     payment_method = models.CharField(max_length=50)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "created_at"], name="payment_user_created_idx"),
+            # Repayments of a lender's loans: joined from Loan(lender), newest first per loan
+            models.Index(fields=["loan", "created_at"], name="payment_loan_created_idx"),
+        ]
+
     def __str__(self):
         return f"Payment {self.amount} for Loan {self.loan.id}"
 
@@ -180,4 +234,270 @@ class ContactMessage(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"{self.name} - {self.subject}"
\ No newline at end of file
+        return f"{self.name} - {self.subject}"
+
+class MpesaPaymentJob(models.Model):
+    """
+    Outbound "STK push requested" job, written by repay_loan and
+    processed by `manage.py mpesa_worker`.
+    """
+    JOB_STATUS = (
+        ("queued", "Queued"),
+        ("processing", "Processing"),
+        ("sent", "Sent"),
+        ("unknown", "Outcome unknown"),  # request went out but no answer came back; never resent
+        ("failed", "Failed"),
+    )
+
+    loan = models.ForeignKey(Loan, on_delete=models.CASCADE, related_name="mpesa_jobs")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="mpesa_jobs")
+    phone = models.CharField(max_length=20)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    status = models.CharField(max_length=20, choices=JOB_STATUS, default="queued")
+    attempts = models.PositiveIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)  # next time a worker may pick it up
+    locked_until = models.DateTimeField(null=True, blank=True)  # lease held by the worker processing it
+    checkout_request_id = models.CharField(max_length=100, blank=True)
+    merchant_request_id = models.CharField(max_length=100, blank=True)
+    correlation_id = models.CharField(max_length=32, blank=True)  # ties log lines of one payment together
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "run_after"], name="mpesa_job_status_run_idx"),
+        ]
+
+    def __str__(self):
+        return f"STK job #{self.pk} - Loan {self.loan_id} - {self.status}"
+
+
+class PendingCheckout(models.Model):
+    """
+    An STK push Daraja accepted but whose result we have not seen yet.
+    Closed by the callback or, if that never arrives, by `manage.py mpesa_reconcile`.
+    """
+    CHECKOUT_STATUS = (
+        ("pending", "Pending"),
+        ("completed", "Completed"),
+        ("failed", "Failed"),
+        ("expired", "Expired"),
+    )
+
+    checkout_request_id = models.CharField(max_length=100, primary_key=True)
+    merchant_request_id = models.CharField(max_length=100, blank=True)
+    loan = models.ForeignKey(Loan, on_delete=models.CASCADE, related_name="pending_checkouts")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="pending_checkouts")
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    phone = models.CharField(max_length=20)
+    correlation_id = models.CharField(max_length=32, blank=True)
+    status = models.CharField(max_length=20, choices=CHECKOUT_STATUS, default="pending")
+    result_code = models.CharField(max_length=20, blank=True)
+    result_desc = models.CharField(max_length=255, blank=True)
+    poll_count = models.PositiveIntegerField(default=0)
+    next_poll_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    resolved_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "next_poll_at"], name="checkout_status_poll_idx"),
+        ]
+
+    def __str__(self):
+        return f"Checkout {self.checkout_request_id} - Loan {self.loan_id} - {self.status}"
+
+
+class MpesaReceipt(models.Model):
+    """
+    One row per confirmed M-Pesa payment. The receipt number and checkout ID
+    are unique, so a callback delivered twice (Safaricom retry, proxy replay,
+    or two deliveries racing) can only ever be credited once.
+    """
+    receipt_number = models.CharField(max_length=30, unique=True, null=True, blank=True)
+    checkout_request_id = models.CharField(max_length=100, unique=True)
+    loan = models.ForeignKey(Loan, on_delete=models.CASCADE, related_name="mpesa_receipts")
+    payment = models.OneToOneField(
+        LoanPayment, on_delete=models.SET_NULL, null=True, blank=True, related_name="mpesa_receipt"
+    )
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    phone = models.CharField(max_length=20, blank=True)
+    transaction_date = models.CharField(max_length=14, blank=True)  # YYYYMMDDHHMMSS as sent by Daraja
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Receipt {self.receipt_number} - Loan {self.loan_id} - {self.amount}"
+
+
+class CallbackInbox(models.Model):
+    """
+    Raw STK callback bodies exactly as Safaricom posted them. mpesa_stk_callback
+    only appends here and acknowledges; `manage.py mpesa_callbacks` drains the
+    inbox in batches and credits the payments.
+    """
+    INBOX_STATUS = (
+        ("received", "Received"),
+        ("processed", "Processed"),
+        ("duplicate", "Duplicate"),
+        ("ignored", "Ignored"),
+        ("error", "Error"),
+    )
+
+    body = models.TextField()
+    status = models.CharField(max_length=20, choices=INBOX_STATUS, default="received")
+    error = models.CharField(max_length=255, blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "id"], name="callback_inbox_status_idx"),
+        ]
+
+    def __str__(self):
+        return f"Callback #{self.pk} - {self.status}"
+
+
+class LedgerAccount(models.Model):
+    """
+    An account in the double-entry journal (see app/ledger.py).
+    `balance` is the sum of the account's postings, kept up to date in the
+    same transaction as each posting so reading it is a single row lookup.
+    """
+    ACCOUNT_KINDS = (
+        ("wallet", "Lender wallet"),
+        ("loan", "Loan receivable"),
+        ("external", "External"),
+        ("income", "Income"),
+    )
+
+    name = models.CharField(max_length=50, unique=True)  # e.g. "wallet:12", "loan:7", "external:deposits"
+    kind = models.CharField(max_length=20, choices=ACCOUNT_KINDS)
+    user = models.ForeignKey(User, on_delete=models.PROTECT, null=True, blank=True, related_name="ledger_accounts")
+    loan = models.OneToOneField(Loan, on_delete=models.PROTECT, null=True, blank=True, related_name="ledger_account")
+    balance = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.balance}"
+
+
+class LedgerTransfer(models.Model):
+    """One money movement. Its postings always sum to zero; never updated or deleted."""
+    TRANSFER_KINDS = (
+        ("opening", "Opening balance"),
+        ("deposit", "Wallet deposit"),
+        ("loan_funding", "Loan funding"),
+        ("repayment", "Loan repayment"),
+    )
+
+    kind = models.CharField(max_length=20, choices=TRANSFER_KINDS)
+    description = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Transfer #{self.pk} - {self.kind}"
+
+
+class LedgerPosting(models.Model):
+    """One leg of a transfer: a signed amount added to an account's balance."""
+    transfer = models.ForeignKey(LedgerTransfer, on_delete=models.PROTECT, related_name="postings")
+    account = models.ForeignKey(LedgerAccount, on_delete=models.PROTECT, related_name="postings")
+    amount = models.DecimalField(max_digits=14, decimal_places=2)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["account", "id"], name="ledger_posting_account_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.account_id}: {self.amount}"
+
+
+class Installment(models.Model):
+    """
+    One row of a loan's amortization schedule (see app/schedule.py), built
+    when the loan is funded. `cumulative_due` is what the borrower must have
+    paid in total to cover this installment, so settling installments after
+    a payment is a single UPDATE against the loan's paid_amount.
+    """
+    loan = models.ForeignKey(Loan, on_delete=models.CASCADE, related_name="installments")
+    number = models.PositiveSmallIntegerField()  # 1-based
+    due_date = models.DateField()
+    amount = models.DecimalField(max_digits=12, decimal_places=2)  # principal + interest
+    principal = models.DecimalField(max_digits=12, decimal_places=2)
+    interest = models.DecimalField(max_digits=12, decimal_places=2)
+    remaining_balance = models.DecimalField(max_digits=12, decimal_places=2)  # principal left after this one
+    cumulative_due = models.DecimalField(max_digits=12, decimal_places=2)
+    paid_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["loan", "number"]
+        constraints = [
+            models.UniqueConstraint(fields=["loan", "number"], name="installment_loan_number_uniq"),
+        ]
+        indexes = [
+            # "What is due between these dates" across all loans is a range scan
+            models.Index(fields=["due_date", "paid_at"], name="installment_due_idx"),
+        ]
+
+    def __str__(self):
+        return f"Loan {self.loan_id} installment {self.number} due {self.due_date}"
+
+
+class LenderStats(models.Model):
+    """
+    Running totals behind the lender dashboard, kept up to date by
+    app/lender_stats.py when a loan is funded, paid or closed, so the
+    dashboard reads one row instead of aggregating every funded loan.
+    `manage.py rebuild_lender_stats` recomputes them from the loans.
+    """
+    lender = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name="lender_stats")
+    loan_count = models.PositiveIntegerField(default=0)
+    active_count = models.IntegerField(default=0)  # status Active and not closed
+    total_invested = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+    expected_earnings = models.DecimalField(max_digits=18, decimal_places=6, default=Decimal("0"))  # sum of Loan.interest
+    total_paid = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    @property
+    def actual_earnings(self):
+        return max(self.total_paid - self.total_invested, Decimal("0.00"))
+
+    def __str__(self):
+        return f"Stats for lender {self.lender_id}"
+
+
+class LenderPurposeStats(models.Model):
+    """Per-purpose breakdown of a lender's funded loans (the dashboard's portfolio overview)."""
+    lender = models.ForeignKey(User, on_delete=models.CASCADE, related_name="lender_purpose_stats")
+    purpose = models.CharField(max_length=100)
+    loan_count = models.PositiveIntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["lender", "purpose"], name="lender_purpose_stats_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["lender", "-total_amount"], name="lender_purpose_amount_idx"),
+        ]
+
+    def __str__(self):
+        return f"Lender {self.lender_id} - {self.purpose}: {self.total_amount}"
+
+
+class LenderDailyStats(models.Model):
+    """Amount a lender funded per day, so N-day windows are a short range scan."""
+    lender = models.ForeignKey(User, on_delete=models.CASCADE, related_name="lender_daily_stats")
+    day = models.DateField()
+    invested = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal("0.00"))
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["lender", "day"], name="lender_daily_stats_uniq"),
+        ]
+
+    def __str__(self):
+        return f"Lender {self.lender_id} - {self.day}: {self.invested}"
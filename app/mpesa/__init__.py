@@ -3,12 +3,26 @@
 # This file makes the mpesa directory a Python package
 # It can be empty or contain imports for convenience
 
-from .stk_push import lipa_na_mpesa_stk_push
-from .utils import get_mpesa_access_token, generate_stk_password, generate_timestamp
+from .auth import get_mpesa_access_token, token_manager
+from .client import DarajaClient, get_daraja_client
+from .async_client import AsyncDarajaClient, alipa_na_mpesa_stk_push
+from .ratelimit import StkPushDispatcher, dispatcher
+from .breaker import CircuitBreaker, CircuitOpenError, get_breaker
+from .utils import generate_stk_password, generate_timestamp, normalize_phone_number
 
 __all__ = [
-    'lipa_na_mpesa_stk_push',
     'get_mpesa_access_token',
+    'token_manager',
+    'DarajaClient',
+    'get_daraja_client',
+    'AsyncDarajaClient',
+    'alipa_na_mpesa_stk_push',
+    'StkPushDispatcher',
+    'dispatcher',
+    'CircuitBreaker',
+    'CircuitOpenError',
+    'get_breaker',
     'generate_stk_password',
     'generate_timestamp',
+    'normalize_phone_number',
 ]
\ No newline at end of file
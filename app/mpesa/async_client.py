@@ -0,0 +1,169 @@
+# app/mpesa/async_client.py
+
+import asyncio
+import random
+import weakref
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from app.mpesa.auth import token_manager
+from app.mpesa.breaker import CircuitOpenError, get_breaker
+from app.mpesa.ratelimit import dispatcher
+from app.mpesa.client import RETRY_STATUSES, bearer_headers, get_daraja_client, is_outage
+from app.mpesa.utils import normalize_phone_number
+
+
+class AsyncDarajaClient:
+    """
+    asyncio counterpart of DarajaClient for mpesa_worker and mpesa_reconcile.
+
+    Shares DarajaConfig (URLs, credentials, timeouts, retry policy) with the
+    sync client, but sends requests over a pooled httpx.AsyncClient so one
+    worker can keep many STK pushes in flight while Daraja is slow.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or get_daraja_client().config
+        pool_size = getattr(settings, "MPESA_ASYNC_POOL_SIZE", 100)
+        self.http = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+            ),
+        )
+
+    async def request(self, endpoint, method, url, retries=None, **kwargs):
+        """
+        Send a request with the endpoint's timeouts, retrying 5xx responses
+        (up to `retries` times, defaulting to MPESA_HTTP_RETRIES).
+        Raises CircuitOpenError while the endpoint's circuit breaker is open.
+        """
+        breaker = get_breaker(endpoint)
+        ticket = await sync_to_async(breaker.before_call, thread_sensitive=False)()
+        try:
+            response = await self._send(endpoint, method, url, retries, **kwargs)
+        except httpx.TransportError:
+            await sync_to_async(breaker.record_failure, thread_sensitive=False)(ticket)
+            raise
+
+        if is_outage(endpoint, response.status_code):
+            await sync_to_async(breaker.record_failure, thread_sensitive=False)(ticket)
+        else:
+            await sync_to_async(breaker.record_success, thread_sensitive=False)(ticket)
+        return response
+
+    async def _send(self, endpoint, method, url, retries, **kwargs):
+        connect, read = self.config.timeouts[endpoint]
+        kwargs.setdefault("timeout", httpx.Timeout(read, connect=connect))
+
+        if retries is None:
+            retries = self.config.retries
+
+        for attempt in range(retries + 1):
+            response = await self.http.request(method, url, **kwargs)
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+            delay = self.config.retry_backoff * (2 ** attempt)
+            await asyncio.sleep(delay + random.uniform(0, delay))
+
+        return response
+
+    async def stk_push(self, access_token, payload):
+        # Never resent: a 5xx may come after Daraja already prompted the customer
+        return await self.request(
+            "stk_push", "POST", self.config.stk_push_url, retries=0,
+            json=payload, headers=bearer_headers(access_token),
+        )
+
+    async def stk_query(self, access_token, checkout_request_id):
+        # No 5xx retries: Daraja answers "still processing" with HTTP 500,
+        # and the reconciler reschedules those itself
+        return await self.request(
+            "stk_query", "POST", self.config.stk_query_url, retries=0,
+            json=get_daraja_client().build_stk_query_payload(checkout_request_id),
+            headers=bearer_headers(access_token),
+        )
+
+    async def aclose(self):
+        await self.http.aclose()
+
+
+# Transport errors raised before the request reached Daraja, so safe to resend
+_NOT_SENT = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+# httpx connection pools are bound to the event loop that created them
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_daraja_client():
+    """
+    Return the AsyncDarajaClient for the running event loop
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = AsyncDarajaClient()
+    return client
+
+
+async def alipa_na_mpesa_stk_push(phone, amount, account_reference, description):
+    """
+    Initiate M-Pesa STK Push without blocking the event loop.
+    Returns Daraja's response dict (ResponseCode "0" when accepted) or
+    {"ResponseCode": "1", "errorMessage": ...}. Failures where the request
+    never reached Daraja or was turned away (connect errors, 401, 429) carry
+    "retryable": True, and an open circuit breaker also sets "retry_after"
+    (seconds). Once the request is out, a read timeout or a 5xx leaves the
+    push's outcome unknown: those carry "unknown": True and must not be
+    resent, or the customer may get a second prompt.
+    """
+    try:
+        phone = normalize_phone_number(phone)
+    except ValueError as e:
+        return {"ResponseCode": "1", "errorMessage": str(e)}
+
+    try:
+        access_token = await token_manager.aget_token()
+    except CircuitOpenError as e:
+        return {"ResponseCode": "1", "errorMessage": str(e), "retryable": True, "retry_after": e.retry_after}
+    if not access_token:
+        return {"ResponseCode": "1", "errorMessage": "Failed to generate access token", "retryable": True}
+
+    client = get_async_daraja_client()
+    payload = get_daraja_client().build_stk_payload(phone, amount, account_reference, description)
+
+    # Queue behind the per-shortcode token bucket instead of drawing HTTP 429s
+    await dispatcher.aacquire(client.config.shortcode)
+
+    try:
+        response = await client.stk_push(access_token, payload)
+        response.raise_for_status()
+        return response.json()
+
+    except CircuitOpenError as e:
+        # Fail fast instead of waiting out the timeout against a degraded Daraja
+        return {"ResponseCode": "1", "errorMessage": str(e), "retryable": True, "retry_after": e.retry_after}
+
+    except httpx.HTTPStatusError:
+        if response.status_code == 401:
+            # Token was revoked or expired early; force a refresh next time
+            await sync_to_async(token_manager.invalidate)()
+        failure = {"ResponseCode": "1", "errorMessage": f"HTTP {response.status_code}: {response.text}"}
+        if response.status_code >= 500:
+            failure["unknown"] = True
+        elif response.status_code in (401, 429):
+            failure["retryable"] = True
+        return failure
+
+    except _NOT_SENT as e:
+        return {"ResponseCode": "1", "errorMessage": str(e) or type(e).__name__, "retryable": True}
+
+    except httpx.HTTPError as e:
+        # Read/write timeouts, dropped connections: Daraja may have taken it
+        return {"ResponseCode": "1", "errorMessage": str(e) or type(e).__name__, "unknown": True}
+
+    except ValueError as e:
+        # Body was not valid JSON
+        return {"ResponseCode": "1", "errorMessage": str(e)}
@@ -0,0 +1,189 @@
+# app/mpesa/auth.py
+
+import logging
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from app.mpesa.breaker import CircuitOpenError
+from app.mpesa.client import get_daraja_client
+
+logger = logging.getLogger(__name__)
+
+
+def fetch_access_token():
+    """
+    Call the Daraja OAuth endpoint once through the pooled client.
+    Returns (token, expires_in_seconds) or raises on failure.
+    """
+    return get_daraja_client().fetch_access_token()
+
+
+class AccessTokenManager:
+    """
+    Caches the Daraja access token until shortly before it expires.
+
+    The token lives in Django's cache so every gunicorn worker shares it,
+    and a short-lived cache lock makes sure only one caller refreshes it.
+    Each process also keeps its own copy so a hit costs no cache round-trip.
+
+    Hits, misses and refreshes are counted in the cache across all
+    processes, see stats() and `manage.py mpesa_token`. Hits on the process
+    copy are published in batches of HIT_BATCH, or when the process next
+    goes to the cache.
+    """
+
+    CACHE_KEY = "mpesa:access_token"
+    LOCK_KEY = "mpesa:access_token:lock"
+    HITS_KEY = "mpesa:access_token:hits"
+    MISSES_KEY = "mpesa:access_token:misses"
+    REFRESHES_KEY = "mpesa:access_token:refreshes"
+    HIT_BATCH = 100
+
+    def __init__(self, fetch=fetch_access_token, refresh_margin=None, lock_timeout=15):
+        self.fetch = fetch
+        if refresh_margin is None:
+            refresh_margin = getattr(settings, "MPESA_TOKEN_REFRESH_MARGIN", 120)
+        self.refresh_margin = refresh_margin
+        self.lock_timeout = lock_timeout
+
+        self._local_lock = threading.Lock()
+        self._token = None
+        self._expires_at = 0.0
+        self._local_hits = 0
+
+    def get_token(self):
+        """
+        Return a valid access token, refreshing it at most once across all workers.
+        Returns None if a token could not be obtained, and raises
+        CircuitOpenError while the OAuth circuit breaker is open.
+        """
+        token = self._local_token()
+        if token:
+            self._local_hits += 1
+            if self._local_hits >= self.HIT_BATCH:
+                self._publish_hits()
+            return token
+
+        with self._local_lock:
+            self._publish_hits()
+            # Another thread may have refreshed while we waited for the lock
+            token = self._local_token()
+            if token:
+                return token
+            token = self._shared_token()
+            if token:
+                _incr(self.HITS_KEY)
+                return token
+
+            _incr(self.MISSES_KEY)
+            return self._refresh()
+
+    async def aget_token(self):
+        """
+        Async variant of get_token. A process-local hit never leaves the event
+        loop; only a cache lookup or refresh is handed to a worker thread.
+        """
+        token = self._local_token()
+        if token:
+            # Published by the next get_token, off the event loop
+            self._local_hits += 1
+            return token
+        return await sync_to_async(self.get_token, thread_sensitive=False)()
+
+    def invalidate(self):
+        """Drop the cached token, e.g. after Daraja rejects it with a 401."""
+        with self._local_lock:
+            self._token = None
+            self._expires_at = 0.0
+            cache.delete(self.CACHE_KEY)
+
+    def stats(self):
+        """Counters across every process, and seconds until the shared token is refreshed."""
+        values = cache.get_many([self.CACHE_KEY, self.HITS_KEY, self.MISSES_KEY, self.REFRESHES_KEY])
+        cached = values.get(self.CACHE_KEY)
+        return {
+            "hits": values.get(self.HITS_KEY, 0),
+            "misses": values.get(self.MISSES_KEY, 0),
+            "refreshes": values.get(self.REFRESHES_KEY, 0),
+            "expires_in": max(cached[1] - time.time(), 0) if cached else None,
+        }
+
+    def _publish_hits(self):
+        hits, self._local_hits = self._local_hits, 0
+        if hits:
+            _incr(self.HITS_KEY, hits)
+
+    def _local_token(self):
+        if self._token and time.time() < self._expires_at:
+            return self._token
+        return None
+
+    def _shared_token(self):
+        cached = cache.get(self.CACHE_KEY)
+        if not cached:
+            return None
+        token, expires_at = cached
+        if time.time() >= expires_at:
+            return None
+        self._token, self._expires_at = token, expires_at
+        return token
+
+    def _refresh(self):
+        # cache.add is atomic on the shared backends, so it doubles as a lock
+        if not cache.add(self.LOCK_KEY, True, timeout=self.lock_timeout):
+            return self._wait_for_refresh()
+
+        try:
+            token, expires_in = self.fetch()
+            _incr(self.REFRESHES_KEY)
+            ttl = max(expires_in - self.refresh_margin, 1)
+            expires_at = time.time() + ttl
+            # Publish before releasing the lock so waiters never see a gap
+            cache.set(self.CACHE_KEY, (token, expires_at), timeout=ttl)
+        except CircuitOpenError:
+            # The OAuth endpoint is down; let callers fail fast with a clear message
+            raise
+        except Exception as e:
+            logger.error("Failed to generate M-Pesa access token: %s", e)
+            return None
+        finally:
+            cache.delete(self.LOCK_KEY)
+
+        self._token, self._expires_at = token, expires_at
+        return token
+
+    def _wait_for_refresh(self):
+        # Another worker holds the lock; wait for it to publish the token
+        deadline = time.time() + self.lock_timeout
+        while time.time() < deadline:
+            time.sleep(0.1)
+            token = self._shared_token()
+            if token:
+                return token
+            if not cache.get(self.LOCK_KEY):
+                # The refresh finished without publishing a token (it failed)
+                return None
+        return None
+
+
+def _incr(key, delta=1):
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # Evicted between add and incr
+        cache.add(key, delta, timeout=None)
+
+
+token_manager = AccessTokenManager()
+
+
+def get_mpesa_access_token():
+    """
+    Return a cached M-Pesa access token, refreshing it only when it is about to expire
+    """
+    return token_manager.get_token()
@@ -0,0 +1,155 @@
+# app/mpesa/breaker.py
+
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+UNAVAILABLE_MESSAGE = "M-Pesa is temporarily unavailable. Please try again shortly."
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling Daraja while its circuit breaker is open."""
+
+    def __init__(self, name, retry_after):
+        super().__init__(UNAVAILABLE_MESSAGE)
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker shared by every process through Django's cache.
+
+    closed     calls go through; `failure_threshold` failures within `window`
+               seconds open the breaker
+    open       calls fail immediately with CircuitOpenError for `reset_timeout`
+               seconds instead of waiting out Daraja's timeouts
+    half-open  a single probe call is let through (cache.add picks the one
+               caller); success closes the breaker, failure re-opens it
+
+    Trips and recoveries are logged as WARNING events and counted in the
+    cache, see stats().
+    """
+
+    def __init__(self, name, failure_threshold=None, window=None, reset_timeout=None, probe_timeout=60):
+        self.name = name
+        self.failure_threshold = failure_threshold or getattr(settings, "MPESA_BREAKER_FAILURE_THRESHOLD", 5)
+        self.window = window or getattr(settings, "MPESA_BREAKER_WINDOW", 60)
+        self.reset_timeout = reset_timeout or getattr(settings, "MPESA_BREAKER_RESET_TIMEOUT", 30)
+        self.probe_timeout = probe_timeout
+
+        prefix = f"mpesa:breaker:{name}"
+        self.open_key = f"{prefix}:open_until"
+        self.failures_key = f"{prefix}:failures"
+        self.probe_key = f"{prefix}:probe"
+        self.trips_key = f"{prefix}:trips"
+        self.recoveries_key = f"{prefix}:recoveries"
+        self.opened_at_key = f"{prefix}:opened_at"
+
+    def before_call(self):
+        """
+        Check the breaker before a call. Raises CircuitOpenError while open;
+        otherwise returns a ticket to hand to record_success/record_failure.
+        """
+        state = cache.get_many([self.open_key, self.failures_key])
+        open_until = state.get(self.open_key)
+        failures = state.get(self.failures_key, 0)
+
+        if open_until is None:
+            return {"probe": False, "failures": failures}
+
+        now = time.time()
+        if now < open_until:
+            raise CircuitOpenError(self.name, open_until - now)
+
+        # Half-open: only the caller that wins the add sends the probe
+        if not cache.add(self.probe_key, True, timeout=self.probe_timeout):
+            raise CircuitOpenError(self.name, self.reset_timeout)
+        logger.info("Circuit breaker %s half-open, sending probe", self.name)
+        return {"probe": True, "failures": failures}
+
+    def record_success(self, ticket):
+        if ticket["probe"]:
+            cache.delete_many([self.open_key, self.failures_key, self.probe_key])
+            self._incr(self.recoveries_key)
+            logger.warning(
+                "Circuit breaker %s closed: probe succeeded", self.name,
+                extra={"breaker": self.name, "event": "recovered"},
+            )
+        elif ticket["failures"]:
+            # Failures must be consecutive to trip the breaker
+            cache.delete(self.failures_key)
+
+    def record_failure(self, ticket):
+        now = time.time()
+        if ticket["probe"]:
+            cache.set(self.open_key, now + self.reset_timeout, timeout=None)
+            cache.delete(self.probe_key)
+            logger.warning(
+                "Circuit breaker %s re-opened: probe failed", self.name,
+                extra={"breaker": self.name, "event": "probe_failed", "retry_after": self.reset_timeout},
+            )
+            return
+
+        failures = self._incr(self.failures_key, timeout=self.window)
+        # cache.add makes sure only one process records the trip
+        if failures >= self.failure_threshold and cache.add(
+            self.open_key, now + self.reset_timeout, timeout=None
+        ):
+            self._incr(self.trips_key)
+            cache.set(self.opened_at_key, now, timeout=None)
+            logger.warning(
+                "Circuit breaker %s opened after %s consecutive failures", self.name, failures,
+                extra={"breaker": self.name, "event": "opened", "failures": failures,
+                       "retry_after": self.reset_timeout},
+            )
+
+    def state(self):
+        open_until = cache.get(self.open_key)
+        if open_until is None:
+            return "closed"
+        return "open" if time.time() < open_until else "half-open"
+
+    def reset(self):
+        """Close the breaker by hand, e.g. once Safaricom confirms an outage is over."""
+        cache.delete_many([self.open_key, self.failures_key, self.probe_key])
+
+    def stats(self):
+        values = cache.get_many([self.failures_key, self.trips_key, self.recoveries_key, self.opened_at_key])
+        return {
+            "state": self.state(),
+            "failures": values.get(self.failures_key, 0),
+            "trips": values.get(self.trips_key, 0),
+            "recoveries": values.get(self.recoveries_key, 0),
+            "last_opened_at": values.get(self.opened_at_key),
+        }
+
+    def _incr(self, key, timeout=None):
+        cache.add(key, 0, timeout=timeout)
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # Expired between add and incr
+            cache.add(key, 1, timeout=timeout)
+            return 1
+
+
+# One breaker per Daraja endpoint, so a broken query API does not block pushes
+breakers = {
+    "oauth": CircuitBreaker("oauth"),
+    "stk_push": CircuitBreaker("stk_push"),
+    "stk_query": CircuitBreaker("stk_query"),
+}
+
+
+def get_breaker(endpoint):
+    return breakers[endpoint]
+
+
+def daraja_unavailable():
+    """True while the OAuth or STK push breaker is open (a half-open probe may still go out)."""
+    return any(breakers[name].state() == "open" for name in ("oauth", "stk_push"))
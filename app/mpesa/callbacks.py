@@ -0,0 +1,192 @@
+# app/mpesa/callbacks.py
+
+import json
+import logging
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from app.models import MpesaReceipt, PendingCheckout
+from app.payments import apply_payment
+
+logger = logging.getLogger(__name__)
+
+# Checkouts a callback may still settle
+OPEN_CHECKOUT_STATUSES = ("pending", "expired")
+
+# CallbackMetadata.Item Name -> StkCallback attribute
+_ITEM_FIELDS = {
+    "Amount": "amount",
+    "MpesaReceiptNumber": "receipt_number",
+    "PhoneNumber": "phone",
+    "TransactionDate": "transaction_date",
+}
+
+try:
+    # Optional: several times faster than json on callback-sized bodies
+    from orjson import loads as _loads
+except ImportError:
+    _loads = json.loads
+
+
+class CallbackError(ValueError):
+    """An STK callback body that cannot be processed."""
+
+
+class MalformedCallback(CallbackError):
+    """Not JSON, or not shaped like an STK callback."""
+
+
+class InvalidCallbackField(CallbackError):
+    """A field is missing or has a value of the wrong type."""
+
+
+class StkCallback:
+    """
+    The fields of an STK callback we act on. Successful callbacks always
+    carry amount and receipt_number; failed ones only the result.
+    """
+
+    __slots__ = (
+        "checkout_request_id",
+        "merchant_request_id",
+        "result_code",
+        "result_desc",
+        "amount",
+        "receipt_number",
+        "phone",
+        "transaction_date",
+    )
+
+    def __init__(self, checkout_request_id, merchant_request_id, result_code, result_desc,
+                 amount=None, receipt_number=None, phone="", transaction_date=""):
+        self.checkout_request_id = checkout_request_id
+        self.merchant_request_id = merchant_request_id
+        self.result_code = result_code
+        self.result_desc = result_desc
+        self.amount = amount
+        self.receipt_number = receipt_number
+        self.phone = phone
+        self.transaction_date = transaction_date
+
+    @property
+    def succeeded(self):
+        return self.result_code == 0
+
+    def __repr__(self):
+        return f"<StkCallback {self.checkout_request_id} result={self.result_code} receipt={self.receipt_number}>"
+
+
+def parse_stk_callback(raw):
+    """
+    Decode a raw STK callback body (bytes or str) into an StkCallback in one
+    pass over CallbackMetadata.Item. Raises MalformedCallback or
+    InvalidCallbackField.
+    """
+    try:
+        data = _loads(raw)
+    except ValueError as e:
+        raise MalformedCallback(f"Invalid JSON: {e}")
+
+    try:
+        stk_callback = data["Body"]["stkCallback"]
+        checkout_request_id = stk_callback["CheckoutRequestID"]
+        result_code = stk_callback["ResultCode"]
+    except (KeyError, TypeError):
+        raise MalformedCallback("Not an STK callback")
+
+    if not isinstance(checkout_request_id, str) or not checkout_request_id:
+        raise InvalidCallbackField("CheckoutRequestID must be a non-empty string")
+    try:
+        result_code = int(result_code)
+    except (TypeError, ValueError):
+        raise InvalidCallbackField(f"ResultCode {result_code!r} is not an integer")
+
+    callback = StkCallback(
+        checkout_request_id,
+        stk_callback.get("MerchantRequestID", ""),
+        result_code,
+        stk_callback.get("ResultDesc", "No description"),
+    )
+    if result_code != 0:
+        return callback
+
+    try:
+        items = stk_callback["CallbackMetadata"]["Item"]
+        for item in items:
+            field = _ITEM_FIELDS.get(item["Name"])
+            if field is not None:
+                setattr(callback, field, item.get("Value"))
+    except (KeyError, TypeError):
+        raise MalformedCallback("Successful callback without CallbackMetadata.Item")
+
+    if callback.amount is None or not callback.receipt_number:
+        raise InvalidCallbackField("Successful callback without Amount or MpesaReceiptNumber")
+    # float -> str -> Decimal keeps 5.0 as Decimal("5.0") instead of a binary fraction
+    if isinstance(callback.amount, bool) or not isinstance(callback.amount, (int, float, str)):
+        raise InvalidCallbackField(f"Amount {callback.amount!r} is not a number")
+    try:
+        callback.amount = Decimal(str(callback.amount))
+    except ArithmeticError:
+        raise InvalidCallbackField(f"Amount {callback.amount!r} is not a number")
+    if not callback.amount.is_finite() or callback.amount <= 0:
+        raise InvalidCallbackField(f"Amount {callback.amount} must be positive")
+
+    callback.receipt_number = str(callback.receipt_number)
+    callback.phone = "" if callback.phone is None else str(callback.phone)
+    callback.transaction_date = "" if callback.transaction_date is None else str(callback.transaction_date)
+    return callback
+
+
+def resolve_checkout(checkout_request_id, status, result_code="", result_desc=""):
+    """
+    Move a pending checkout to its final status.
+
+    Returns True only for the caller that actually closed it, so a callback
+    and the reconciler can never both credit the same payment. An expired
+    checkout can still be settled by a late callback.
+    """
+    return PendingCheckout.objects.filter(
+        checkout_request_id=checkout_request_id,
+        status__in=OPEN_CHECKOUT_STATUSES,
+    ).update(
+        status=status,
+        result_code=str(result_code),
+        result_desc=str(result_desc)[:255],
+        resolved_at=timezone.now(),
+    ) == 1
+
+
+def claim_receipt(loan, receipt_number, checkout_request_id, amount, phone="", transaction_date=""):
+    """
+    Insert the payment's MpesaReceipt, or return None if another delivery of
+    the same callback got there first. Call inside transaction.atomic(): a
+    concurrent duplicate blocks on the unique index until the first commits,
+    then fails here instead of crediting the loan again.
+    """
+    try:
+        # Savepoint, so a duplicate leaves the caller's transaction usable
+        with transaction.atomic():
+            return MpesaReceipt.objects.create(
+                receipt_number=receipt_number or None,
+                checkout_request_id=checkout_request_id,
+                loan=loan,
+                amount=amount,
+                phone=phone or "",
+                transaction_date=str(transaction_date or ""),
+            )
+    except IntegrityError:
+        return None
+
+
+def apply_stk_payment(loan, amount, receipt=None):
+    """
+    Credit a confirmed M-Pesa payment to its loan and record it.
+    Shared by mpesa_stk_callback and the STK query reconciler.
+    """
+    payment = apply_payment(loan, amount, "M-Pesa")
+    if receipt is not None:
+        receipt.payment = payment
+        receipt.save(update_fields=["payment"])
+    return payment
@@ -0,0 +1,222 @@
+# app/mpesa/client.py
+
+import base64
+import random
+import time
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from app.mpesa.breaker import get_breaker
+from app.mpesa.utils import generate_stk_password, generate_timestamp
+
+
+BASE_URLS = {
+    "sandbox": "https://sandbox.safaricom.co.ke",
+    "production": "https://api.safaricom.co.ke",
+}
+
+OAUTH_PATH = "/oauth/v1/generate?grant_type=client_credentials"
+STK_PUSH_PATH = "/mpesa/stkpush/v1/processrequest"
+STK_QUERY_PATH = "/mpesa/stkpushquery/v1/query"
+
+# (connect, read) timeouts in seconds per endpoint
+DEFAULT_TIMEOUTS = {
+    "oauth": (3.05, 10),
+    "stk_push": (3.05, 30),
+    "stk_query": (3.05, 15),
+}
+
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+def is_outage(endpoint, status_code):
+    """Whether a final response status counts against the endpoint's circuit breaker."""
+    if endpoint == "stk_query":
+        # Daraja answers "still processing" with HTTP 500
+        return status_code in (502, 503, 504)
+    return status_code in RETRY_STATUSES
+
+
+def bearer_headers(access_token):
+    return {
+        "Authorization": f"Bearer {access_token}",
+        "Content-Type": "application/json",
+    }
+
+
+class DarajaConfig:
+    """
+    M-Pesa environment settings, resolved once from Django settings
+    """
+
+    def __init__(self):
+        self.env = getattr(settings, "MPESA_ENV", "sandbox")
+
+        if self.env in ("sandbox", "simulator"):
+            # The local simulator (manage.py mpesa_simulator) accepts the sandbox credentials
+            self.base_url = BASE_URLS["sandbox"]
+            if self.env == "simulator":
+                self.base_url = getattr(settings, "MPESA_SIMULATOR_URL", "http://127.0.0.1:8900")
+            self.consumer_key = settings.MPESA_CONSUMER_KEY
+            self.consumer_secret = settings.MPESA_CONSUMER_SECRET
+            self.shortcode = getattr(settings, "MPESA_SHORTCODE", "174379")
+            self.passkey = settings.MPESA_PASSKEY
+        else:
+            self.base_url = BASE_URLS["production"]
+            self.consumer_key = settings.MPESA_CONSUMER_KEY_PROD
+            self.consumer_secret = settings.MPESA_CONSUMER_SECRET_PROD
+            self.shortcode = settings.MPESA_SHORTCODE_PROD
+            self.passkey = settings.MPESA_PASSKEY_PROD
+
+        self.callback_url = settings.MPESA_CALLBACK_URL
+        self.timeouts = {**DEFAULT_TIMEOUTS, **getattr(settings, "MPESA_TIMEOUTS", {})}
+        self.pool_size = getattr(settings, "MPESA_HTTP_POOL_SIZE", 10)
+        self.retries = getattr(settings, "MPESA_HTTP_RETRIES", 2)
+        self.retry_backoff = getattr(settings, "MPESA_HTTP_RETRY_BACKOFF", 0.5)
+
+    @property
+    def oauth_url(self):
+        return self.base_url + OAUTH_PATH
+
+    @property
+    def stk_push_url(self):
+        return self.base_url + STK_PUSH_PATH
+
+    @property
+    def stk_query_url(self):
+        return self.base_url + STK_QUERY_PATH
+
+
+class DarajaClient:
+    """
+    Thin Daraja API client over a pooled keep-alive session.
+
+    Connections to safaricom.co.ke are reused between calls, each endpoint
+    has its own connect/read timeout, and 5xx responses are retried with
+    exponential backoff plus jitter.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or DarajaConfig()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self.config.pool_size,
+            pool_maxsize=self.config.pool_size,
+        )
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, endpoint, method, url, retries=None, **kwargs):
+        """
+        Send a request with the endpoint's timeouts, retrying 5xx responses
+        (up to `retries` times, defaulting to MPESA_HTTP_RETRIES).
+        Network errors and the final response are returned/raised as-is.
+
+        Raises CircuitOpenError without touching the network while the
+        endpoint's circuit breaker is open.
+        """
+        breaker = get_breaker(endpoint)
+        ticket = breaker.before_call()
+        try:
+            response = self._send(endpoint, method, url, retries, **kwargs)
+        except requests.exceptions.RequestException:
+            breaker.record_failure(ticket)
+            raise
+
+        if is_outage(endpoint, response.status_code):
+            breaker.record_failure(ticket)
+        else:
+            breaker.record_success(ticket)
+        return response
+
+    def _send(self, endpoint, method, url, retries, **kwargs):
+        kwargs.setdefault("timeout", self.config.timeouts[endpoint])
+
+        if retries is None:
+            retries = self.config.retries
+
+        for attempt in range(retries + 1):
+            response = self.session.request(method, url, **kwargs)
+            if response.status_code not in RETRY_STATUSES or attempt == retries:
+                return response
+            delay = self.config.retry_backoff * (2 ** attempt)
+            time.sleep(delay + random.uniform(0, delay))
+
+        return response
+
+    def fetch_access_token(self):
+        """
+        Call the OAuth endpoint once.
+        Returns (token, expires_in_seconds) or raises on failure.
+        """
+        auth = base64.b64encode(
+            f"{self.config.consumer_key}:{self.config.consumer_secret}".encode()
+        ).decode()
+        headers = {"Authorization": f"Basic {auth}"}
+
+        response = self.request("oauth", "GET", self.config.oauth_url, headers=headers)
+        response.raise_for_status()
+        data = response.json()
+        token = data.get("access_token")
+        if not token:
+            raise ValueError("OAuth response did not contain an access_token")
+        # Daraja returns expires_in as a string ("3599")
+        return token, int(data.get("expires_in", 3599))
+
+    def build_stk_payload(self, phone, amount, account_reference, description):
+        timestamp = generate_timestamp()
+        return {
+            "BusinessShortCode": self.config.shortcode,
+            "Password": generate_stk_password(self.config.shortcode, self.config.passkey, timestamp),
+            "Timestamp": timestamp,
+            "TransactionType": "CustomerPayBillOnline",
+            "Amount": int(amount),
+            "PartyA": phone,
+            "PartyB": self.config.shortcode,
+            "PhoneNumber": phone,
+            "CallBackURL": self.config.callback_url,
+            "AccountReference": account_reference,
+            "TransactionDesc": description,
+        }
+
+    def build_stk_query_payload(self, checkout_request_id):
+        timestamp = generate_timestamp()
+        return {
+            "BusinessShortCode": self.config.shortcode,
+            "Password": generate_stk_password(self.config.shortcode, self.config.passkey, timestamp),
+            "Timestamp": timestamp,
+            "CheckoutRequestID": checkout_request_id,
+        }
+
+    def stk_push(self, access_token, payload):
+        """POST an STK push request and return the raw response."""
+        # Never resent: a 5xx may come after Daraja already prompted the customer
+        return self.request(
+            "stk_push", "POST", self.config.stk_push_url, retries=0,
+            json=payload, headers=bearer_headers(access_token),
+        )
+
+    def stk_query(self, access_token, checkout_request_id):
+        """POST an STK push status query and return the raw response."""
+        # No 5xx retries: Daraja answers "still processing" with HTTP 500
+        return self.request(
+            "stk_query", "POST", self.config.stk_query_url, retries=0,
+            json=self.build_stk_query_payload(checkout_request_id),
+            headers=bearer_headers(access_token),
+        )
+
+
+_client = None
+
+
+def get_daraja_client():
+    """
+    Return the process-wide DarajaClient, created on first use
+    """
+    global _client
+    if _client is None:
+        _client = DarajaClient()
+    return _client
@@ -0,0 +1,237 @@
+# app/mpesa/inbox.py
+#
+# Batch processing of the callback inbox filled by mpesa_stk_callback.
+# Run continuously with `python manage.py mpesa_callbacks`.
+
+import logging
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from app.models import CallbackInbox, Loan, MpesaReceipt, PendingCheckout
+from app.mpesa.callbacks import (
+    OPEN_CHECKOUT_STATUSES,
+    CallbackError,
+    apply_stk_payment,
+    claim_receipt,
+    parse_stk_callback,
+    resolve_checkout,
+)
+from app.mpesa.jobs import adopt_unknown_pushes
+from app.mpesa.log import correlation
+from app.mpesa.reconcile import SUCCESS_RESULT_CODE
+from app.payments import apply_payments
+
+logger = logging.getLogger(__name__)
+
+
+def drain_inbox(batch_size=500, ids=None):
+    """
+    Process up to batch_size received callbacks in one transaction and
+    return the inbox rows with their final status. With `ids`, only those
+    inbox rows are considered.
+
+    Rows are claimed with SELECT ... FOR UPDATE SKIP LOCKED, so several
+    drainers can run side by side without seeing the same callback. If the
+    batch fails as a whole, its rows are retried one savepoint each and the
+    ones that still fail are marked error, so a single bad callback cannot
+    hold back the rest of the inbox.
+    """
+    received = CallbackInbox.objects.filter(status="received")
+    if ids is not None:
+        received = received.filter(pk__in=ids)
+    with transaction.atomic():
+        rows = list(received.select_for_update(skip_locked=True).order_by("id")[:batch_size])
+        if not rows:
+            return rows
+
+        try:
+            with transaction.atomic():
+                process_callbacks(rows)
+        except Exception:
+            logger.exception("Batch of %s callbacks failed, processing them one by one", len(rows))
+            for row in rows:
+                _process_one(row)
+
+        # One UPDATE per outcome rather than bulk_update's per-row CASE,
+        # which costs more to build than the rest of the batch
+        outcomes = defaultdict(list)
+        for row in rows:
+            outcomes[row.status, row.error].append(row.pk)
+        now = timezone.now()
+        for (status, error), pks in outcomes.items():
+            CallbackInbox.objects.filter(pk__in=pks).update(status=status, error=error, processed_at=now)
+    return rows
+
+
+def process_callbacks(rows):
+    """Parse a batch of inbox rows, settle failures and credit the payments."""
+    credits = []
+    seen = set()
+
+    for row in rows:
+        row.status, row.error = "processed", ""
+        try:
+            callback = parse_stk_callback(row.body)
+        except CallbackError as e:
+            row.status, row.error = "error", str(e)[:255]
+            continue
+
+        if not callback.succeeded:
+            resolve_checkout(callback.checkout_request_id, "failed", callback.result_code, callback.result_desc)
+            continue
+
+        # The same callback twice in one batch
+        keys = _receipt_keys(callback.checkout_request_id, callback.receipt_number)
+        if keys & seen:
+            row.status = "duplicate"
+            continue
+        seen |= keys
+        credits.append((row, callback))
+
+    if credits:
+        _credit(credits)
+
+
+def _process_one(row):
+    """Process a single inbox row in its own savepoint, marking it error if it fails."""
+    try:
+        with transaction.atomic():
+            process_callbacks([row])
+    except Exception as e:
+        logger.exception("M-Pesa callback inbox row #%s failed", row.pk)
+        row.status, row.error = "error", f"{type(e).__name__}: {e}"[:255]
+
+
+def _receipt_keys(checkout_request_id, receipt_number):
+    keys = {("checkout", checkout_request_id)}
+    if receipt_number:
+        keys.add(("receipt", receipt_number))
+    return keys
+
+
+def _credit(credits):
+    checkout_ids = [callback.checkout_request_id for _, callback in credits]
+    receipt_numbers = [callback.receipt_number for _, callback in credits if callback.receipt_number]
+
+    # Receipts recorded by earlier batches: one query for the whole batch
+    known = set()
+    for checkout_request_id, receipt_number in MpesaReceipt.objects.filter(
+        Q(checkout_request_id__in=checkout_ids) | Q(receipt_number__in=receipt_numbers)
+    ).values_list("checkout_request_id", "receipt_number"):
+        known |= _receipt_keys(checkout_request_id, receipt_number)
+
+    # The callback's loan comes from the checkout recorded when the push was
+    # accepted: one primary-key lookup for the whole batch, locked so the
+    # reconciler cannot resolve these checkouts while the batch commits
+    checkouts = (
+        PendingCheckout.objects
+        .select_for_update()
+        .only("status", "correlation_id", "loan_id", "user_id")
+        .in_bulk(checkout_ids)
+    )
+
+    # Callbacks for pushes that timed out before Daraja answered them
+    untracked = [callback for _, callback in credits if callback.checkout_request_id not in checkouts]
+    if untracked:
+        checkouts.update(adopt_unknown_pushes(untracked))
+
+    to_credit = []
+    already_resolved = []
+    for row, callback in credits:
+        if _receipt_keys(callback.checkout_request_id, callback.receipt_number) & known:
+            row.status = "duplicate"
+            continue
+
+        checkout = checkouts.get(callback.checkout_request_id)
+        if checkout is None:
+            row.status, row.error = "ignored", "Unknown CheckoutRequestID"
+            logger.warning("M-Pesa callback for unknown checkout %s", callback.checkout_request_id)
+            continue
+
+        if checkout.status not in OPEN_CHECKOUT_STATUSES:
+            # The reconciler already settled it; keep the receipt, credit nothing
+            row.status, row.error = "duplicate", "Checkout already resolved"
+            already_resolved.append(_receipt(callback, checkout.loan_id))
+            continue
+
+        to_credit.append((row, callback, checkout))
+
+    try:
+        # Savepoint: a receipt conflict with a concurrent drainer only undoes this part
+        with transaction.atomic():
+            _apply(to_credit, already_resolved)
+    except IntegrityError:
+        logger.warning("Receipt conflict in a batch of %s callbacks, crediting one by one", len(to_credit))
+        for row, callback, checkout in to_credit:
+            _credit_one(row, callback, checkout)
+        for receipt in already_resolved:
+            claim_receipt(
+                Loan(pk=receipt.loan_id), receipt.receipt_number, receipt.checkout_request_id,
+                receipt.amount, receipt.phone, receipt.transaction_date,
+            )
+        return
+
+    for row, callback, checkout in to_credit:
+        with correlation(checkout.correlation_id or checkout.pk):
+            logger.info(
+                "M-Pesa payment of %s applied to loan #%s", callback.amount, checkout.loan_id,
+                extra={"loan_id": checkout.loan_id, "receipt_number": callback.receipt_number},
+            )
+
+
+def _apply(to_credit, receipts):
+    now = timezone.now()
+
+    # Close the checkouts, one UPDATE per distinct description (normally one)
+    by_desc = defaultdict(list)
+    for _, callback, checkout in to_credit:
+        by_desc[callback.result_desc].append(checkout.pk)
+    for result_desc, pks in by_desc.items():
+        PendingCheckout.objects.filter(pk__in=pks, status__in=OPEN_CHECKOUT_STATUSES).update(
+            status="completed",
+            result_code=SUCCESS_RESULT_CODE,
+            result_desc=str(result_desc)[:255],
+            resolved_at=now,
+        )
+
+    payments = apply_payments(
+        [(checkout.loan_id, checkout.user_id, callback.amount) for _, callback, checkout in to_credit],
+        "M-Pesa",
+    )
+    for (_, callback, checkout), payment in zip(to_credit, payments):
+        # bulk_create only returns primary keys on backends that support it
+        receipts.append(_receipt(callback, checkout.loan_id, payment if payment.pk else None))
+
+    MpesaReceipt.objects.bulk_create(receipts)
+
+
+def _receipt(callback, loan_id, payment=None):
+    return MpesaReceipt(
+        receipt_number=callback.receipt_number or None,
+        checkout_request_id=callback.checkout_request_id,
+        loan_id=loan_id,
+        payment=payment,
+        amount=callback.amount,
+        phone=callback.phone,
+        transaction_date=callback.transaction_date,
+    )
+
+
+def _credit_one(row, callback, checkout):
+    """Slow path for a batch that hit a receipt conflict: one savepoint per callback."""
+    loan = Loan(pk=checkout.loan_id, user_id=checkout.user_id)
+    with transaction.atomic():
+        receipt = claim_receipt(
+            loan, callback.receipt_number, callback.checkout_request_id,
+            callback.amount, callback.phone, callback.transaction_date,
+        )
+        if receipt is None:
+            row.status = "duplicate"
+            return
+        if not resolve_checkout(checkout.pk, "completed", SUCCESS_RESULT_CODE, callback.result_desc):
+            row.status, row.error = "duplicate", "Checkout already resolved"
+            return
+        apply_stk_payment(loan, callback.amount, receipt)
@@ -0,0 +1,275 @@
+# app/mpesa/jobs.py
+
+import asyncio
+import logging
+import random
+from collections import defaultdict
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from app.models import MpesaPaymentJob, Notification
+from app.mpesa.async_client import alipa_na_mpesa_stk_push
+from app.mpesa.log import set_correlation_id
+from app.mpesa.reconcile import track_checkout
+from app.mpesa.utils import normalize_phone_number
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_stk_push(loan, user, phone, amount, correlation_id=""):
+    """
+    Record an "STK push requested" job; a worker sends it to Daraja
+    """
+    return MpesaPaymentJob.objects.create(
+        loan=loan,
+        user=user,
+        phone=phone,
+        amount=amount,
+        correlation_id=correlation_id,
+    )
+
+
+def claim_jobs(batch_size, lease_seconds=None):
+    """
+    Claim up to batch_size runnable jobs for this worker.
+
+    Rows are locked with SELECT ... FOR UPDATE SKIP LOCKED so concurrent
+    workers never claim the same job. Jobs left in "processing" by a worker
+    that died are picked up again once their lease expires; a live worker
+    keeps renewing its leases (see process_batch).
+    """
+    if lease_seconds is None:
+        lease_seconds = _lease_seconds()
+    now = timezone.now()
+
+    with transaction.atomic():
+        jobs = list(
+            MpesaPaymentJob.objects
+            .select_for_update(skip_locked=True)
+            .filter(
+                Q(status="queued", run_after__lte=now)
+                | Q(status="processing", locked_until__lt=now)
+            )
+            .order_by("run_after")[:batch_size]
+        )
+        if jobs:
+            MpesaPaymentJob.objects.filter(pk__in=[job.pk for job in jobs]).update(
+                status="processing",
+                locked_until=now + timedelta(seconds=lease_seconds),
+                attempts=F("attempts") + 1,
+                updated_at=now,
+            )
+            for job in jobs:
+                job.attempts += 1
+    return jobs
+
+
+def _lease_seconds():
+    return getattr(settings, "MPESA_JOB_LEASE_SECONDS", 120)
+
+
+def renew_leases(job_ids, lease_seconds=None):
+    """Extend the lease of claimed jobs still in "processing". Returns how many were renewed."""
+    if lease_seconds is None:
+        lease_seconds = _lease_seconds()
+    now = timezone.now()
+    return MpesaPaymentJob.objects.filter(pk__in=job_ids, status="processing").update(
+        locked_until=now + timedelta(seconds=lease_seconds), updated_at=now,
+    )
+
+
+def retry_delay(attempts):
+    """Exponential backoff with jitter, capped at MPESA_JOB_MAX_BACKOFF seconds."""
+    base = getattr(settings, "MPESA_JOB_RETRY_BACKOFF", 15)
+    cap = getattr(settings, "MPESA_JOB_MAX_BACKOFF", 600)
+    delay = min(base * (2 ** (attempts - 1)), cap)
+    return delay + random.uniform(0, delay / 2)
+
+
+def record_result(job, response):
+    """
+    Store the outcome of one STK push attempt on its job.
+    Failures that never reached Daraja are re-queued with backoff until
+    MPESA_JOB_MAX_ATTEMPTS; a push whose outcome is unknown is not.
+    """
+    now = timezone.now()
+    job.locked_until = None
+
+    sent = response.get("ResponseCode") == "0"
+    if sent:
+        job.status = "sent"
+        job.checkout_request_id = response.get("CheckoutRequestID", "")
+        job.merchant_request_id = response.get("MerchantRequestID", "")
+        job.last_error = ""
+    else:
+        job.last_error = (
+            response.get("errorMessage") or response.get("ResponseDescription") or "Unknown error"
+        )
+        max_attempts = getattr(settings, "MPESA_JOB_MAX_ATTEMPTS", 5)
+        if response.get("unknown"):
+            # Daraja may have prompted the customer already: a resend could
+            # charge them twice. The callback, if any, is matched by
+            # adopt_unknown_pushes.
+            job.status = "unknown"
+            logger.warning("STK push job #%s outcome unknown, not resending: %s", job.pk, job.last_error)
+            Notification.objects.create(
+                user_id=job.user_id,
+                role="borrower",
+                message=(
+                    f"We could not confirm the M-Pesa request for Loan #{job.loan_id}. If you approved it "
+                    f"on your phone it will be credited; please check before paying again."
+                )[:255],
+            )
+        elif response.get("retry_after") is not None:
+            # Circuit breaker open: nothing was sent, so the attempt does not count
+            job.status = "queued"
+            job.attempts -= 1
+            job.run_after = now + timedelta(seconds=response["retry_after"] + random.uniform(0, 5))
+            logger.info("STK push job #%s deferred: %s", job.pk, job.last_error)
+        elif response.get("retryable") and job.attempts < max_attempts:
+            job.status = "queued"
+            job.run_after = now + timedelta(seconds=retry_delay(job.attempts))
+            logger.warning("STK push job #%s attempt %s failed, will retry: %s", job.pk, job.attempts, job.last_error)
+        else:
+            job.status = "failed"
+            logger.error("STK push job #%s failed after %s attempts: %s", job.pk, job.attempts, job.last_error)
+            Notification.objects.create(
+                user_id=job.user_id,
+                role="borrower",
+                message=f"M-Pesa payment request for Loan #{job.loan_id} failed: {job.last_error}"[:255],
+            )
+
+    with transaction.atomic():
+        job.save(update_fields=[
+            "status", "attempts", "locked_until", "checkout_request_id", "merchant_request_id",
+            "last_error", "run_after", "updated_at",
+        ])
+        if sent:
+            # Track the checkout until its callback (or the reconciler) resolves it
+            track_checkout(response, job.loan_id, job.user_id, job.amount, job.phone, job.correlation_id)
+    if sent:
+        logger.info("STK push job #%s sent", job.pk, extra={"checkout_request_id": job.checkout_request_id})
+
+
+def adopt_unknown_pushes(callbacks):
+    """
+    Match successful callbacks for checkouts nobody tracked to recent jobs
+    whose push ended "unknown" (same phone and amount, oldest job first):
+    track those checkouts and close the jobs as sent, so the payments are
+    credited to their loans. Returns {checkout_request_id: PendingCheckout}.
+    """
+    since = timezone.now() - timedelta(seconds=getattr(settings, "MPESA_CHECKOUT_EXPIRY", 24 * 60 * 60))
+    waiting = defaultdict(list)
+    for job in MpesaPaymentJob.objects.select_for_update().filter(
+        status="unknown", created_at__gte=since
+    ).order_by("created_at"):
+        try:
+            phone = normalize_phone_number(job.phone)
+        except ValueError:
+            continue
+        # The push asked for whole shillings (see process_job)
+        waiting[phone, int(job.amount)].append(job)
+
+    adopted = {}
+    for callback in callbacks:
+        jobs = waiting.get((callback.phone, callback.amount))
+        if not jobs:
+            continue
+        job = jobs.pop(0)
+        response = {
+            "CheckoutRequestID": callback.checkout_request_id,
+            "MerchantRequestID": callback.merchant_request_id or "",
+        }
+        adopted[callback.checkout_request_id] = track_checkout(
+            response, job.loan_id, job.user_id, job.amount, job.phone, job.correlation_id,
+        )
+        MpesaPaymentJob.objects.filter(pk=job.pk).update(
+            status="sent",
+            checkout_request_id=response["CheckoutRequestID"],
+            merchant_request_id=response["MerchantRequestID"],
+            updated_at=timezone.now(),
+        )
+        logger.info("STK push job #%s with unknown outcome matched checkout %s", job.pk,
+                    callback.checkout_request_id)
+    return adopted
+
+
+def mark_sent_untracked(job, response, error):
+    """
+    The push went out but recording it failed: close the job as sent anyway
+    so its lease expiring can never send the borrower a second prompt.
+    """
+    MpesaPaymentJob.objects.filter(pk=job.pk).update(
+        status="sent",
+        locked_until=None,
+        checkout_request_id=response.get("CheckoutRequestID", ""),
+        merchant_request_id=response.get("MerchantRequestID", ""),
+        last_error=f"Sent, but recording the result failed: {error}",
+        updated_at=timezone.now(),
+    )
+
+
+async def process_job(job):
+    """Send one job's STK push and record the result."""
+    # Each gathered job runs in its own task, so this does not leak between jobs
+    set_correlation_id(job.correlation_id or f"job-{job.pk}")
+    try:
+        response = await alipa_na_mpesa_stk_push(
+            phone=job.phone,
+            amount=int(job.amount),
+            account_reference=f"Loan-{job.loan_id}",
+            description=f"Loan Repayment for Loan #{job.loan_id}",
+        )
+    except Exception as e:
+        # Whether the request went out is not known: do not resend it
+        response = {"ResponseCode": "1", "errorMessage": str(e), "unknown": True}
+
+    try:
+        await sync_to_async(record_result)(job, response)
+    except Exception as e:
+        logger.exception("Recording STK push job #%s failed", job.pk)
+        if response.get("ResponseCode") != "0":
+            raise
+        await sync_to_async(mark_sent_untracked)(job, response, e)
+    return job
+
+
+async def process_batch(jobs, concurrency):
+    """
+    Send a claimed batch with at most `concurrency` pushes in flight.
+
+    Jobs can wait on the shared token bucket and on retries for longer than
+    their lease, so the leases of unfinished jobs are renewed every third of
+    MPESA_JOB_LEASE_SECONDS until they are done. A job that raises is logged
+    and returned as its exception; the rest of the batch carries on.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    unfinished = {job.pk for job in jobs}
+
+    async def run(job):
+        try:
+            async with semaphore:
+                return await process_job(job)
+        finally:
+            unfinished.discard(job.pk)
+
+    async def keep_leases():
+        while unfinished:
+            await asyncio.sleep(_lease_seconds() / 3)
+            if unfinished:
+                await sync_to_async(renew_leases)(list(unfinished))
+
+    heartbeat = asyncio.create_task(keep_leases())
+    try:
+        results = await asyncio.gather(*(run(job) for job in jobs), return_exceptions=True)
+    finally:
+        heartbeat.cancel()
+    for job, result in zip(jobs, results):
+        if isinstance(result, Exception):
+            logger.error("STK push job #%s failed: %r", job.pk, result, exc_info=result)
+    return results
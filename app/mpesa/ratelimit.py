@@ -0,0 +1,130 @@
+# app/mpesa/ratelimit.py
+
+import asyncio
+import math
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+
+class TokenBucket:
+    """
+    Token bucket shared by every process through Django's cache.
+
+    Implemented as GCRA: the cache holds the bucket's "theoretical arrival
+    time" (TAT). Each caller reserves the next free slot and is told how long
+    to wait for it, so callers over the limit queue in order instead of failing.
+    """
+
+    def __init__(self, name, rate, burst):
+        self.key = f"mpesa:bucket:{name}"
+        self.lock_key = f"{self.key}:lock"
+        self.interval = 1.0 / rate            # seconds per token
+        self.tolerance = (burst - 1) * self.interval
+
+    def reserve(self):
+        """
+        Reserve the next token and return how many seconds to wait before using it.
+        """
+        self._lock()
+        try:
+            now = time.time()
+            tat = max(cache.get(self.key, now), now)
+            wait = max(tat - self.tolerance - now, 0.0)
+            new_tat = tat + self.interval
+            cache.set(self.key, new_tat, timeout=int(new_tat - now) + 60)
+        finally:
+            cache.delete(self.lock_key)
+        return wait
+
+    def queue_depth(self):
+        """Number of reservations currently waiting for a token, across all processes."""
+        now = time.time()
+        tat = cache.get(self.key, now)
+        # The next reservation would wait this many intervals; one less are queued
+        # ahead of it (rounded so float error cannot add a phantom reservation)
+        return max(math.ceil(round((tat - self.tolerance - now) / self.interval, 6)) - 1, 0)
+
+    def _lock(self):
+        # cache.add is atomic on the shared backends; the timeout frees a crashed holder
+        while not cache.add(self.lock_key, True, timeout=5):
+            time.sleep(0.005)
+
+
+class StkPushDispatcher:
+    """
+    Paces outgoing STK pushes with one TokenBucket per shortcode and keeps
+    wait-time counters for sizing the bucket against the real Daraja quota.
+    """
+
+    def __init__(self, rate=None, burst=None):
+        self.rate = rate or getattr(settings, "MPESA_STK_RATE", 5.0)
+        self.burst = burst or getattr(settings, "MPESA_STK_BURST", 10)
+        self._buckets = {}
+        self._stats_lock = threading.Lock()
+
+        self.dispatched = 0
+        self.delayed = 0
+        self.waiting = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def bucket(self, shortcode):
+        if shortcode not in self._buckets:
+            self._buckets[shortcode] = TokenBucket(shortcode, self.rate, self.burst)
+        return self._buckets[shortcode]
+
+    def acquire(self, shortcode):
+        """Block until an STK push may be sent for this shortcode."""
+        wait = self.bucket(shortcode).reserve()
+        self._started(wait)
+        try:
+            if wait:
+                time.sleep(wait)
+        finally:
+            self._finished(wait)
+        return wait
+
+    async def aacquire(self, shortcode):
+        """Async acquire: the wait is spent in asyncio.sleep, not a thread."""
+        wait = await sync_to_async(self.bucket(shortcode).reserve, thread_sensitive=False)()
+        self._started(wait)
+        try:
+            if wait:
+                await asyncio.sleep(wait)
+        finally:
+            self._finished(wait)
+        return wait
+
+    def stats(self, shortcode=None):
+        with self._stats_lock:
+            data = {
+                "dispatched": self.dispatched,
+                "delayed": self.delayed,
+                "waiting": self.waiting,
+                "avg_wait": self.total_wait / self.dispatched if self.dispatched else 0.0,
+                "max_wait": self.max_wait,
+            }
+        if shortcode is not None:
+            data["queue_depth"] = self.bucket(shortcode).queue_depth()
+        return data
+
+    def _started(self, wait):
+        with self._stats_lock:
+            self.dispatched += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            if wait:
+                self.delayed += 1
+                self.waiting += 1
+
+    def _finished(self, wait):
+        if wait:
+            with self._stats_lock:
+                self.waiting -= 1
+
+
+dispatcher = StkPushDispatcher()
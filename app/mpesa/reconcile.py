@@ -0,0 +1,169 @@
+# app/mpesa/reconcile.py
+
+import asyncio
+import logging
+from datetime import timedelta
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from app.models import PendingCheckout
+from app.mpesa.async_client import get_async_daraja_client
+from app.mpesa.auth import token_manager
+from app.mpesa.breaker import CircuitOpenError
+from app.mpesa.callbacks import apply_stk_payment, resolve_checkout
+from app.mpesa.log import set_correlation_id
+from app.mpesa.ratelimit import dispatcher
+
+logger = logging.getLogger(__name__)
+
+# (max checkout age in seconds, seconds until the next poll)
+# Young checkouts are polled often; old ones rarely, since a callback
+# or a customer decision is far more likely early on.
+DEFAULT_POLL_SCHEDULE = (
+    (5 * 60, 30),
+    (30 * 60, 2 * 60),
+    (3 * 60 * 60, 10 * 60),
+    (None, 30 * 60),
+)
+
+# Any other final ResultCode (1032 cancelled, 1037 unreachable,
+# 1 insufficient funds, 2001 wrong PIN, ...) closes the checkout as failed
+SUCCESS_RESULT_CODE = "0"
+
+
+def first_poll_delay():
+    """Seconds to give the callback before the first status query."""
+    return getattr(settings, "MPESA_RECONCILE_FIRST_POLL", 60)
+
+
+def track_checkout(response, loan_id, user_id, amount, phone, correlation_id=""):
+    """
+    Record an accepted STK push so its callback can be matched to the loan by
+    CheckoutRequestID (a primary-key lookup) and polled if it never arrives.
+    """
+    return PendingCheckout.objects.create(
+        checkout_request_id=response["CheckoutRequestID"],
+        merchant_request_id=response.get("MerchantRequestID", ""),
+        loan_id=loan_id,
+        user_id=user_id,
+        amount=amount,
+        phone=phone,
+        correlation_id=correlation_id,
+        next_poll_at=timezone.now() + timedelta(seconds=first_poll_delay()),
+    )
+
+
+def expire_checkouts():
+    """
+    Mark checkouts older than MPESA_CHECKOUT_EXPIRY that are still pending as
+    expired, in one UPDATE. Returns how many were expired.
+    """
+    now = timezone.now()
+    expiry = timedelta(seconds=getattr(settings, "MPESA_CHECKOUT_EXPIRY", 24 * 60 * 60))
+    return PendingCheckout.objects.filter(status="pending", created_at__lt=now - expiry).update(
+        status="expired", resolved_at=now,
+    )
+
+
+def next_poll_delay(age_seconds):
+    schedule = getattr(settings, "MPESA_RECONCILE_SCHEDULE", DEFAULT_POLL_SCHEDULE)
+    for max_age, delay in schedule:
+        if max_age is None or age_seconds < max_age:
+            return delay
+    return schedule[-1][1]
+
+
+def claim_due_checkouts(batch_size):
+    """
+    Claim up to batch_size pending checkouts whose next poll is due.
+
+    next_poll_at is pushed forward inside the locking transaction, which acts
+    as a lease: other reconcilers skip the rows and will not re-poll them
+    until the next scheduled time.
+    """
+    expired = expire_checkouts()
+    if expired:
+        logger.info("Expired %s checkouts that never got a result", expired)
+
+    now = timezone.now()
+    with transaction.atomic():
+        checkouts = list(
+            PendingCheckout.objects
+            .select_for_update(skip_locked=True)
+            .filter(status="pending", next_poll_at__lte=now)
+            .order_by("next_poll_at")[:batch_size]
+        )
+
+        for checkout in checkouts:
+            age = now - checkout.created_at
+            checkout.next_poll_at = now + timedelta(seconds=next_poll_delay(age.total_seconds()))
+            checkout.poll_count += 1
+
+        PendingCheckout.objects.bulk_update(checkouts, ["next_poll_at", "poll_count"])
+    return checkouts
+
+
+def record_query_result(checkout, result_code, result_desc):
+    """
+    Apply a final STK query result. Payments go through the same path as
+    mpesa_stk_callback, and only if the callback has not resolved it first.
+    """
+    with transaction.atomic():
+        if result_code == SUCCESS_RESULT_CODE:
+            if resolve_checkout(checkout.pk, "completed", result_code, result_desc):
+                apply_stk_payment(checkout.loan, checkout.amount)
+                return "completed"
+        elif resolve_checkout(checkout.pk, "failed", result_code, result_desc):
+            return "failed"
+    return "already resolved"
+
+
+async def query_checkout(checkout):
+    """
+    Ask Daraja for one checkout's status.
+    Returns "completed", "failed", "already resolved" or "pending".
+    """
+    # Each gathered checkout runs in its own task, so this does not leak between them
+    set_correlation_id(checkout.correlation_id or checkout.pk)
+    client = get_async_daraja_client()
+    try:
+        access_token = await token_manager.aget_token()
+    except CircuitOpenError:
+        return "pending"
+    if not access_token:
+        return "pending"
+
+    await dispatcher.aacquire(f"{client.config.shortcode}:query")
+    try:
+        response = await client.stk_query(access_token, checkout.pk)
+        data = response.json()
+    except (CircuitOpenError, httpx.HTTPError, ValueError):
+        return "pending"
+
+    # While the customer has not answered, Daraja replies with HTTP 500 /
+    # errorCode 500.001.1001; any other error is also retried on schedule
+    result_code = data.get("ResultCode")
+    if response.status_code != 200 or result_code is None:
+        return "pending"
+
+    checkout = await PendingCheckout.objects.select_related("loan__user").aget(pk=checkout.pk)
+    outcome = await sync_to_async(record_query_result)(
+        checkout, str(result_code), data.get("ResultDesc", "")
+    )
+    logger.info("Reconciled checkout %s: %s (ResultCode %s)", checkout.pk, outcome, result_code)
+    return outcome
+
+
+async def reconcile_batch(checkouts, concurrency):
+    """Query a claimed batch with at most `concurrency` requests in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(checkout):
+        async with semaphore:
+            return await query_checkout(checkout)
+
+    return await asyncio.gather(*(run(checkout) for checkout in checkouts))
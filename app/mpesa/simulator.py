@@ -0,0 +1,201 @@
+# app/mpesa/simulator.py
+#
+# Local stand-in for the Daraja API, started with `python manage.py mpesa_simulator`.
+# Point the app at it with MPESA_ENV = "simulator".
+
+import json
+import random
+import string
+import threading
+import time
+import uuid
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import requests
+
+
+def _random_receipt():
+    return "".join(random.choices(string.ascii_uppercase + string.digits, k=10))
+
+
+class DarajaSimulator:
+    """
+    Serves the OAuth, STK push and STK query endpoints with Daraja's response
+    shapes and POSTs a result callback for every accepted push.
+
+    callback_delay   seconds between accepting a push and sending its callback
+    failure_rate     share of pushes that end as "Request cancelled by user" (1032)
+    duplicate_rate   share of callbacks delivered twice, like a Safaricom retry
+    latency          extra seconds added to every API response
+    """
+
+    def __init__(self, callback_url=None, callback_delay=3.0, failure_rate=0.1,
+                 duplicate_rate=0.05, latency=0.0):
+        self.callback_url = callback_url
+        self.callback_delay = callback_delay
+        self.failure_rate = failure_rate
+        self.duplicate_rate = duplicate_rate
+        self.latency = latency
+
+        self.session = requests.Session()
+        self.checkouts = {}  # CheckoutRequestID -> callback body (None while pending)
+        self.lock = threading.Lock()
+        self.counters = {"oauth": 0, "stk_push": 0, "stk_query": 0, "callbacks": 0, "callback_errors": 0}
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    # ---- endpoint handlers: return (status, body) ----
+
+    def oauth(self):
+        self.count("oauth")
+        return 200, {"access_token": uuid.uuid4().hex, "expires_in": "3599"}
+
+    def stk_push(self, payload):
+        self.count("stk_push")
+        required = ("BusinessShortCode", "Password", "Timestamp", "Amount", "PhoneNumber", "CallBackURL")
+        missing = [field for field in required if not payload.get(field)]
+        if missing:
+            return 400, {
+                "requestId": uuid.uuid4().hex,
+                "errorCode": "400.002.02",
+                "errorMessage": f"Bad Request - Invalid {missing[0]}",
+            }
+
+        merchant_id = f"{random.randint(10000, 99999)}-{random.randint(1000000, 9999999)}-1"
+        checkout_id = f"ws_CO_{datetime.now().strftime('%d%m%Y%H%M%S')}{random.randint(100000, 999999)}"
+        with self.lock:
+            self.checkouts[checkout_id] = None
+
+        timer = threading.Timer(
+            self.callback_delay, self.complete, args=(merchant_id, checkout_id, payload)
+        )
+        timer.daemon = True
+        timer.start()
+
+        return 200, {
+            "MerchantRequestID": merchant_id,
+            "CheckoutRequestID": checkout_id,
+            "ResponseCode": "0",
+            "ResponseDescription": "Success. Request accepted for processing",
+            "CustomerMessage": "Success. Request accepted for processing",
+        }
+
+    def stk_query(self, payload):
+        self.count("stk_query")
+        checkout_id = payload.get("CheckoutRequestID")
+        with self.lock:
+            known = checkout_id in self.checkouts
+            body = self.checkouts.get(checkout_id)
+
+        if not known:
+            return 400, {
+                "requestId": uuid.uuid4().hex,
+                "errorCode": "400.002.02",
+                "errorMessage": "Bad Request - Invalid CheckoutRequestID",
+            }
+        if body is None:
+            return 500, {
+                "requestId": uuid.uuid4().hex,
+                "errorCode": "500.001.1001",
+                "errorMessage": "The transaction is being processed",
+            }
+
+        callback = body["Body"]["stkCallback"]
+        return 200, {
+            "ResponseCode": "0",
+            "ResponseDescription": "The service request has been accepted successsfully",
+            "MerchantRequestID": callback["MerchantRequestID"],
+            "CheckoutRequestID": checkout_id,
+            "ResultCode": str(callback["ResultCode"]),
+            "ResultDesc": callback["ResultDesc"],
+        }
+
+    # ---- callbacks ----
+
+    def build_callback(self, merchant_id, checkout_id, payload):
+        callback = {
+            "MerchantRequestID": merchant_id,
+            "CheckoutRequestID": checkout_id,
+        }
+        if random.random() < self.failure_rate:
+            callback["ResultCode"] = 1032
+            callback["ResultDesc"] = "Request cancelled by user"
+        else:
+            callback["ResultCode"] = 0
+            callback["ResultDesc"] = "The service request is processed successfully."
+            callback["CallbackMetadata"] = {
+                "Item": [
+                    {"Name": "Amount", "Value": float(payload["Amount"])},
+                    {"Name": "MpesaReceiptNumber", "Value": _random_receipt()},
+                    {"Name": "TransactionDate", "Value": int(datetime.now().strftime("%Y%m%d%H%M%S"))},
+                    {"Name": "PhoneNumber", "Value": int(payload["PhoneNumber"])},
+                ]
+            }
+        return {"Body": {"stkCallback": callback}}
+
+    def complete(self, merchant_id, checkout_id, payload):
+        body = self.build_callback(merchant_id, checkout_id, payload)
+        with self.lock:
+            self.checkouts[checkout_id] = body
+
+        url = self.callback_url or payload["CallBackURL"]
+        deliveries = 2 if random.random() < self.duplicate_rate else 1
+        for _ in range(deliveries):
+            try:
+                self.session.post(url, json=body, timeout=10)
+                self.count("callbacks")
+            except requests.exceptions.RequestException:
+                self.count("callback_errors")
+
+    # ---- HTTP server ----
+
+    def make_handler(self):
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = urlparse(self.path).path
+                if path == "/oauth/v1/generate":
+                    self.respond(*simulator.oauth())
+                else:
+                    self.respond(404, {"errorMessage": "Not found"})
+
+            def do_POST(self):
+                path = urlparse(self.path).path
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                except json.JSONDecodeError:
+                    self.respond(400, {"errorMessage": "Invalid JSON"})
+                    return
+
+                if path == "/mpesa/stkpush/v1/processrequest":
+                    self.respond(*simulator.stk_push(payload))
+                elif path == "/mpesa/stkpushquery/v1/query":
+                    self.respond(*simulator.stk_query(payload))
+                else:
+                    self.respond(404, {"errorMessage": "Not found"})
+
+            def respond(self, status, body):
+                if simulator.latency:
+                    time.sleep(simulator.latency)
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def serve(self, host, port):
+        server = ThreadingHTTPServer((host, port), self.make_handler())
+        server.daemon_threads = True
+        return server
@@ -1,40 +1,28 @@
 # app/mpesa/utils.py or wherever your M-Pesa utilities are
 
-import requests
 import base64
 from datetime import datetime
-from django.conf import settings
-from requests.auth import HTTPBasicAuth
 
 
-def get_mpesa_access_token():
+def normalize_phone_number(phone):
     """
-    Generate M-Pesa access token using consumer key and secret
+    Convert a phone number to the 254XXXXXXXXX format Daraja expects.
+    Raises ValueError with a user-facing message if it cannot be converted.
     """
-    consumer_key = settings.MPESA_CONSUMER_KEY
-    consumer_secret = settings.MPESA_CONSUMER_SECRET
-    api_url = settings.MPESA_AUTH_URL  # Should be: https://sandbox.safaricom.co.ke/oauth/v1/generate?grant_type=client_credentials
-
-    try:
-        response = requests.get(
-            api_url,
-            auth=HTTPBasicAuth(consumer_key, consumer_secret),
-            timeout=30
-        )
-
-        if response.status_code == 200:
-            json_response = response.json()
-            access_token = json_response.get('access_token')
-            print(f"✓ Access token generated successfully")
-            return access_token
-        else:
-            print(f"✗ Failed to get access token: {response.status_code}")
-            print(f"Response: {response.text}")
-            return None
-
-    except requests.exceptions.RequestException as e:
-        print(f"✗ Error getting access token: {e}")
-        return None
+    phone = str(phone).strip().replace(" ", "").replace("-", "").replace("+", "")
+
+    if phone.startswith("0"):
+        phone = "254" + phone[1:]
+    elif phone.startswith("7") or phone.startswith("1"):
+        phone = "254" + phone
+    elif not phone.startswith("254"):
+        raise ValueError("Invalid phone number format")
+
+    # Should be 12 digits: 254XXXXXXXXX
+    if len(phone) != 12:
+        raise ValueError("Phone number must be 12 digits (254XXXXXXXXX)")
+
+    return phone
 
 
 def generate_stk_password(shortcode, passkey, timestamp):
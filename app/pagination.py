@@ -0,0 +1,142 @@
+# app/pagination.py
+#
+# Keyset ("cursor") pagination for the list views. A page is the
+# LIST_PAGE_SIZE rows after (or before) the last row the user saw, found
+# with a WHERE on the sort key rather than an OFFSET, so page N reads the
+# same short index range as page 1. Ties on the sort key are broken by id.
+#
+# Cursors are opaque to the templates: ?after=<cursor> is the next (older)
+# page and ?before=<cursor> the previous (newer) one.
+
+import base64
+import binascii
+import datetime
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+def _json_value(value):
+    # Full isoformat: DjangoJSONEncoder drops microseconds, which would skip ties
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+
+def encode_cursor(*values):
+    raw = json.dumps(values, default=_json_value, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """The list of values in `cursor`, or None if it is missing or malformed."""
+    if not cursor:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+class Page:
+    """
+    One page of rows plus the cursors of its neighbours (None at either end).
+    Iterates, counts and tests true like the list it wraps.
+    """
+
+    def __init__(self, items, next_cursor=None, previous_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def __repr__(self):
+        return f"<Page of {len(self.items)} rows>"
+
+
+def page_request(request):
+    """("after" | "before", cursor values) from the query string, ("after", None) for the first page."""
+    before = decode_cursor(request.GET.get("before"))
+    if before is not None:
+        return "before", before
+    return "after", decode_cursor(request.GET.get("after"))
+
+
+def make_page(rows, size, direction, position, cursor_of):
+    """
+    Turn the `size + 1` rows fetched in `direction` from `position` into a
+    Page: the extra row only says whether there is more that way. Rows
+    fetched "before" come back oldest first and are flipped here.
+    """
+    more = len(rows) > size
+    items = rows[:size]
+    if direction == "before":
+        items.reverse()
+    if not items:
+        return Page(items)
+    older = more if direction == "after" else position is not None
+    newer = more if direction == "before" else position is not None
+    return Page(
+        items,
+        next_cursor=cursor_of(items[-1]) if older else None,
+        previous_cursor=cursor_of(items[0]) if newer else None,
+    )
+
+
+def paginate(request, queryset, key, page_size=None):
+    """
+    One Page of `queryset` ordered by `key` (e.g. "-created_at") then id, at
+    the request's ?after= / ?before= cursor. The key field must not be null.
+    """
+    size = page_size or settings.LIST_PAGE_SIZE
+    name = key.lstrip("-")
+    descending = key.startswith("-")
+    field = queryset.model._meta.get_field(name)
+    direction, values = page_request(request)
+
+    position = None
+    if values is not None and len(values) == 2:
+        try:
+            position = field.to_python(values[0]), int(values[1])
+        except (TypeError, ValueError, ValidationError):
+            position = None
+    if position is None:
+        direction = "after"
+
+    # Walking back to newer rows reads the index the other way round
+    forward = descending == (direction == "after")
+    if position is not None:
+        queryset = queryset.filter(beyond(name, *position, descending=forward))
+    ordering = (f"-{name}", "-id") if forward else (name, "id")
+    rows = list(queryset.order_by(*ordering)[: size + 1])
+    return make_page(rows, size, direction, position, lambda row: encode_cursor(getattr(row, name), row.pk))
+
+
+def beyond(name, value, pk, descending=True):
+    """
+    Rows strictly past (value, pk) in ORDER BY name, id (both DESC or both
+    ASC). Written as `name <= value AND (name < value OR id < pk)` so the
+    leading comparison is an index range the database can seek to.
+    """
+    if descending:
+        return Q(**{f"{name}__lte": value}) & (Q(**{f"{name}__lt": value}) | Q(pk__lt=pk))
+    return Q(**{f"{name}__gte": value}) & (Q(**{f"{name}__gt": value}) | Q(pk__gt=pk))
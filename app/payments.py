@@ -0,0 +1,150 @@
+# app/payments.py
+
+import logging
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import BooleanField, Case, DecimalField, ExpressionWrapper, F, Q, Value, When
+from django.db.models.functions import Round
+from django.db.models.lookups import GreaterThan, LessThanOrEqual
+
+from app import ledger, lender_stats, schedule
+from app.models import Loan, LoanPayment, interest_due
+
+logger = logging.getLogger(__name__)
+
+
+def _owed_after(amount):
+    """
+    Loan.balance less `amount` as a database expression, rounded to the six
+    decimal places of Loan.interest so SQLite's float arithmetic cannot
+    leave a paid-off loan a hair short.
+    """
+    return Round(F("amount") + interest_due() - F("paid_amount") - amount, 6)
+
+
+def _pays_off(amount):
+    """Matches a loan whose balance a payment of `amount` covers."""
+    return LessThanOrEqual(_owed_after(amount), 0)
+
+
+def _closed_by(amount):
+    """Matches a re-read loan if the payment of `amount` just applied is what closed it."""
+    # Closed, and the paid_amount before this payment did not cover the total due
+    return Q(closed=True) & GreaterThan(_owed_after(-amount), 0)
+
+
+def apply_payment(loan, amount, payment_method):
+    """
+    Credit `amount` to a loan and record the LoanPayment.
+
+    paid_amount is incremented in the database with a single UPDATE, which
+    also closes the loan when this payment covers the balance, so concurrent
+    payments on one loan can never overwrite each other. Only paid_amount,
+    status and closed are written (Loan.save() is not called). The ledger,
+    the installments and the lender's dashboard stats follow in the same
+    transaction.
+
+    `loan` is refreshed with the new values. Returns the LoanPayment.
+    """
+    # status/closed are listed before paid_amount and compare against the old
+    # paid_amount + amount: MySQL evaluates SET assignments left to right, other
+    # databases against the old row, and this reads the same on both
+    fully_paid = _pays_off(amount)
+
+    with transaction.atomic():
+        Loan.objects.filter(pk=loan.pk).update(
+            status=Case(When(fully_paid, then=Value("Completed")), default=F("status")),
+            closed=Case(When(fully_paid, then=Value(True)), default=F("closed"), output_field=BooleanField()),
+            paid_amount=F("paid_amount") + amount,
+        )
+        # The UPDATE holds the row lock until commit, so this reads our own result
+        loan.paid_amount, loan.status, loan.closed, lender_id, just_closed = (
+            Loan.objects.filter(pk=loan.pk)
+            .annotate(just_closed=ExpressionWrapper(_closed_by(amount), output_field=BooleanField()))
+            .values_list("paid_amount", "status", "closed", "lender_id", "just_closed").get()
+        )
+        ledger.record_repayments([(loan.pk, lender_id, amount)], f"{payment_method} repayment of loan #{loan.pk}")
+        schedule.settle_installments({loan.pk: loan.paid_amount}, closed=[loan.pk] if loan.closed else ())
+        lender_stats.record_payments({lender_id: amount}, {lender_id: int(just_closed)})
+
+        payment = LoanPayment.objects.create(
+            loan=loan,
+            user_id=loan.user_id,
+            amount=amount,
+            payment_method=payment_method,
+        )
+
+    if loan.closed:
+        logger.info("Loan #%s fully paid and closed", loan.pk)
+    logger.info(
+        "%s payment of %s applied to loan #%s", payment_method, amount, loan.pk,
+        extra={"loan_id": loan.pk, "payment_id": payment.pk, "paid_amount": str(loan.paid_amount)},
+    )
+    return payment
+
+
+def apply_payments(payments, payment_method):
+    """
+    Batch version of apply_payment for many payments at once.
+
+    `payments` is a list of (loan_id, user_id, amount). Amounts are summed per
+    loan and every loan is updated by one UPDATE ... CASE statement (same
+    atomic increment and closing rule as apply_payment); all LoanPayment rows
+    go in with one bulk INSERT. Returns the LoanPayment objects in order.
+    """
+    totals = defaultdict(Decimal)
+    for loan_id, _, amount in payments:
+        totals[loan_id] += amount
+    if not totals:
+        return []
+
+    fully_paid = {
+        loan_id: Q(pk=loan_id) & _pays_off(total)
+        for loan_id, total in totals.items()
+    }
+
+    with transaction.atomic():
+        Loan.objects.filter(pk__in=totals).update(
+            status=Case(
+                *[When(match, then=Value("Completed")) for match in fully_paid.values()],
+                default=F("status"),
+            ),
+            closed=Case(
+                *[When(match, then=Value(True)) for match in fully_paid.values()],
+                default=F("closed"),
+                output_field=BooleanField(),
+            ),
+            paid_amount=Case(
+                *[When(pk=loan_id, then=F("paid_amount") + total) for loan_id, total in totals.items()],
+                default=F("paid_amount"),
+                output_field=DecimalField(max_digits=12, decimal_places=2),
+            ),
+        )
+        lenders, paid_amounts, closed = {}, {}, []
+        lender_paid, lender_closed = defaultdict(Decimal), defaultdict(int)
+        rows = Loan.objects.filter(pk__in=totals).annotate(just_closed=Case(
+            *[When(Q(pk=loan_id) & _closed_by(total), then=Value(True)) for loan_id, total in totals.items()],
+            default=Value(False),
+            output_field=BooleanField(),
+        )).values_list("pk", "lender_id", "paid_amount", "closed", "just_closed")
+        for loan_id, lender_id, paid_amount, is_closed, just_closed in rows:
+            lenders[loan_id], paid_amounts[loan_id] = lender_id, paid_amount
+            if is_closed:
+                closed.append(loan_id)
+            lender_paid[lender_id] += totals[loan_id]
+            lender_closed[lender_id] += just_closed
+        ledger.record_repayments(
+            [(loan_id, lenders[loan_id], total) for loan_id, total in totals.items()],
+            f"{payment_method} repayments ({len(payments)})",
+        )
+        schedule.settle_installments(paid_amounts, closed)
+        lender_stats.record_payments(lender_paid, lender_closed)
+        created = LoanPayment.objects.bulk_create([
+            LoanPayment(loan_id=loan_id, user_id=user_id, amount=amount, payment_method=payment_method)
+            for loan_id, user_id, amount in payments
+        ])
+
+    logger.info("Applied %s %s payments to %s loans", len(created), payment_method, len(totals))
+    return created
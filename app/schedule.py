@@ -0,0 +1,113 @@
+# app/schedule.py
+#
+# Repayment schedules: one Installment row per month of a loan, built when
+# the loan is funded. The installments add up to exactly what the loan
+# closes at (Loan.amount + Loan.interest), so the schedule is paid off by
+# the same payment that closes the loan.
+#
+# An installment counts as paid once the loan's paid_amount reaches its
+# cumulative_due, so payments settle installments oldest first without
+# reading the schedule back into Python.
+
+import calendar
+import datetime
+import logging
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db.models import Prefetch, Q
+from django.utils import timezone
+
+from app.models import Installment
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal("0.01")
+
+
+def add_months(day, months):
+    """`day` moved forward by whole months, clamped to the end of shorter months."""
+    month_index = day.month - 1 + months
+    year, month = day.year + month_index // 12, month_index % 12 + 1
+    return day.replace(year=year, month=month, day=min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def build_schedule(loan):
+    """
+    Unsaved Installment rows for `loan`: the total due (amount plus the
+    loan's flat interest) in equal monthly parts, principal and interest
+    each split evenly, with the last installment absorbing the rounding so
+    the schedule totals exactly what closes the loan.
+    """
+    start = loan.start_date
+    if isinstance(start, datetime.datetime):
+        start = start.date()
+
+    total_interest = Decimal(loan.interest).quantize(CENT, rounding=ROUND_HALF_UP)
+    monthly_principal = (loan.amount / loan.duration).quantize(CENT)
+    monthly_interest = (total_interest / loan.duration).quantize(CENT)
+    remaining = loan.amount
+    interest_left = total_interest
+    cumulative = Decimal("0.00")
+    installments = []
+
+    for number in range(1, loan.duration + 1):
+        last = number == loan.duration
+        principal = remaining if last else min(monthly_principal, remaining)
+        interest = interest_left if last else min(monthly_interest, interest_left)
+        remaining -= principal
+        interest_left -= interest
+        cumulative += principal + interest
+        installments.append(Installment(
+            loan_id=loan.pk,
+            number=number,
+            due_date=add_months(start, number),
+            amount=principal + interest,
+            principal=principal,
+            interest=interest,
+            remaining_balance=remaining,
+            cumulative_due=cumulative,
+        ))
+    return installments
+
+
+def create_schedule(loan):
+    """Build and insert the loan's installments (one INSERT), settling any already paid."""
+    installments = Installment.objects.bulk_create(build_schedule(loan))
+    if loan.paid_amount:
+        settle_installments({loan.pk: loan.paid_amount})
+    logger.info("Built a %s-installment schedule for loan #%s", len(installments), loan.pk)
+    return installments
+
+
+def settle_installments(paid_amounts, closed=()):
+    """
+    Mark installments paid for {loan_id: new paid_amount}: every unpaid
+    installment whose cumulative_due is covered, plus every remaining
+    installment of the `closed` loan ids, in one UPDATE for all loans.
+    Run it in the transaction that changed paid_amount.
+    """
+    if not paid_amounts and not closed:
+        return 0
+    covered = Q(loan_id__in=list(closed)) if closed else Q()
+    for loan_id, paid_amount in paid_amounts.items():
+        covered |= Q(loan_id=loan_id, cumulative_due__lte=paid_amount)
+    return Installment.objects.filter(covered, paid_at__isnull=True).update(paid_at=timezone.now())
+
+
+def due_between(start, end):
+    """Unpaid installments of open loans due in [start, end], by due date."""
+    return (
+        Installment.objects
+        .filter(due_date__range=(start, end), paid_at__isnull=True, loan__closed=False)
+        .select_related("loan", "loan__user")
+        .order_by("due_date", "loan_id")
+    )
+
+
+def prefetch_unpaid():
+    """Prefetch for Loan querysets that fills Loan.unpaid_installments for next_payment."""
+    return Prefetch(
+        "installments",
+        queryset=Installment.objects.filter(paid_at__isnull=True).order_by("number"),
+        to_attr="unpaid_installments",
+    )
@@ -0,0 +1,85 @@
+# app/stats.py
+#
+# Dashboard stat cards. Every card set is one round-trip: loan metrics are
+# conditional aggregates (SUM/COUNT ... FILTER) over the user's loans in a
+# single query, and the lender cards read the maintained LenderStats row
+# with the 30-day window and pending count as scalar subqueries.
+
+import datetime
+from decimal import Decimal
+
+from django.db.models import Count, DecimalField, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from app import lender_stats
+from app.models import LenderDailyStats, LenderStats, LoanApplication, interest_due
+
+RECENT_DAYS = 30
+CENT = Decimal("0.01")
+
+_MONEY = DecimalField(max_digits=18, decimal_places=6)
+_ACTIVE = Q(status="Active", closed=False)
+
+
+def _money(expression, **filters):
+    """SUM(expression) as a Decimal, 0 instead of NULL, optionally FILTERed."""
+    condition = Q(**filters) if filters else None
+    return Coalesce(Sum(expression, filter=condition, output_field=_MONEY), Value(Decimal("0")), output_field=_MONEY)
+
+
+def loan_metrics(since):
+    """Every metric a dashboard can ask for, as aggregate expressions over Loan rows."""
+    return {
+        "loan_count": Count("id"),
+        "active_count": Count("id", filter=_ACTIVE),
+        "total_amount": _money(F("amount")),
+        "total_paid": _money(F("paid_amount")),
+        "expected_interest": _money(interest_due()),
+        # What borrowers still owe on Active loans, interest included
+        "outstanding": _money(F("amount") + interest_due() - F("paid_amount"), status="Active"),
+        # Principal not yet paid back, across all loans
+        "principal_outstanding": _money(F("amount") - F("paid_amount")),
+        "recent_amount": _money(F("amount"), funded_date__gte=since),
+    }
+
+
+def loan_stats(loans, *names, days=RECENT_DAYS):
+    """
+    The named metrics for a Loan queryset in one aggregate query, e.g.
+    loan_stats(Loan.objects.filter(user=user), "total_amount", "active_count").
+    """
+    metrics = loan_metrics(timezone.now() - datetime.timedelta(days=days))
+    values = loans.order_by().aggregate(**{name: metrics[name] for name in names})
+    # Money is summed at full precision and shown in cents
+    return {
+        name: value.quantize(CENT) if isinstance(value, Decimal) else value
+        for name, value in values.items()
+    }
+
+
+def lender_cards(lender, days=RECENT_DAYS):
+    """
+    The lender dashboard's cards in one query: the LenderStats row plus the
+    amount funded in the last `days` days and the pending request count.
+    Returns (LenderStats, recent_invested, pending_requests).
+    """
+    since = timezone.localdate() - datetime.timedelta(days=days)
+    recent = (
+        LenderDailyStats.objects.filter(lender=OuterRef("lender"), day__gte=since)
+        .order_by().values("lender").annotate(total=Sum("invested")).values("total")
+    )
+    pending = (
+        LoanApplication.objects.filter(status="pending")
+        .order_by().values("status").annotate(total=Count("id")).values("total")
+    )
+    query = LenderStats.objects.filter(lender=lender).annotate(
+        recent_invested=Coalesce(Subquery(recent), Value(Decimal("0.00")), output_field=DecimalField()),
+        pending_requests=Coalesce(Subquery(pending), Value(0)),
+    )
+    stats = query.first()
+    if stats is None:
+        # Nothing funded yet (migration 0023 filled in the earlier lenders)
+        lender_stats.ensure_rows([lender.pk])
+        stats = query.first()
+    return stats, stats.recent_invested, stats.pending_requests
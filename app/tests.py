@@ -1,3 +1,824 @@
-from django.test import TestCase
+import asyncio
+import csv
+import datetime
+import gzip
+import io
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import httpx
+from asgiref.sync import iscoroutinefunction
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DataError, IntegrityError, close_old_connections
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.urls import reverse
+from django.utils import timezone
+
+from app import ledger, lender_stats, schedule, stats
+from app.history import FUNDING, REPAYMENT, WALLET, history, history_rows
+from app.management.commands import check_query_plans
+from app.management.commands.check_query_budgets import BORROWER_VIEWS, LENDER_VIEWS
+from app.management.commands._seed import seed_dataset
+from app.middleware import QueryInstrumentationMiddleware
+from app.models import (
+    CallbackInbox, LedgerAccount, LenderStats, Loan, LoanPayment, MpesaReceipt, PendingCheckout, Transaction,
+)
+from app.mpesa import async_client, jobs
+from app.mpesa.auth import AccessTokenManager
+from app.mpesa.breaker import CircuitBreaker, CircuitOpenError
+from app.mpesa.callbacks import (
+    CallbackError, InvalidCallbackField, MalformedCallback, StkCallback, parse_stk_callback,
+)
+from app.mpesa.inbox import drain_inbox
+from app.mpesa.ratelimit import StkPushDispatcher, TokenBucket
+from app.pagination import encode_cursor, paginate
+from app.payments import apply_payment, apply_payments
+from app.views import _csv_stream
+
+User = get_user_model()
+
+
+def make_loan(amount, rate, duration, **fields):
+    borrower = User.objects.create(username=f"borrower-{User.objects.count()}", role="borrower")
+    if "lender" not in fields:
+        fields["lender"] = User.objects.create(username=f"lender-{User.objects.count()}", role="lender")
+    return Loan.objects.create(
+        user=borrower, amount=Decimal(amount), interest_rate=Decimal(rate),
+        duration=duration, purpose="business", status="Active", funded_date=timezone.now(), **fields,
+    )
+
+
+def stk_callback(checkout_request_id, receipt_number, amount=100):
+    return json.dumps({"Body": {"stkCallback": {
+        "MerchantRequestID": "m-1",
+        "CheckoutRequestID": checkout_request_id,
+        "ResultCode": 0,
+        "ResultDesc": "The service request is processed successfully.",
+        "CallbackMetadata": {"Item": [
+            {"Name": "Amount", "Value": amount},
+            {"Name": "MpesaReceiptNumber", "Value": receipt_number},
+            {"Name": "TransactionDate", "Value": 20250131235959},
+            {"Name": "PhoneNumber", "Value": 254700000000},
+        ]},
+    }}})
+
+
+def make_checkout(checkout_request_id, **fields):
+    loan = make_loan("1000", "10", 12)
+    return PendingCheckout.objects.create(
+        checkout_request_id=checkout_request_id, loan=loan, user=loan.user,
+        amount=Decimal("100"), phone="254700000000", next_poll_at=timezone.now(), **fields,
+    )
+
+
+class ScheduleTests(TestCase):
+    def test_schedule_totals_what_closes_the_loan(self):
+        for amount, rate, duration in (("1000", "8.5", 24), ("1000", "8.5", 2), ("1050", "7", 12), ("999.99", "0", 7)):
+            loan = make_loan(amount, rate, duration)
+            installments = schedule.build_schedule(loan)
+            self.assertEqual(len(installments), duration)
+            self.assertEqual(sum(i.amount for i in installments), installments[-1].cumulative_due)
+            self.assertEqual(installments[-1].cumulative_due, (loan.amount + loan.interest).quantize(Decimal("0.01")))
+            self.assertEqual(installments[-1].remaining_balance, 0)
+
+    def test_paying_the_balance_settles_every_installment(self):
+        loan = make_loan("1000", "8.5", 24)
+        schedule.create_schedule(loan)
+        apply_payment(loan, Decimal("1000.00"), "M-Pesa")
+        self.assertFalse(loan.closed)
+        self.assertIsNotNone(Loan.objects.get(pk=loan.pk).next_payment)
+
+        apply_payment(loan, loan.balance, "M-Pesa")
+        loan = Loan.objects.get(pk=loan.pk)
+        self.assertTrue(loan.closed)
+        self.assertEqual(loan.status, "Completed")
+        self.assertFalse(loan.installments.filter(paid_at__isnull=True).exists())
+        self.assertIsNone(loan.next_payment)
+        self.assertFalse(schedule.due_between(datetime.date.min, datetime.date.max).filter(loan=loan).exists())
+
+
+class AccountDeletionTests(TestCase):
+    def test_user_without_ledger_records_is_deleted(self):
+        user = User.objects.create(username="nobody", role="borrower")
+        self.client.force_login(user)
+        response = self.client.post(reverse("delete_account"))
+        self.assertRedirects(response, reverse("index"), fetch_redirect_response=False)
+        self.assertFalse(User.objects.filter(pk=user.pk).exists())
+
+    def test_lender_with_a_wallet_is_deactivated(self):
+        lender = User.objects.create(username="saver", role="lender")
+        ledger.deposit(lender, Decimal("500.00"))
+        self.client.force_login(lender)
+        response = self.client.post(reverse("ldelete_account"))
+        self.assertRedirects(response, reverse("index"), fetch_redirect_response=False)
+        lender.refresh_from_db()
+        self.assertFalse(lender.is_active)
+        self.assertEqual(ledger.balance(ledger.wallet_account(lender.pk)), Decimal("500.00"))
+        self.assertNotIn("_auth_user_id", self.client.session)
+
+    def test_borrower_with_a_funded_loan_is_deactivated(self):
+        loan = make_loan("1000", "8", 12)
+        ledger.deposit(loan.lender, Decimal("1000.00"))
+        ledger.fund_loan(loan)
+        self.client.force_login(loan.user)
+        response = self.client.post(reverse("delete_account"))
+        self.assertEqual(response.status_code, 302)
+        loan.user.refresh_from_db()
+        self.assertFalse(loan.user.is_active)
+        self.assertTrue(LedgerAccount.objects.filter(loan=loan).exists())
+
+class PaymentTests(TestCase):
+    def test_fractional_interest_must_be_paid_to_close(self):
+        # 1050 @ 7% owes 1123.50; whole-number columns must not truncate that to 1123
+        for pay in (apply_payment, lambda loan, amount, method: apply_payments([(loan.pk, loan.user_id, amount)], method)):
+            loan = make_loan("1050", "7", 12)
+            pay(loan, Decimal("1123.00"), "M-Pesa")
+            loan.refresh_from_db()
+            self.assertFalse(loan.closed)
+            self.assertEqual(loan.balance, Decimal("0.50"))
+
+            pay(loan, Decimal("0.50"), "M-Pesa")
+            loan.refresh_from_db()
+            self.assertTrue(loan.closed)
+            self.assertEqual(loan.status, "Completed")
+
+
+class StatsTests(TestCase):
+    def test_interest_is_not_truncated(self):
+        loan = make_loan("1050", "7", 12)
+        figures = stats.loan_stats(Loan.objects.filter(pk=loan.pk), "expected_interest", "outstanding")
+        self.assertEqual(figures, {"expected_interest": Decimal("73.50"), "outstanding": Decimal("1123.50")})
+
+        lender_stats.rebuild([loan.lender_id])
+        row, _, _ = stats.lender_cards(loan.lender)
+        self.assertEqual(row.expected_earnings, Decimal("73.50"))
+
+    def test_first_stats_start_from_a_zero_row(self):
+        lender = User.objects.create(username="new-lender", role="lender")
+        row, recent, _ = stats.lender_cards(lender)
+        self.assertEqual((row.loan_count, row.total_invested, recent), (0, 0, 0))
+        # A concurrent first request loses the insert race quietly
+        lender_stats.ensure_rows([lender.pk])
+        self.assertEqual(LenderStats.objects.filter(lender=lender).count(), 1)
+
+        loan = make_loan("1000", "8", 12, lender=lender)
+        lender_stats.record_funding(loan)
+        row, recent, _ = stats.lender_cards(lender)
+        self.assertEqual((row.loan_count, row.total_invested, recent), (1, Decimal("1000.00"), Decimal("1000.00")))
+
+    def test_funding_without_a_stats_row_counts_the_loan_once(self):
+        loan = make_loan("1000", "8", 12)
+        lender_stats.record_funding(loan)
+        row = LenderStats.objects.get(lender_id=loan.lender_id)
+        self.assertEqual((row.loan_count, row.total_invested, row.expected_earnings), (1, 1000, 80))
+
+    def test_payment_without_a_stats_row_rebuilds_the_lender(self):
+        loan = make_loan("1000", "8", 12)
+        make_loan("500", "10", 6, lender=loan.lender)
+        apply_payment(loan, Decimal("1080"), "M-Pesa")
+        row = LenderStats.objects.get(lender_id=loan.lender_id)
+        self.assertEqual(
+            (row.loan_count, row.active_count, row.total_invested, row.expected_earnings, row.total_paid),
+            (2, 1, 1500, 130, 1080),
+        )
+
+
+class QueryPlanTests(TestCase):
+    def test_hot_queries_use_an_index(self):
+        random.seed(1)
+        lender, borrower = seed_dataset(100, 2000)
+        plans = check_query_plans.Command()
+        plans.analyze()
+        for name, queryset in check_query_plans.hot_queries(lender, borrower).items():
+            with self.subTest(name):
+                plan, scans = plans.explain(queryset)
+                self.assertFalse(scans, "\n".join(plan))
+
+
+@override_settings(SQL_INSTRUMENTATION=True, SQL_QUERY_BUDGET_ENFORCE=True)
+class QueryBudgetTests(TestCase):
+    def test_views_stay_within_their_query_budget(self):
+        random.seed(1)
+        lender, borrower = seed_dataset(20, 500)
+        lender_stats.rebuild([lender.pk])
+        for user, views in ((borrower, BORROWER_VIEWS), (lender, LENDER_VIEWS)):
+            client = Client()
+            client.force_login(user)
+            for view in views:
+                with self.subTest(view):
+                    # Over budget raises QueryBudgetExceeded out of the test client
+                    response = client.get(reverse(view))
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(response["X-SQL-Repeated"], "0")
+
+    def test_async_requests_stay_async(self):
+        async def view(request):
+            return HttpResponse()
+
+        middleware = QueryInstrumentationMiddleware(view)
+        self.assertTrue(iscoroutinefunction(middleware))
+        response = asyncio.run(middleware(RequestFactory().get("/")))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("X-SQL-Queries", response)
+
+    def test_sync_requests_are_recorded(self):
+        def view(request):
+            list(Loan.objects.all())
+            return HttpResponse()
+
+        middleware = QueryInstrumentationMiddleware(view)
+        self.assertFalse(iscoroutinefunction(middleware))
+        self.assertEqual(middleware(RequestFactory().get("/"))["X-SQL-Queries"], "1")
+
+
+def walk_pages(fetch):
+    """Every row reached by following next cursors, then by previous cursors back from the last page."""
+    pages = [fetch({})]
+    while pages[-1].has_next:
+        pages.append(fetch({"after": pages[-1].next_cursor}))
+    forward = [row for page in pages for row in page]
+
+    page, backward = pages[-1], list(pages[-1])
+    while page.has_previous:
+        page = fetch({"before": page.previous_cursor})
+        backward = list(page) + backward
+    return forward, backward, pages
+
+
+class PaginationTests(TestCase):
+    def setUp(self):
+        lender = User.objects.create(username="lender", role="lender")
+        for _ in range(8):
+            make_loan("1000", "10", 12, lender=lender)
+        # Ties on the sort key: five loans created in the same instant
+        tied = list(Loan.objects.order_by("?").values_list("pk", flat=True)[:5])
+        Loan.objects.filter(pk__in=tied).update(created_at=timezone.now())
+        self.loans = Loan.objects.all()
+
+    def fetch(self, params, key="-created_at", page_size=3):
+        return paginate(RequestFactory().get("/", params), self.loans, key, page_size=page_size)
+
+    def test_cursors_walk_every_row_once_both_ways(self):
+        forward, backward, pages = walk_pages(self.fetch)
+        expected = list(self.loans.order_by("-created_at", "-id"))
+        self.assertEqual(forward, expected)
+        self.assertEqual(backward, expected)
+        self.assertEqual([len(page) for page in pages], [3, 3, 2])
+        self.assertFalse(pages[0].has_previous)
+        self.assertFalse(pages[-1].has_next)
+
+    def test_ascending_key(self):
+        forward, backward, _ = walk_pages(lambda params: self.fetch(params, key="created_at"))
+        expected = list(self.loans.order_by("created_at", "id"))
+        self.assertEqual((forward, backward), (expected, expected))
+
+    def test_bad_cursors_give_the_first_page(self):
+        first = list(self.fetch({}))
+        for cursor in (
+            "garbage!!",
+            "e30",  # {}
+            encode_cursor("not a date", 1),
+            encode_cursor(timezone.now(), "x"),
+            encode_cursor(timezone.now()),
+            encode_cursor(timezone.now(), 1, 2),
+        ):
+            for direction in ("after", "before"):
+                with self.subTest(cursor=cursor, direction=direction):
+                    page = self.fetch({direction: cursor})
+                    self.assertEqual(list(page), first)
+                    self.assertFalse(page.has_previous)
+
+
+def make_history(lender):
+    """
+    Wallet deposits, fundings and repayments for `lender` on five consecutive
+    days, ten days ago; rows of different sources share moments.
+    """
+    start = timezone.localtime().replace(hour=10, minute=0, second=0, microsecond=0) - datetime.timedelta(days=10)
+    moments = [start + datetime.timedelta(days=days) for days in (0, 1, 1, 2, 3, 3, 3, 4)]
+
+    deposits = [
+        Transaction.objects.create(lender=lender, amount=Decimal(amount), type="deposit")
+        for amount in ("5000", "2500.50", "1000")
+    ]
+    loans = [make_loan(amount, "10", 6, lender=lender) for amount in ("1500", "2000.25", "700")]
+    payments = [
+        LoanPayment.objects.create(loan=loan, user=loan.user, amount=Decimal(amount), payment_method="M-Pesa")
+        for loan, amount in ((loans[0], "400"), (loans[0], "333.33"), (loans[1], "120.10"))
+    ]
+    for when, (model, pk, field) in zip(moments, [
+        (Transaction, deposits[0].pk, "timestamp"),
+        (Loan, loans[0].pk, "funded_date"),
+        (Transaction, deposits[1].pk, "timestamp"),
+        (LoanPayment, payments[0].pk, "created_at"),
+        (Loan, loans[1].pk, "funded_date"),
+        (LoanPayment, payments[1].pk, "created_at"),
+        (Transaction, deposits[2].pk, "timestamp"),
+        (Loan, loans[2].pk, "funded_date"),
+    ]):
+        model.objects.filter(pk=pk).update(**{field: when})
+    LoanPayment.objects.filter(pk=payments[2].pk).update(created_at=moments[-1])
+    return moments
+
+
+class HistoryTests(TestCase):
+    def setUp(self):
+        self.lender = User.objects.create(username="lender", role="lender")
+        make_history(self.lender)
+
+    def fetch(self, params):
+        page, _ = history(RequestFactory().get("/", params), self.lender, page_size=4)
+        return page
+
+    def test_running_balance_is_continuous_across_pages(self):
+        forward, backward, pages = walk_pages(self.fetch)
+
+        self.assertEqual(len(pages), 3)
+        self.assertEqual(len(forward), 9)
+        key = lambda row: (row["source"], row["id"], row["balance"])
+        self.assertEqual([key(row) for row in forward], [key(row) for row in backward])
+        self.assertEqual({row["source"] for row in forward}, {WALLET, FUNDING, REPAYMENT})
+
+        balance = Decimal(0)
+        for row in reversed(forward):
+            balance += row["amount"] if row["positive"] else -row["amount"]
+            self.assertEqual(row["balance"], f"{balance:,.2f}")
+        self.assertEqual(balance, Decimal("5000") + Decimal("2500.50") + Decimal("1000")
+                         - Decimal("1500") - Decimal("2000.25") - Decimal("700")
+                         + Decimal("400") + Decimal("333.33") + Decimal("120.10"))
+
+    def test_totals_cover_the_whole_history(self):
+        _, figures = history(RequestFactory().get("/"), self.lender, page_size=4)
+        self.assertEqual(figures["count"], 9)
+        self.assertEqual(figures["inflow"], Decimal("9353.93"))
+        self.assertEqual(figures["outflow"], Decimal("4200.25"))
+
+    def test_streamed_rows_match_the_pages(self):
+        forward, _, _ = walk_pages(self.fetch)
+        streamed = list(history_rows(self.lender, chunk_size=2))
+        self.assertEqual(
+            [(row["source"], row["id"], f"{row['balance']:,.2f}") for row in streamed],
+            [(row["source"], row["id"], row["balance"]) for row in forward],
+        )
+
+
+class ExportCsvTests(TestCase):
+    def setUp(self):
+        self.lender = User.objects.create(username="lender", role="lender")
+        self.moments = make_history(self.lender)
+        self.client.force_login(self.lender)
+
+    def export(self, **params):
+        response = self.client.get(reverse("export_csv"), params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b"".join(response.streaming_content)
+
+    def rows(self, **params):
+        header, *rows = csv.reader(io.StringIO(self.export(**params).decode()))
+        self.assertEqual(header[0], "Date")
+        return rows
+
+    def test_full_export_carries_running_balances(self):
+        rows = self.rows()
+        self.assertEqual(len(rows), 9)
+        self.assertEqual(rows[0][-1], "$5,153.68")
+        self.assertEqual(rows[-1][-1], "$5,000.00")
+
+    def test_type_filter(self):
+        rows = self.rows(type="repayment")
+        self.assertEqual([row[2] for row in rows], ["Loan Repayment"] * 3)
+        self.assertEqual([row[5] for row in rows], ["+$120.10", "+$333.33", "+$400.00"])
+
+    def test_date_filters_keep_account_balances(self):
+        day = lambda moment: moment.date().isoformat()
+        rows = self.rows(**{"from": day(self.moments[1]), "to": day(self.moments[4])})
+        self.assertEqual(len(rows), 6)
+        self.assertEqual({row[0] for row in rows}, {moment.strftime("%b %d, %Y") for moment in self.moments[1:7]})
+        # The newest row in range still shows the balance of the whole account at that point
+        self.assertEqual(rows[0][-1], "$5,733.58")
+
+    def test_gzip(self):
+        response = self.client.get(reverse("export_csv"), {"gzip": "1"})
+        self.assertEqual(response["Content-Type"], "application/gzip")
+        self.assertIn("transactions_export.csv.gz", response["Content-Disposition"])
+        self.assertEqual(gzip.decompress(b"".join(response.streaming_content)), self.export())
+
+    def test_bad_filters(self):
+        for params in ({"from": "yesterday"}, {"to": "2025-13-01"}, {"type": "loans"}):
+            with self.subTest(params):
+                self.assertEqual(self.client.get(reverse("export_csv"), params).status_code, 400)
+
+    def test_rows_are_streamed_as_they_are_read(self):
+        consumed = []
+
+        def rows():
+            for row in history_rows(self.lender, chunk_size=2):
+                consumed.append(row)
+                yield row
+
+        chunks = _csv_stream(rows(), batch=3)
+        next(chunks)
+        self.assertEqual(len(consumed), 0)
+        next(chunks)
+        self.assertEqual(len(consumed), 3)
+        self.assertEqual(len(list(chunks)), 2)
+        self.assertEqual(len(consumed), 9)
+
+
+@skipUnlessDBFeature("test_db_allows_multiple_connections")
+class ConcurrentPaymentTests(TransactionTestCase):
+    def test_parallel_payments_are_not_lost(self):
+        count, amount = 40, Decimal("5.00")
+        # Fully paid by exactly the last payment (0% interest)
+        loan = make_loan(amount * count, "0", 12)
+
+        def pay(_):
+            try:
+                apply_payment(Loan(pk=loan.pk, user_id=loan.user_id), amount, "Stress test")
+            finally:
+                close_old_connections()
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(pay, range(count)))
+
+        loan.refresh_from_db()
+        self.assertEqual(loan.paid_amount, amount * count)
+        self.assertEqual(LoanPayment.objects.filter(loan=loan).count(), count)
+        self.assertTrue(loan.closed)
+        self.assertEqual(loan.status, "Completed")
+
+    def test_concurrent_deliveries_credit_once(self):
+        checkout = make_checkout("ws_twice")
+        ids = [CallbackInbox.objects.create(body=stk_callback("ws_twice", "RCPTTWICE1")).pk for _ in range(4)]
+
+        def drain(pk):
+            try:
+                return drain_inbox(ids=[pk])[0].status
+            finally:
+                close_old_connections()
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            statuses = list(pool.map(drain, ids))
+
+        self.assertEqual(sorted(statuses), ["duplicate", "duplicate", "duplicate", "processed"])
+        self.assertEqual(LoanPayment.objects.filter(loan=checkout.loan).count(), 1)
+        self.assertEqual(MpesaReceipt.objects.filter(checkout_request_id="ws_twice").count(), 1)
+        checkout.loan.refresh_from_db()
+        self.assertEqual(checkout.loan.paid_amount, Decimal("100.00"))
+
+
+class CallbackParserTests(TestCase):
+    def body_with(self, **items):
+        body = json.loads(stk_callback("ws_1", "RCPT000001"))
+        body["Body"]["stkCallback"]["CallbackMetadata"]["Item"] = [
+            {"Name": name, "Value": value} for name, value in items.items()
+        ]
+        return json.dumps(body)
+
+    def test_successful_callback_fills_every_field(self):
+        callback = parse_stk_callback(stk_callback("ws_1", "RCPT000001", amount=100.5).encode())
+        self.assertEqual(
+            [getattr(callback, field) for field in StkCallback.__slots__],
+            ["ws_1", "m-1", 0, "The service request is processed successfully.",
+             Decimal("100.5"), "RCPT000001", "254700000000", "20250131235959"],
+        )
+        self.assertTrue(callback.succeeded)
+        self.assertFalse(hasattr(callback, "__dict__"))
+        with self.assertRaises(AttributeError):
+            callback.loan_id = 1
+
+    def test_failed_callback_needs_no_metadata(self):
+        callback = parse_stk_callback(json.dumps({"Body": {"stkCallback": {
+            "CheckoutRequestID": "ws_1", "ResultCode": "1032", "ResultDesc": "Request cancelled by user",
+        }}}))
+        self.assertEqual((callback.result_code, callback.amount, callback.succeeded), (1032, None, False))
+
+    def test_malformed_bodies(self):
+        for body in (
+            "{not json",
+            "[]",
+            json.dumps({"Body": {}}),
+            json.dumps({"Body": {"stkCallback": {"ResultCode": 0}}}),
+            json.dumps({"Body": {"stkCallback": {"CheckoutRequestID": "ws_1", "ResultCode": 0}}}),
+            self.body_with().replace("[]", "5"),
+            self.body_with().replace("[]", "[5]"),
+        ):
+            with self.subTest(body), self.assertRaises(MalformedCallback):
+                parse_stk_callback(body)
+
+    def test_invalid_fields(self):
+        for body in (
+            json.dumps({"Body": {"stkCallback": {"CheckoutRequestID": "", "ResultCode": 0}}}),
+            json.dumps({"Body": {"stkCallback": {"CheckoutRequestID": "ws_1", "ResultCode": "zero"}}}),
+            self.body_with(MpesaReceiptNumber="RCPT000001"),
+            self.body_with(Amount=100),
+            self.body_with(Amount="abc", MpesaReceiptNumber="RCPT000001"),
+            self.body_with(Amount=True, MpesaReceiptNumber="RCPT000001"),
+            self.body_with(Amount=[100], MpesaReceiptNumber="RCPT000001"),
+            self.body_with(Amount=0, MpesaReceiptNumber="RCPT000001"),
+            self.body_with(Amount=-5, MpesaReceiptNumber="RCPT000001"),
+            self.body_with(Amount="NaN", MpesaReceiptNumber="RCPT000001"),
+            self.body_with(Amount="Infinity", MpesaReceiptNumber="RCPT000001"),
+        ):
+            with self.subTest(body), self.assertRaises(InvalidCallbackField):
+                parse_stk_callback(body)
+
+    def test_non_finite_json_numbers(self):
+        # json accepts bare NaN/Infinity (rejected as a field); orjson rejects the body
+        for value in ("NaN", "Infinity", "-Infinity"):
+            body = self.body_with(Amount=1, MpesaReceiptNumber="RCPT000001")
+            body = body.replace('"Value": 1}', f'"Value": {value}}}')
+            self.assertIn(value, body)
+            with self.subTest(value), self.assertRaises(CallbackError):
+                parse_stk_callback(body)
+
+
+class CallbackInboxTests(TestCase):
+    def assertCreditedOnce(self, checkout):
+        self.assertEqual(LoanPayment.objects.filter(loan=checkout.loan).count(), 1)
+        self.assertEqual(MpesaReceipt.objects.filter(checkout_request_id=checkout.pk).count(), 1)
+        checkout.loan.refresh_from_db()
+        self.assertEqual(checkout.loan.paid_amount, Decimal("100.00"))
+
+    def test_duplicate_in_one_batch_is_credited_once(self):
+        checkout = make_checkout("ws_dup")
+        for _ in range(3):
+            CallbackInbox.objects.create(body=stk_callback("ws_dup", "RCPTDUP001"))
+
+        rows = drain_inbox()
+
+        self.assertEqual([row.status for row in rows], ["processed", "duplicate", "duplicate"])
+        self.assertCreditedOnce(checkout)
+
+    def test_duplicate_in_a_later_batch_is_credited_once(self):
+        checkout = make_checkout("ws_dup")
+        for _ in range(3):
+            CallbackInbox.objects.create(body=stk_callback("ws_dup", "RCPTDUP001"))
+
+        statuses = [row.status for _ in range(3) for row in drain_inbox(batch_size=1)]
+
+        self.assertEqual(statuses, ["processed", "duplicate", "duplicate"])
+        self.assertCreditedOnce(checkout)
+
+    def test_failing_row_does_not_hold_back_the_batch(self):
+        good, bad = make_checkout("ws_good"), make_checkout("ws_bad")
+        CallbackInbox.objects.create(body=stk_callback("ws_good", "RCPTGOOD01"))
+        CallbackInbox.objects.create(body=stk_callback("ws_bad", "RCPTBAD001", amount=10 ** 12))
+
+        def out_of_range(payments, method):
+            # What MySQL's strict mode does with an amount too large for the column
+            if any(amount >= 10 ** 10 for _, _, amount in payments):
+                raise DataError("Out of range value for column 'amount'")
+            return apply_payments(payments, method)
+
+        with mock.patch("app.mpesa.inbox.apply_payments", side_effect=out_of_range):
+            rows = drain_inbox()
+
+        self.assertEqual([row.status for row in rows], ["processed", "error"])
+        self.assertIn("DataError", rows[1].error)
+        self.assertEqual(CallbackInbox.objects.filter(status="received").count(), 0)
+        good.loan.refresh_from_db()
+        bad.loan.refresh_from_db()
+        self.assertEqual((good.loan.paid_amount, bad.loan.paid_amount), (Decimal("100.00"), Decimal("0.00")))
+
+    def test_receipt_conflict_keeps_receipts_of_resolved_checkouts(self):
+        make_checkout("ws_open")
+        make_checkout("ws_resolved", status="completed")
+        CallbackInbox.objects.create(body=stk_callback("ws_open", "RCPTOPEN01"))
+        CallbackInbox.objects.create(body=stk_callback("ws_resolved", "RCPTRESOL1"))
+
+        with mock.patch("app.mpesa.inbox._apply", side_effect=IntegrityError):
+            rows = drain_inbox()
+
+        self.assertEqual([row.status for row in rows], ["processed", "duplicate"])
+        self.assertEqual(
+            set(MpesaReceipt.objects.values_list("receipt_number", flat=True)), {"RCPTOPEN01", "RCPTRESOL1"},
+        )
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class AccessTokenTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.fetched = []
+
+    def fetch(self, expires_in=3599):
+        self.fetched.append(time.time())
+        return f"token-{len(self.fetched)}", expires_in
+
+    def test_token_is_shared_between_processes(self):
+        self.assertEqual(AccessTokenManager(self.fetch).get_token(), "token-1")
+        # A second worker finds it in the cache
+        self.assertEqual(AccessTokenManager(self.fetch).get_token(), "token-1")
+        self.assertEqual(len(self.fetched), 1)
+        self.assertEqual(
+            {key: value for key, value in AccessTokenManager().stats().items() if key != "expires_in"},
+            {"hits": 1, "misses": 1, "refreshes": 1},
+        )
+
+    def test_token_is_refreshed_before_it_expires(self):
+        manager = AccessTokenManager(self.fetch, refresh_margin=120)
+        now = time.time()
+        with mock.patch("app.mpesa.auth.time.time", return_value=now):
+            self.assertEqual(manager.get_token(), "token-1")
+            self.assertAlmostEqual(manager.stats()["expires_in"], 3599 - 120)
+        with mock.patch("app.mpesa.auth.time.time", return_value=now + 3599 - 119):
+            self.assertEqual(manager.get_token(), "token-2")
+
+    def test_concurrent_callers_fetch_once(self):
+        def slow_fetch():
+            time.sleep(0.3)
+            return self.fetch()
+
+        # One manager per caller, like separate gunicorn workers
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            tokens = list(pool.map(lambda _: AccessTokenManager(slow_fetch).get_token(), range(8)))
+
+        self.assertEqual(tokens, ["token-1"] * 8)
+        self.assertEqual(len(self.fetched), 1)
+
+    def test_caller_waits_for_the_refresh_lock(self):
+        cache.add(AccessTokenManager.LOCK_KEY, True)
+
+        def publish():
+            time.sleep(0.2)
+            cache.set(AccessTokenManager.CACHE_KEY, ("token-elsewhere", time.time() + 60))
+
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            pool.submit(publish)
+            self.assertEqual(AccessTokenManager(self.fetch).get_token(), "token-elsewhere")
+        self.assertEqual(self.fetched, [])
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class RateLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_burst_over_the_rate_queues_in_order(self):
+        bucket = TokenBucket("test", rate=5, burst=2)
+        with mock.patch("app.mpesa.ratelimit.time.time", return_value=1000.0):
+            waits = [bucket.reserve() for _ in range(5)]
+            self.assertEqual(bucket.queue_depth(), 3)
+        self.assertEqual([round(wait, 6) for wait in waits], [0, 0, 0.2, 0.4, 0.6])
+        with mock.patch("app.mpesa.ratelimit.time.time", return_value=1000.3):
+            self.assertEqual(bucket.queue_depth(), 2)
+        with mock.patch("app.mpesa.ratelimit.time.time", return_value=1001.0):
+            self.assertEqual(bucket.queue_depth(), 0)
+
+    def test_dispatcher_reports_waits(self):
+        dispatcher = StkPushDispatcher(rate=50, burst=2)
+
+        async def burst():
+            return await asyncio.gather(*[dispatcher.aacquire("174379") for _ in range(5)])
+
+        waits = sorted(asyncio.run(burst()))
+
+        for wait, expected in zip(waits, [0, 0, 0.02, 0.04, 0.06]):
+            self.assertAlmostEqual(wait, expected, delta=0.015)
+        stats = dispatcher.stats("174379")
+        self.assertEqual((stats["dispatched"], stats["delayed"], stats["waiting"]), (5, 3, 0))
+        self.assertAlmostEqual(stats["max_wait"], 0.06, delta=0.015)
+        self.assertAlmostEqual(stats["avg_wait"], sum(waits) / 5)
+        self.assertEqual(stats["queue_depth"], 0)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.breaker = CircuitBreaker("test", failure_threshold=3, window=60, reset_timeout=30)
+
+    def fail(self, times=1):
+        for _ in range(times):
+            self.breaker.record_failure(self.breaker.before_call())
+
+    def open_breaker(self):
+        self.fail(3)
+        # The breaker stores wall-clock times; move past the reset timeout
+        return mock.patch("app.mpesa.breaker.time.time", return_value=time.time() + 31)
+
+    def test_opens_at_the_failure_threshold(self):
+        self.fail(2)
+        self.assertEqual(self.breaker.state(), "closed")
+        self.fail()
+        self.assertEqual(self.breaker.state(), "open")
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+        self.assertEqual(self.breaker.stats()["trips"], 1)
+
+    def test_success_resets_the_failure_count(self):
+        self.fail(2)
+        self.breaker.record_success(self.breaker.before_call())
+        self.fail(2)
+        self.assertEqual(self.breaker.state(), "closed")
+
+    def test_half_open_lets_a_single_probe_through(self):
+        with self.open_breaker():
+            self.assertEqual(self.breaker.state(), "half-open")
+            self.assertTrue(self.breaker.before_call()["probe"])
+            with self.assertRaises(CircuitOpenError):
+                self.breaker.before_call()
+
+    def test_probe_success_closes_the_breaker(self):
+        with self.open_breaker():
+            self.breaker.record_success(self.breaker.before_call())
+            self.assertEqual(self.breaker.state(), "closed")
+            self.assertFalse(self.breaker.before_call()["probe"])
+        self.assertEqual(self.breaker.stats()["recoveries"], 1)
+
+    def test_probe_failure_reopens_the_breaker(self):
+        with self.open_breaker():
+            self.breaker.record_failure(self.breaker.before_call())
+            self.assertEqual(self.breaker.state(), "open")
+            with self.assertRaises(CircuitOpenError):
+                self.breaker.before_call()
+        self.assertEqual(self.breaker.stats()["recoveries"], 0)
+
+
+class StkPushJobTests(TransactionTestCase):
+    def setUp(self):
+        self.loan = make_loan("1000", "8", 12)
+        self.job = jobs.enqueue_stk_push(self.loan, self.loan.user, "254700000000", Decimal("100"))
+
+    def push(self, response, track_checkout=None):
+        push = mock.AsyncMock(return_value=response)
+        with mock.patch.object(jobs, "alipa_na_mpesa_stk_push", push), \
+                mock.patch.object(jobs, "track_checkout", side_effect=track_checkout, autospec=True):
+            return asyncio.run(jobs.process_batch(jobs.claim_jobs(10), concurrency=2))
+
+    def test_sent_job_stays_sent_when_tracking_fails(self):
+        results = self.push({"ResponseCode": "0", "CheckoutRequestID": "ws_1"}, track_checkout=RuntimeError("db down"))
+        self.assertEqual(len(results), 1)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, "sent")
+        self.assertEqual(self.job.checkout_request_id, "ws_1")
+        self.assertIsNone(self.job.locked_until)
+        self.assertFalse(jobs.claim_jobs(10))
+
+    def test_tracking_is_saved_with_the_job(self):
+        with mock.patch.object(jobs, "alipa_na_mpesa_stk_push",
+                               mock.AsyncMock(return_value={"ResponseCode": "0", "CheckoutRequestID": "ws_2"})):
+            asyncio.run(jobs.process_batch(jobs.claim_jobs(10), concurrency=2))
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, "sent")
+        self.assertTrue(PendingCheckout.objects.filter(checkout_request_id="ws_2").exists())
+
+    @override_settings(MPESA_JOB_LEASE_SECONDS=0.3)
+    def test_lease_is_renewed_while_the_push_waits(self):
+        async def slow_push(**kwargs):
+            await asyncio.sleep(0.6)
+            # Well past the first lease: another worker must not get the job
+            self.assertEqual(await jobs.sync_to_async(jobs.claim_jobs)(10), [])
+            return {"ResponseCode": "0", "CheckoutRequestID": "ws_3"}
+
+        with mock.patch.object(jobs, "alipa_na_mpesa_stk_push", slow_push):
+            results = asyncio.run(jobs.process_batch(jobs.claim_jobs(10), concurrency=2))
+        self.assertNotIsInstance(results[0], Exception)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, "sent")
+
+    def test_timed_out_push_is_not_sent_again(self):
+        sent = []
+
+        def daraja(request):
+            sent.append(request)
+            raise httpx.ReadTimeout("timed out", request=request)
+
+        async def run(claimed):
+            client = async_client.get_async_daraja_client()
+            client.http = httpx.AsyncClient(transport=httpx.MockTransport(daraja))
+            try:
+                return await jobs.process_batch(claimed, concurrency=1)
+            finally:
+                await client.aclose()
+
+        with mock.patch.object(async_client.token_manager, "aget_token", mock.AsyncMock(return_value="token")):
+            asyncio.run(run(jobs.claim_jobs(10)))
+            # Nothing left for this or any other worker to send
+            self.assertEqual(jobs.claim_jobs(10), [])
+
+        self.assertEqual(len(sent), 1)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.status, "unknown")
+        self.assertFalse(PendingCheckout.objects.exists())
+
+    def test_callback_for_an_unknown_push_is_credited(self):
+        self.job.status = "unknown"
+        self.job.save()
+        CallbackInbox.objects.create(body=stk_callback("ws_late", "RCPTLATE01"))
+
+        [row] = drain_inbox()
+        self.assertEqual(row.status, "processed")
+        self.job.refresh_from_db()
+        self.assertEqual((self.job.status, self.job.checkout_request_id), ("sent", "ws_late"))
+        self.assertEqual(PendingCheckout.objects.get(pk="ws_late").status, "completed")
+        self.loan.refresh_from_db()
+        self.assertEqual(self.loan.paid_amount, Decimal("100.00"))
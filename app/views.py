@@ -1,27 +1,45 @@
 import json
+import logging
+import uuid
 from decimal import Decimal, InvalidOperation
 
 from django.conf import settings
+from django.db import transaction
+from django.db.models import ProtectedError
 from django.core.mail import send_mail
 
-from app.mpesa.stk_push import lipa_na_mpesa_stk_push
+from asgiref.sync import sync_to_async
+
+from app.mpesa.breaker import UNAVAILABLE_MESSAGE, daraja_unavailable
+from app.mpesa.inbox import drain_inbox
+from app.mpesa.jobs import enqueue_stk_push
+from app.mpesa.log import correlation, get_correlation_id
+from app.mpesa.reconcile import track_checkout
+from app.mpesa.utils import normalize_phone_number
 from django.views.decorators.csrf import csrf_exempt
-from django.db.models.functions import Coalesce
 from django.utils import timezone
-from django.db.models import Sum, DecimalField, F
 from django.shortcuts import render, redirect,get_object_or_404
 from django.contrib.auth import authenticate, login, get_user_model, update_session_auth_hash, logout
-from .models import Notification, LenderWallet, Transaction, Loan, LoanApplication, LoanPayment
+from .models import Notification, LenderWallet, Transaction, Loan, LoanApplication, LoanPayment, CallbackInbox
 from django.contrib.auth.hashers import make_password
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_date
 import csv
+import datetime
+import zlib
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
+from . import ledger, lender_stats, schedule
 from .forms import LoanApplicationForm, ContactForm
+from .history import SOURCE_NAMES, history, history_rows
+from .pagination import paginate
+from .payments import apply_payment
+from .stats import lender_cards, loan_stats
 from django.http import JsonResponse
 
 # Create your views here.
 User = get_user_model()
+logger = logging.getLogger(__name__)
 
 def index(request):
     return render(request, 'index.html')
@@ -136,15 +154,13 @@ def apply_loan(request):
 @login_required
 def my_loans(request):
 
-    # Only final loans for the logged-in user
-    loans = Loan.objects.filter(user=request.user).order_by('-created_at')
+    # Only final loans for the logged-in user, one page at a time
+    loans = paginate(request, Loan.objects.filter(user=request.user).select_related('user'), '-created_at')
 
-    total_borrowed = sum([l.amount for l in loans])
-    active_loans_count = loans.filter(status='Active', closed=False).count()
-    total_outstanding = sum([
-        (l.amount + (l.amount * l.interest_rate / 100) - l.paid_amount)
-        for l in loans if l.status == 'Active'
-    ])
+    cards = loan_stats(Loan.objects.filter(user=request.user), "total_amount", "active_count", "outstanding")
+    total_borrowed = cards['total_amount']
+    active_loans_count = cards['active_count']
+    total_outstanding = cards['outstanding']
 
     # Attach calculated progress field from the model
     loans_with_progress = []
@@ -156,6 +172,7 @@ def my_loans(request):
 
     context = {
         'loans': loans,
+        'page': loans,
         'loans_with_progress': loans_with_progress,
         'total_borrowed': total_borrowed,
         'active_loans': active_loans_count,
@@ -178,15 +195,118 @@ def format_phone_for_mpesa(phone):
     if phone.startswith("0"):
         phone = "254" + phone[1:]
     return phone
+def _validate_repayment(request):
+    """
+    Validate the posted repayment form.
+    Returns (loan, amount, None) on success or (None, None, redirect_response) on failure.
+    """
+    loan_id = request.POST.get("loan")
+    amount = request.POST.get("amount")
+    payment_method = request.POST.get("payment_method")
+
+    logger.debug("Repayment request loan=%s amount=%s method=%s", loan_id, amount, payment_method)
+
+    # Validation
+    if not loan_id or not amount:
+        messages.error(request, "Please select a loan and enter an amount.")
+        return None, None, redirect("repay_loan")
+
+    if not payment_method:
+        messages.error(request, "Please select a payment method.")
+        return None, None, redirect("repay_loan")
+
+    # Validate amount
+    try:
+        amount = Decimal(amount)
+        if amount <= 0:
+            messages.error(request, "Amount must be greater than zero.")
+            return None, None, redirect("repay_loan")
+    except (ValueError, InvalidOperation) as e:
+        logger.info("Repayment rejected: invalid amount %r (%s)", amount, e)
+        messages.error(request, "Invalid amount format.")
+        return None, None, redirect("repay_loan")
+
+    # Get the loan
+    try:
+        loan = Loan.objects.get(id=loan_id, user=request.user)
+    except Loan.DoesNotExist:
+        logger.info("Repayment rejected: loan %s not found", loan_id)
+        messages.error(request, "Loan not found.")
+        return None, None, redirect("repay_loan")
+
+    # Check if loan is active
+    if loan.status != "Active" or loan.closed:
+        logger.info("Repayment rejected: loan #%s not active (status=%s, closed=%s)", loan.id, loan.status, loan.closed)
+        messages.error(request, "This loan is not active.")
+        return None, None, redirect("repay_loan")
+
+    # Check if amount exceeds balance
+    if amount > loan.balance:
+        logger.info("Repayment rejected: %s exceeds balance %s on loan #%s", amount, loan.balance, loan.id)
+        messages.error(request, f"Payment amount (${amount}) exceeds outstanding balance (${loan.balance}).")
+        return None, None, redirect("repay_loan")
+
+    return loan, amount, None
 @login_required
-def repay_loan(request):
+async def repay_loan(request):
+    """
+    Handle loan repayment via M-Pesa STK Push or Manual Payment.
+
+    The M-Pesa branch only queues an STK push job (see mpesa_worker), so
+    web latency no longer depends on Daraja. Manual payments and the GET
+    form use the sync path.
     """
-    Handle loan repayment via M-Pesa STK Push or Manual Payment
+    with correlation():
+        if request.method == "POST" and request.POST.get("payment_method") == "mpesa":
+            return await _repay_loan_mpesa(request)
+        return await sync_to_async(_repay_loan)(request)
+async def _repay_loan_mpesa(request):
     """
-    print("\n" + "=" * 70)
-    print("REPAY LOAN VIEW CALLED")
-    print("=" * 70)
+    M-PESA PAYMENT: queue an STK Push job and return right away
+    """
+    loan, amount, error_response = await sync_to_async(_validate_repayment)(request)
+    if error_response:
+        return error_response
+
+    # Format phone number for M-Pesa
+    user = await request.auser()
+    phone = user.phone
+
+    if not phone:
+        logger.info("M-Pesa repayment rejected: no phone number in profile")
+        messages.error(request, "Phone number not found in your profile. Please update your profile.")
+        return redirect("bsettings")
+
+    # Format to international format (254XXXXXXXXX)
+    try:
+        phone = normalize_phone_number(phone)
+    except ValueError:
+        logger.info("M-Pesa repayment rejected: invalid phone %s", phone)
+        messages.error(request, "Invalid phone number format. Please update your profile.")
+        return redirect("bsettings")
+
+    # Fail fast while Daraja is down instead of queueing a push that cannot go out
+    if await sync_to_async(daraja_unavailable)():
+        logger.info("M-Pesa repayment rejected: circuit breaker open")
+        messages.error(request, UNAVAILABLE_MESSAGE)
+        return redirect("repay_loan")
+
+    # Queue the STK push; mpesa_worker sends it so this request never waits on Daraja
+    job = await sync_to_async(enqueue_stk_push)(loan, user, phone, amount, get_correlation_id())
+    logger.info(
+        "STK push job #%s queued for loan #%s", job.id, loan.id,
+        extra={"job_id": job.id, "loan_id": loan.id, "amount": str(amount)},
+    )
+    messages.success(
+        request,
+        "Payment request received! You will get an M-Pesa prompt on your phone shortly - enter your PIN to complete the payment."
+    )
 
+    return redirect("repay_loan")
+def _repay_loan(request):
+    """
+    Sync part of repay_loan: the repayment form and manual payments
+    """
     # Get all active loans for this borrower
     active_loans = Loan.objects.filter(
         user=request.user,
@@ -194,182 +314,34 @@ def repay_loan(request):
         closed=False
     ).order_by('-funded_date')
 
-    print(f"Active loans for user {request.user.username}: {active_loans.count()}")
-
     selected_loan_data = None
 
     if request.method == "POST":
-        print("\n--- POST REQUEST ---")
-        loan_id = request.POST.get("loan")
-        amount = request.POST.get("amount")
-        payment_method = request.POST.get("payment_method")  # NEW: Get payment method
-
-        print(f"Loan ID: {loan_id}")
-        print(f"Amount: {amount}")
-        print(f"Payment Method: {payment_method}")
-
-        # Validation
-        if not loan_id or not amount:
-            messages.error(request, "Please select a loan and enter an amount.")
-            return redirect("repay_loan")
-
-        if not payment_method:
-            messages.error(request, "Please select a payment method.")
-            return redirect("repay_loan")
-
-        # Validate amount
-        try:
-            amount = Decimal(amount)
-            if amount <= 0:
-                messages.error(request, "Amount must be greater than zero.")
-                return redirect("repay_loan")
-            print(f"✓ Amount validated: {amount}")
-        except (ValueError, InvalidOperation) as e:
-            print(f"✗ Amount validation error: {e}")
-            messages.error(request, "Invalid amount format.")
-            return redirect("repay_loan")
-
-        # Get the loan
-        try:
-            loan = Loan.objects.get(id=loan_id, user=request.user)
-            print(f"✓ Loan found: #{loan.id}")
-        except Loan.DoesNotExist:
-            print(f"✗ Loan not found")
-            messages.error(request, "Loan not found.")
-            return redirect("repay_loan")
+        payment_method = request.POST.get("payment_method")
 
-        # Check if loan is active
-        if loan.status != "Active" or loan.closed:
-            print(f"✗ Loan not active: status={loan.status}, closed={loan.closed}")
-            messages.error(request, "This loan is not active.")
-            return redirect("repay_loan")
-
-        # Check if amount exceeds balance
-        if amount > loan.balance:
-            print(f"✗ Amount exceeds balance: {amount} > {loan.balance}")
-            messages.error(request, f"Payment amount (${amount}) exceeds outstanding balance (${loan.balance}).")
-            return redirect("repay_loan")
+        loan, amount, error_response = _validate_repayment(request)
+        if error_response:
+            return error_response
 
         # ===== PAYMENT METHOD HANDLING =====
 
         if payment_method == "manual":
             # MANUAL PAYMENT: Instant deduction
-            print("\n--- MANUAL PAYMENT SELECTED ---")
-
             try:
-                # Update loan
-                old_paid = loan.paid_amount
-                loan.paid_amount += amount
-                new_paid = loan.paid_amount
-
-                print(f"Old paid amount: ${old_paid}")
-                print(f"Payment amount: ${amount}")
-                print(f"New paid amount: ${new_paid}")
-                print(f"Total due: ${loan.amount + loan.interest}")
-
-                # Check if fully paid
-                if loan.paid_amount >= (loan.amount + loan.interest):
-                    loan.status = "Completed"
-                    loan.closed = True
-                    print(f"✓ Loan fully paid and closed")
-
-                loan.save()
-
-                # Create payment record
-                payment = LoanPayment.objects.create(
-                    loan=loan,
-                    user=loan.user,
-                    amount=amount,
-                    payment_method="Manual"
-                )
-                print(f"✓ Payment record created: #{payment.id}")
+                apply_payment(loan, amount, "Manual")
 
                 messages.success(
                     request,
                     f"Payment of ${amount} processed successfully! New balance: ${loan.balance}"
                 )
 
-                print("=" * 70 + "\n")
                 return redirect("my_loans")
 
             except Exception as e:
-                print(f"✗ Manual payment error: {e}")
-                import traceback
-                traceback.print_exc()
+                logger.exception("Manual payment failed for loan #%s", loan.id)
                 messages.error(request, f"Payment processing failed: {str(e)}")
                 return redirect("repay_loan")
 
-        elif payment_method == "mpesa":
-            # M-PESA PAYMENT: STK Push
-            print("\n--- M-PESA PAYMENT SELECTED ---")
-
-            # Format phone number for M-Pesa
-            phone = request.user.phone
-            print(f"Original phone: {phone}")
-
-            if not phone:
-                print(f"✗ No phone number in profile")
-                messages.error(request, "Phone number not found in your profile. Please update your profile.")
-                return redirect("bsettings")
-
-            # Format to international format (254XXXXXXXXX)
-            phone = str(phone).strip()
-            phone = phone.replace(" ", "").replace("-", "").replace("+", "")
-
-            if phone.startswith("0"):
-                phone = "254" + phone[1:]
-            elif phone.startswith("7") or phone.startswith("1"):
-                phone = "254" + phone
-            elif not phone.startswith("254"):
-                print(f"✗ Invalid phone format: {phone}")
-                messages.error(request, "Invalid phone number format. Please update your profile.")
-                return redirect("bsettings")
-
-            print(f"Formatted phone: {phone}")
-
-            # Initiate M-Pesa STK Push
-            print("\nInitiating STK Push...")
-            try:
-                response = lipa_na_mpesa_stk_push(
-                    phone=phone,
-                    amount=int(amount),
-                    account_reference=f"Loan-{loan.id}",
-                    description=f"Loan Repayment for Loan #{loan.id}",
-                )
-
-                print(f"\nSTK Push Response:")
-                print(f"Type: {type(response)}")
-                print(f"Content: {response}")
-
-                # Check response
-                if response and isinstance(response, dict):
-                    response_code = response.get("ResponseCode")
-                    print(f"Response Code: {response_code}")
-
-                    if response_code == "0":
-                        print("✓ STK Push successful!")
-                        messages.success(
-                            request,
-                            "Payment request sent! Please check your phone and enter your M-Pesa PIN to complete the payment."
-                        )
-                    else:
-                        error_message = response.get("errorMessage") or response.get(
-                            "ResponseDescription") or "Unknown error"
-                        print(f"✗ STK Push failed: {error_message}")
-                        messages.error(request, f"Failed to initiate payment: {error_message}")
-                else:
-                    print(f"✗ Invalid response format: {response}")
-                    messages.error(request, "Failed to initiate payment: Invalid response from M-Pesa")
-
-            except Exception as e:
-                print(f"✗ Exception during STK Push: {e}")
-                import traceback
-                traceback.print_exc()
-                messages.error(request, f"Payment error: {str(e)}")
-
-            print("=" * 70 + "\n")
-            return redirect("repay_loan")
-
         else:
             messages.error(request, "Invalid payment method selected.")
             return redirect("repay_loan")
@@ -380,7 +352,6 @@ def repay_loan(request):
     if loan_id:
         try:
             selected_loan_data = Loan.objects.get(id=loan_id, user=request.user)
-            print(f"Selected loan: #{selected_loan_data.id}")
         except Loan.DoesNotExist:
             messages.warning(request, "Selected loan not found.")
 
@@ -393,14 +364,9 @@ def repay_loan(request):
 @csrf_exempt
 def mpesa_stk_callback(request):
     """
-    Handle M-Pesa STK Push callback
+    Handle M-Pesa STK Push callback: store the raw body in the inbox and
+    acknowledge right away. `manage.py mpesa_callbacks` credits the payment.
     """
-    print("\n" + "=" * 70)
-    print("M-PESA CALLBACK RECEIVED")
-    print("=" * 70)
-    print(f"Method: {request.method}")
-    print(f"Content-Type: {request.content_type}")
-
     # Handle GET requests (for testing)
     if request.method == "GET":
         return JsonResponse({
@@ -408,159 +374,22 @@ def mpesa_stk_callback(request):
             "status": "ready"
         })
 
-    # Log raw body
+    # Decode raw body
     try:
         raw_body = request.body.decode('utf-8')
-        print(f"Raw Body:\n{raw_body}")
-    except Exception as e:
-        print(f"Could not decode body: {e}")
+    except UnicodeDecodeError as e:
+        logger.warning("Could not decode M-Pesa callback body: %s", e)
         return JsonResponse({
             "ResultCode": 1,
             "ResultDesc": "Could not decode request body"
         }, status=400)
 
-    # Parse JSON
-    try:
-        data = json.loads(raw_body)
-        print(f"Parsed JSON:\n{json.dumps(data, indent=2)}")
-    except json.JSONDecodeError as e:
-        print(f"JSON Decode Error: {e}")
-        print(f"Invalid JSON received")
-        return JsonResponse({
-            "ResultCode": 1,
-            "ResultDesc": "Invalid JSON format"
-        }, status=400)
-
-    # Extract callback data
-    try:
-        body = data.get("Body", {})
-        stk_callback = body.get("stkCallback", {})
-        result_code = stk_callback.get("ResultCode")
-        result_desc = stk_callback.get("ResultDesc", "No description")
-
-        print(f"Result Code: {result_code}")
-        print(f"Result Description: {result_desc}")
-
-        # Payment failed
-        if result_code != 0:
-            print(f"✗ Payment failed or cancelled")
-            return JsonResponse({
-                "ResultCode": 0,
-                "ResultDesc": "Callback acknowledged"
-            })
-
-        # Extract metadata
-        callback_metadata = stk_callback.get("CallbackMetadata", {})
-        items = callback_metadata.get("Item", [])
-
-        if not items:
-            print("✗ No callback items found")
-            return JsonResponse({
-                "ResultCode": 0,
-                "ResultDesc": "No metadata"
-            })
-
-        # Parse items
-        amount = None
-        mpesa_receipt = None
-        phone = None
-        transaction_date = None
-
-        for item in items:
-            name = item.get("Name")
-            value = item.get("Value")
-
-            if name == "Amount":
-                amount = Decimal(str(value))
-            elif name == "MpesaReceiptNumber":
-                mpesa_receipt = value
-            elif name == "PhoneNumber":
-                phone = str(value)
-            elif name == "TransactionDate":
-                transaction_date = value
-
-        print(f"Amount: {amount}")
-        print(f"Receipt: {mpesa_receipt}")
-        print(f"Phone: {phone}")
-
-        # Extract account reference
-        account_ref = stk_callback.get("AccountReference", "")
-        print(f"Account Reference: {account_ref}")
-
-        if not account_ref or not account_ref.startswith("Loan-"):
-            print(f"✗ Invalid account reference format")
-            return JsonResponse({
-                "ResultCode": 0,
-                "ResultDesc": "Invalid reference format"
-            })
-
-        # Parse loan ID
-        try:
-            loan_id = int(account_ref.split("-")[1])
-            print(f"Loan ID: {loan_id}")
-        except (IndexError, ValueError) as e:
-            print(f"✗ Could not parse loan ID: {e}")
-            return JsonResponse({
-                "ResultCode": 0,
-                "ResultDesc": "Invalid loan ID"
-            })
-
-        # Get loan
-        try:
-            loan = Loan.objects.get(id=loan_id)
-            print(f"✓ Loan found: #{loan.id}")
-        except Loan.DoesNotExist:
-            print(f"✗ Loan #{loan_id} not found in database")
-            return JsonResponse({
-                "ResultCode": 0,
-                "ResultDesc": "Loan not found"
-            })
-
-        # Update loan
-        old_paid = loan.paid_amount
-        loan.paid_amount += amount
-        new_paid = loan.paid_amount
-
-        print(f"Old paid amount: ${old_paid}")
-        print(f"Payment amount: ${amount}")
-        print(f"New paid amount: ${new_paid}")
-        print(f"Total due: ${loan.amount + loan.interest}")
-
-        # Check if fully paid
-        if loan.paid_amount >= (loan.amount + loan.interest):
-            loan.status = "Completed"
-            loan.closed = True
-            print(f"✓ Loan fully paid and closed")
-
-        loan.save()
-
-        # Create payment record
-        payment = LoanPayment.objects.create(
-            loan=loan,
-            user=loan.user,
-            amount=amount,
-            payment_method="M-Pesa"
-        )
-        print(f"✓ Payment record created: #{payment.id}")
-
-        print(f"✓ Payment processed successfully!")
-        print("=" * 70 + "\n")
+    CallbackInbox.objects.create(body=raw_body)
 
-        return JsonResponse({
-            "ResultCode": 0,
-            "ResultDesc": "Payment received and processed"
-        })
-
-    except Exception as e:
-        print(f"✗ Unexpected error: {e}")
-        import traceback
-        traceback.print_exc()
-        print("=" * 70 + "\n")
-
-        return JsonResponse({
-            "ResultCode": 1,
-            "ResultDesc": f"Processing error: {str(e)}"
-        }, status=500)
+    return JsonResponse({
+        "ResultCode": 0,
+        "ResultDesc": "Accepted"
+    })
 
 @login_required
 @csrf_exempt
@@ -577,19 +406,29 @@ def test_mpesa_callback(request):
         loan_id = request.POST.get("loan_id")
         amount = request.POST.get("amount")
 
+        loan = get_object_or_404(Loan, id=loan_id)
+        test_id = uuid.uuid4().hex[:12]
+
+        # Record the checkout an accepted STK push would have created, so the
+        # callback can be matched to the loan. Unique per test, or the
+        # callback would be ignored as a duplicate.
+        checkout = {
+            "MerchantRequestID": f"test-merchant-{test_id}",
+            "CheckoutRequestID": f"test-checkout-{test_id}",
+        }
+        track_checkout(checkout, loan.id, loan.user_id, Decimal(amount), "254708374149")
+
         # Simulate successful callback data
         simulated_callback = {
             "Body": {
                 "stkCallback": {
-                    "MerchantRequestID": "test-merchant-123",
-                    "CheckoutRequestID": "test-checkout-456",
+                    **checkout,
                     "ResultCode": 0,
                     "ResultDesc": "The service request is processed successfully.",
-                    "AccountReference": f"Loan-{loan_id}",
                     "CallbackMetadata": {
                         "Item": [
                             {"Name": "Amount", "Value": float(amount)},
-                            {"Name": "MpesaReceiptNumber", "Value": f"TEST{loan_id}"},
+                            {"Name": "MpesaReceiptNumber", "Value": f"TEST{test_id[:6].upper()}"},
                             {"Name": "PhoneNumber", "Value": "254708374149"},
                             {"Name": "TransactionDate", "Value": 20241210120000}
                         ]
@@ -605,6 +444,8 @@ def test_mpesa_callback(request):
         test_request._body = json.dumps(simulated_callback).encode()
 
         response = mpesa_stk_callback(test_request)
+        # Credit it now instead of waiting for the mpesa_callbacks worker
+        drain_inbox()
 
         messages.success(request, f"Test callback processed! Loan #{loan_id} updated with payment of ${amount}")
         return redirect('my_loans')
@@ -615,12 +456,14 @@ def bnotifications(request):
     notes = Notification.objects.filter(
         user=request.user,
         role="borrower"
-    ).order_by("-created_at")
+    )
 
     unread_count = notes.filter(read=False).count()
+    page = paginate(request, notes, "-created_at")
 
     return render(request, "borrower/bnotifications.html", {
-        "notifications": notes,
+        "notifications": page,
+        "page": page,
         "unread_count": unread_count,
     })
 
@@ -629,12 +472,14 @@ def lnotifications(request):
     notes = Notification.objects.filter(
         user=request.user,
         role="lender"
-    ).order_by("-created_at")
+    )
 
     unread_count = notes.filter(read=False).count()
+    page = paginate(request, notes, "-created_at")
 
     return render(request, "lender/lnotifications.html", {
-        "notifications": notes,
+        "notifications": page,
+        "page": page,
         "unread_count": unread_count,
     })
 
@@ -646,21 +491,16 @@ def borrower(request):
     """Borrower dashboard showing loans, stats, and recent activity."""
 
     # Get all loans for this user
-    loans = Loan.objects.filter(user=request.user).order_by('-created_at')
+    loans = Loan.objects.filter(user=request.user).prefetch_related(schedule.prefetch_unpaid()).order_by('-created_at')
 
-    # Stats calculations
-    total_borrowed = sum([l.amount for l in loans])
-    active_loans_count = loans.filter(status='Active', closed=False).count()
-    total_outstanding = sum([
-        (l.amount + (l.amount * l.interest_rate / 100) - l.paid_amount)
-        for l in loans if l.status == 'Active'
-    ])
+    # Stats calculations (one aggregate query)
+    cards = loan_stats(Loan.objects.filter(user=request.user), "total_amount", "active_count", "outstanding")
 
     # Stats for dashboard
     stats = [
-        {'title': 'Total Borrowed', 'value': total_borrowed, 'icon': '💰'},
-        {'title': 'Active Loans', 'value': active_loans_count, 'icon': '📊'},
-        {'title': 'Total Outstanding', 'value': total_outstanding, 'icon': '⚠️'},
+        {'title': 'Total Borrowed', 'value': cards['total_amount'], 'icon': '💰'},
+        {'title': 'Active Loans', 'value': cards['active_count'], 'icon': '📊'},
+        {'title': 'Total Outstanding', 'value': cards['outstanding'], 'icon': '⚠️'},
     ]
 
     # Build loan objects compatible with your template
@@ -673,14 +513,14 @@ def borrower(request):
             'progress_percent': loan.progress_percent,  # Model @property
             'paid_amount': loan.paid_amount,
             'interest_rate': loan.interest_rate,
-            'next_payment': getattr(loan, "next_payment", None),
+            'next_payment': loan.next_payment,
         })
 
     # Recent activities: payments only
     recent_activity = [
         {
             'date': payment.created_at.strftime('%b %d, %Y'),
-            'description': f"Repayment for Loan #{payment.loan.id}",
+            'description': f"Repayment for Loan #{payment.loan_id}",
             'amount': payment.amount,
             'type': 'payment'
         }
@@ -703,42 +543,16 @@ def lender(request):
     if request.user.role != "lender":
         return redirect("borrower")
 
-    # Get all loans funded by this lender
-    funded_loans = Loan.objects.filter(lender=request.user)
-    active_loans = funded_loans.filter(status='Active', closed=False)
-
-    # Calculate Total Invested
-    total_invested = funded_loans.aggregate(
-        total=Coalesce(Sum('amount'), Decimal('0.00'))
-    )['total']
-
-    # Calculate Total Earnings (interest from all loans)
-    total_earnings = funded_loans.aggregate(
-        total=Coalesce(
-            Sum((F('amount') * F('interest_rate') / 100), output_field=DecimalField()),
-            Decimal('0.00')
-        )
-    )['total']
-
-    # Calculate Actual Earnings (from payments received)
-    actual_earnings = funded_loans.aggregate(
-        total=Coalesce(
-            Sum(F('paid_amount') - F('amount'), output_field=DecimalField()),
-            Decimal('0.00')
-        )
-    )['total']
-    # Ensure non-negative
-    if actual_earnings < 0:
-        actual_earnings = Decimal('0.00')
-
-    # Active loans count
-    active_loans_count = active_loans.count()
-
-    # Pending loan requests (applications not yet processed)
-    pending_requests = LoanApplication.objects.filter(status='pending').count()
+    # Running totals maintained by app/lender_stats.py, the 30-day window and
+    # pending loan requests (applications not yet processed): one query
+    stats, recent_invested, pending_requests = lender_cards(request.user)
+    total_invested = stats.total_invested
+    total_earnings = stats.expected_earnings
+    actual_earnings = stats.actual_earnings
+    active_loans_count = stats.active_count
 
     # Recent Activity - Last 5 transactions
-    recent_loans = funded_loans.order_by('-funded_date')[:5]
+    recent_loans = Loan.objects.filter(lender=request.user).select_related('user').order_by('-funded_date')[:5]
     activities = []
     for loan in recent_loans:
         activities.append({
@@ -748,39 +562,19 @@ def lender(request):
             'status': loan.status
         })
 
-    # Portfolio Overview - Distribution by loan purpose
-    from django.db.models import Count, Sum as DbSum
-
-    portfolio_data = funded_loans.values('purpose').annotate(
-        count=Count('id'),
-        total_amount=DbSum('amount')
-    ).order_by('-total_amount')
-
-    # Calculate percentages for portfolio
+    # Portfolio Overview - Distribution by loan purpose (top 5 categories)
     portfolio = []
     if total_invested > 0:
-        for item in portfolio_data[:5]:  # Top 5 categories
-            percentage = (item['total_amount'] / total_invested) * 100
+        for item in lender_stats.top_purposes(request.user):
+            percentage = (item.total_amount / total_invested) * 100
             portfolio.append({
-                'category': item['purpose'].title(),
+                'category': item.purpose.title(),
                 'percentage': round(percentage, 1),
-                'amount': item['total_amount']
+                'amount': item.total_amount
             })
 
-    # Calculate growth percentages (placeholder - you can implement actual calculation)
-    # For now, we'll calculate based on recent vs older loans
-    from datetime import timedelta
-    from django.utils import timezone
-
-    thirty_days_ago = timezone.now() - timedelta(days=30)
-
-    recent_invested = funded_loans.filter(
-        funded_date__gte=thirty_days_ago
-    ).aggregate(total=Coalesce(Sum('amount'), Decimal('0.00')))['total']
-
-    older_invested = funded_loans.filter(
-        funded_date__lt=thirty_days_ago
-    ).aggregate(total=Coalesce(Sum('amount'), Decimal('0.00')))['total']
+    # Growth: funded in the last 30 days against everything funded before
+    older_invested = total_invested - recent_invested
 
     if older_invested > 0:
         investment_growth = ((recent_invested / older_invested) * 100)
@@ -808,10 +602,11 @@ def loan_requests(request):
     if request.user.role != "lender":
         return redirect("dashboard")
 
-    pending = LoanApplication.objects.filter(status="pending")
+    pending = paginate(request, LoanApplication.objects.filter(status="pending").select_related("user"), "-created_at")
 
     return render(request, "lender/loan_requests.html", {
-        "requests": pending
+        "requests": pending,
+        "page": pending,
     })
 def calculate_monthly_payment(amount, duration, interest_rate=Decimal("8.00")):
     monthly_rate = interest_rate / Decimal(100 * 12)
@@ -837,27 +632,35 @@ def fund_loan(request, application_id):
         interest_rate=application.interest_rate
     )
 
-    # Create Loan record
-    loan = Loan.objects.create(
-        user=application.user,
-        amount=application.amount,
-        purpose=application.purpose,
-        duration=application.duration,
-        interest_rate=application.interest_rate,
-        start_date=timezone.now().date(),
-        paid_amount=Decimal('0.00'),
-        closed=False,
-        status="Active",
-        application_id=application.id,  # link back to LoanApplication
-        lender=request.user,
-        funded_date=timezone.now().date()
-    )
-
-
-    # Update the LoanApplication
-    application.status = "approved"
-    application.lender = request.user
-    application.save()
+    try:
+        with transaction.atomic():
+            # Create Loan record
+            loan = Loan.objects.create(
+                user=application.user,
+                amount=application.amount,
+                purpose=application.purpose,
+                duration=application.duration,
+                interest_rate=application.interest_rate,
+                start_date=timezone.now().date(),
+                paid_amount=Decimal('0.00'),
+                closed=False,
+                status="Active",
+                application_id=application.id,  # link back to LoanApplication
+                lender=request.user,
+                funded_date=timezone.now().date()
+            )
+            # Debit the lender's wallet; rolls the loan back if it cannot cover it
+            ledger.fund_loan(loan)
+            schedule.create_schedule(loan)
+            lender_stats.record_funding(loan)
+
+            # Update the LoanApplication
+            application.status = "approved"
+            application.lender = request.user
+            application.save()
+    except ledger.InsufficientFunds:
+        messages.error(request, "Your wallet balance is too low to fund this loan.")
+        return redirect("loan_requests")
 
     messages.success(request, f"Loan #{loan.id} funded successfully!")
     return redirect("loan_requests")
@@ -883,27 +686,22 @@ def approved_loans(request):
     Calculates totals for dashboard summary cards.
     """
     # Only loans funded by this lender
-    loans = Loan.objects.filter(lender=request.user).order_by('-funded_date')
-
-    # Totals
-    total_funded = loans.aggregate(
-        total=Coalesce(Sum('amount'), Decimal('0.00'))
-    )['total']
-
-    # Outstanding balance = sum of remaining amounts
-    outstanding_balance = loans.aggregate(
-        total=Coalesce(Sum(F('amount') - F('paid_amount'), output_field=DecimalField()), Decimal('0.00'))
-    )['total']
+    funded = Loan.objects.filter(lender=request.user)
 
-    # Expected interest = sum of total interest for all loans
-    expected_interest = loans.aggregate(
-        total=Coalesce(Sum((F('amount') * F('interest_rate') / 100), output_field=DecimalField()), Decimal('0.00'))
-    )['total']
+    # Totals (one aggregate query): funded, outstanding principal and
+    # expected interest across all of them
+    cards = loan_stats(funded, "total_amount", "principal_outstanding", "expected_interest", "loan_count")
+    total_funded = cards['total_amount']
+    outstanding_balance = cards['principal_outstanding']
+    expected_interest = cards['expected_interest']
+    total_loans = cards['loan_count']
 
-    total_loans = loans.count()
+    # Funding sets funded_date, so every loan a lender holds has one to page on
+    loans = paginate(request, funded.filter(funded_date__isnull=False).select_related('user'), '-funded_date')
 
     context = {
         'loans': loans,  # Changed from 'l' to 'loans'
+        'page': loans,
         'total_funded': total_funded,
         'outstanding_balance': outstanding_balance,
         'expected_interest': expected_interest,
@@ -919,15 +717,23 @@ def fund_wallet(request):
     wallets, created = LenderWallet.objects.get_or_create(lender=request.user)
 
     if request.method == "POST":
-        amount = float(request.POST.get("amount"))
-        wallets.balance += amount
-        wallets.save()
-
-        Transaction.objects.create(
-            lender=request.user,
-            amount=amount,
-            type="deposit"
-        )
+        try:
+            amount = Decimal(request.POST.get("amount", "")).quantize(ledger.CENT)
+        except (ValueError, InvalidOperation):
+            messages.error(request, "Invalid amount format.")
+            return redirect("fund_wallet")
+        if amount <= 0:
+            messages.error(request, "Amount must be greater than zero.")
+            return redirect("fund_wallet")
+
+        # The journal updates wallets.balance; never add to it here
+        with transaction.atomic():
+            ledger.deposit(request.user, amount)
+            Transaction.objects.create(
+                lender=request.user,
+                amount=amount,
+                type="deposit"
+            )
 
         return redirect("fund_wallet")
 
@@ -944,111 +750,16 @@ def transaction_history(request):
     if request.user.role != "lender":
         return redirect("borrower")
 
-    # Get all transactions from different sources
-    transactions_list = []
-
-    # 1. Wallet Transactions (deposits)
-    wallet_transactions = Transaction.objects.filter(
-        lender=request.user
-    ).order_by('-timestamp')
-
-    for txn in wallet_transactions:
-        transactions_list.append({
-            'type': f'Wallet {txn.type.title()}',
-            'borrower': 'Self',
-            'status': 'Completed',
-            'amount': float(txn.amount),
-            'balance': 0,  # We'll calculate running balance later
-            'date': txn.timestamp.strftime('%b %d, %Y'),
-            'time': txn.timestamp.strftime('%I:%M %p'),
-            'timestamp': txn.timestamp,
-            'positive': True,  # Deposits are positive
-        })
-
-    # 2. Loans Funded (outflow)
-    funded_loans = Loan.objects.filter(
-        lender=request.user
-    ).order_by('-funded_date')
-
-    for loan in funded_loans:
-        if loan.funded_date:
-            transactions_list.append({
-                'type': 'Loan Funded',
-                'borrower': loan.user.get_full_name() or loan.user.username,
-                'status': loan.status,
-                'amount': float(loan.amount),
-                'balance': 0,
-                'date': loan.funded_date.strftime('%b %d, %Y'),
-                'time': loan.funded_date.strftime('%I:%M %p'),
-                'timestamp': loan.funded_date,
-                'positive': False,  # Funding is outflow
-            })
-
-    # 3. Loan Repayments (inflow)
-    # Get all payments for loans funded by this lender
-    loan_payments = LoanPayment.objects.filter(
-        loan__lender=request.user
-    ).select_related('loan', 'user').order_by('-created_at')
-
-    for payment in loan_payments:
-        transactions_list.append({
-            'type': 'Loan Repayment',
-            'borrower': payment.user.get_full_name() or payment.user.username,
-            'status': 'Completed',
-            'amount': float(payment.amount),
-            'balance': 0,
-            'date': payment.created_at.strftime('%b %d, %Y'),
-            'time': payment.created_at.strftime('%I:%M %p'),
-            'timestamp': payment.created_at,
-            'positive': True,  # Repayments are inflow
-        })
-
-    # Sort all transactions by timestamp (newest first)
-    transactions_list.sort(key=lambda x: x['timestamp'], reverse=True)
-
-    # Calculate running balance (from oldest to newest, then reverse for display)
-    running_balance = Decimal('0.00')
-    reversed_txns = list(reversed(transactions_list))
-
-    for txn in reversed_txns:
-        if txn['positive']:
-            running_balance += Decimal(str(txn['amount']))
-        else:
-            running_balance -= Decimal(str(txn['amount']))
-        txn['balance'] = f"{running_balance:,.2f}"
-
-    # Reverse back to newest first
-    transactions_list = list(reversed(reversed_txns))
-
-    # Calculate summary statistics
-    total_transactions = len(transactions_list)
-
-    # Transactions this month
-    now = timezone.now()
-    first_day_of_month = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    transactions_this_month = sum(
-        1 for txn in transactions_list
-        if txn['timestamp'] >= first_day_of_month
-    )
-
-    # Total inflow (repayments + deposits)
-    total_inflow = sum(
-        Decimal(str(txn['amount'])) for txn in transactions_list
-        if txn['positive']
-    )
-
-    # Total outflow (loans funded + withdrawals)
-    total_outflow = sum(
-        Decimal(str(txn['amount'])) for txn in transactions_list
-        if not txn['positive']
-    )
+    # One page of history (with running balances) and the all-time totals
+    transactions, totals = history(request, request.user)
 
     context = {
-        'transactions': transactions_list,
-        'total_transactions': total_transactions,
-        'transactions_this_month': transactions_this_month,
-        'total_inflow': f"{total_inflow:,.2f}",
-        'total_outflow': f"{total_outflow:,.2f}",
+        'transactions': transactions,
+        'page': transactions,
+        'total_transactions': totals['count'],
+        'transactions_this_month': totals['this_month'],
+        'total_inflow': f"{totals['inflow']:,.2f}",
+        'total_outflow': f"{totals['outflow']:,.2f}",
     }
 
     return render(request, "lender/transaction_history.html", context)
@@ -1060,106 +771,88 @@ def loan_success(request):
 @login_required
 def export_csv(request):
     """
-    Export lender's transaction history to CSV file
+    Stream the lender's transaction history as CSV, newest first.
+    Optional filters: ?from=YYYY-MM-DD&to=YYYY-MM-DD (inclusive, local
+    dates) and ?type=wallet|funding|repayment; ?gzip=1 sends .csv.gz.
     """
     if request.user.role != "lender":
         return HttpResponse("Unauthorized", status=403)
 
-    # Create the HttpResponse object with CSV headers
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="transactions_export.csv"'
-
-    writer = csv.writer(response)
-    # Write header row
-    writer.writerow(['Date', 'Time', 'Type', 'Borrower/Description', 'Status', 'Amount', 'Balance'])
-
-    # Get all transactions (same logic as transaction_history view)
-    transactions_list = []
-
-    # 1. Wallet Transactions
-    wallet_transactions = Transaction.objects.filter(
-        lender=request.user
-    ).order_by('-timestamp')
-
-    for txn in wallet_transactions:
-        transactions_list.append({
-            'type': f'Wallet {txn.type.title()}',
-            'borrower': 'Self',
-            'status': 'Completed',
-            'amount': float(txn.amount),
-            'balance': 0,
-            'date': txn.timestamp.strftime('%b %d, %Y'),
-            'time': txn.timestamp.strftime('%I:%M %p'),
-            'timestamp': txn.timestamp,
-            'positive': True,
-        })
-
-    # 2. Loans Funded
-    funded_loans = Loan.objects.filter(lender=request.user).order_by('-funded_date')
-
-    for loan in funded_loans:
-        if loan.funded_date:
-            transactions_list.append({
-                'type': 'Loan Funded',
-                'borrower': loan.user.get_full_name() or loan.user.username,
-                'status': loan.status,
-                'amount': float(loan.amount),
-                'balance': 0,
-                'date': loan.funded_date.strftime('%b %d, %Y'),
-                'time': loan.funded_date.strftime('%I:%M %p'),
-                'timestamp': loan.funded_date,
-                'positive': False,
-            })
-
-    # 3. Loan Repayments
-    loan_payments = LoanPayment.objects.filter(
-        loan__lender=request.user
-    ).select_related('loan', 'user').order_by('-created_at')
-
-    for payment in loan_payments:
-        transactions_list.append({
-            'type': 'Loan Repayment',
-            'borrower': payment.user.get_full_name() or payment.user.username,
-            'status': 'Completed',
-            'amount': float(payment.amount),
-            'balance': 0,
-            'date': payment.created_at.strftime('%b %d, %Y'),
-            'time': payment.created_at.strftime('%I:%M %p'),
-            'timestamp': payment.created_at,
-            'positive': True,
-        })
-
-    # Sort by timestamp (oldest first for balance calculation)
-    transactions_list.sort(key=lambda x: x['timestamp'])
-
-    # Calculate running balance
-    running_balance = Decimal('0.00')
-    for txn in transactions_list:
-        if txn['positive']:
-            running_balance += Decimal(str(txn['amount']))
-        else:
-            running_balance -= Decimal(str(txn['amount']))
-        txn['balance'] = float(running_balance)
-
-    # Reverse to show newest first in export
-    transactions_list.reverse()
+    try:
+        since = _export_day(request.GET.get('from'))
+        until = _export_day(request.GET.get('to'), end=True)
+    except ValueError:
+        return HttpResponse("Dates must look like YYYY-MM-DD", status=400)
+    sources = None
+    if request.GET.get('type'):
+        if request.GET['type'] not in SOURCE_NAMES:
+            return HttpResponse(f"type must be one of: {', '.join(SOURCE_NAMES)}", status=400)
+        sources = {SOURCE_NAMES[request.GET['type']]}
+
+    # Rows are read from the database in chunks while the response streams
+    rows = history_rows(request.user, since=since, until=until, sources=sources)
+    compress = request.GET.get('gzip') in ('1', 'true', 'yes')
+    response = StreamingHttpResponse(
+        _csv_stream(rows, compress),
+        content_type='application/gzip' if compress else 'text/csv',
+    )
+    filename = "transactions_export.csv.gz" if compress else "transactions_export.csv"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
 
-    # Write transaction rows
-    for txn in transactions_list:
-        amount_str = f"{'+' if txn['positive'] else '-'}${txn['amount']:,.2f}"
-        balance_str = f"${txn['balance']:,.2f}"
 
-        writer.writerow([
+def _export_day(value, end=False):
+    """
+    The aware local midnight starting day `value` (YYYY-MM-DD), or ending
+    it when `end`; None when empty.
+    """
+    if not value:
+        return None
+    day = parse_date(value)
+    if day is None:
+        raise ValueError(value)
+    if end:
+        day += datetime.timedelta(days=1)
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+class _Echo:
+    """File-like object for csv.writer that hands back each line instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def _csv_stream(rows, compress=False, batch=500):
+    """CSV (optionally gzipped) bytes for history rows, `batch` lines per chunk."""
+    writer = csv.writer(_Echo())
+    gzip = zlib.compressobj(wbits=31) if compress else None
+    lines = [writer.writerow(['Date', 'Time', 'Type', 'Borrower/Description', 'Status', 'Amount', 'Balance'])]
+
+    def flush():
+        data = "".join(lines).encode()
+        lines.clear()
+        return gzip.compress(data) if gzip else data
+
+    # The header goes out before the first query, so the first byte never waits on the data
+    yield flush() + (gzip.flush(zlib.Z_SYNC_FLUSH) if gzip else b"")
+    for txn in rows:
+        lines.append(writer.writerow([
             txn['date'],
             txn['time'],
             txn['type'],
             txn['borrower'],
             txn['status'],
-            amount_str,
-            balance_str
-        ])
-
-    return response
+            f"{'+' if txn['positive'] else '-'}${txn['amount']:,.2f}",
+            f"${txn['balance']:,.2f}",
+        ]))
+        if len(lines) >= batch:
+            chunk = flush()
+            if chunk:
+                yield chunk
+    chunk = flush() + (gzip.flush() if gzip else b"")
+    if chunk:
+        yield chunk
 @login_required
 def mark_notification_read(request, notification_id):
     notification = get_object_or_404(Notification, id=notification_id, user=request.user)
@@ -1259,11 +952,28 @@ def download_my_data(request):
     response = HttpResponse(data, content_type='text/plain')
     response['Content-Disposition'] = 'attachment; filename="my_data.txt"'
     return response
+def _close_account(request):
+    """
+    Delete the user, or deactivate them when the ledger still refers to them
+    (a wallet, or a loan they borrowed or funded): the journal is append-only
+    and keeps its accounts, so those users are switched off instead.
+    """
+    user = request.user
+    try:
+        with transaction.atomic():
+            user.delete()
+        messages.success(request, "Your account has been deleted.")
+    except ProtectedError:
+        user.is_active = False
+        user.save(update_fields=["is_active"])
+        messages.success(request, "Your account has been closed. Your loan and wallet records are kept.")
+    logout(request)
+    return redirect("index")
+
+
 @login_required
 def delete_account(request):
-    request.user.delete()
-    messages.success(request, "Your account has been deleted.")
-    return redirect("home")
+    return _close_account(request)
 
 @login_required
 def lsettings_view(request):
@@ -1359,8 +1069,6 @@ def ldownload_my_data(request):
     return response
 @login_required
 def ldelete_account(request):
-    request.user.delete()
-    messages.success(request, "Your account has been deleted.")
-    return redirect("home")
+    return _close_account(request)
 
 
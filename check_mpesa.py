@@ -11,8 +11,7 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')  # Change 'p
 django.setup()
 
 from django.conf import settings
-import requests
-from requests.auth import HTTPBasicAuth
+from app.mpesa.client import get_daraja_client
 
 print("=" * 70)
 print("M-PESA CONFIGURATION CHECK")
@@ -54,18 +53,18 @@ print("\n2. TESTING ACCESS TOKEN:")
 print("-" * 70)
 
 try:
-    consumer_key = settings.MPESA_CONSUMER_KEY
-    consumer_secret = settings.MPESA_CONSUMER_SECRET
-    api_url = settings.MPESA_AUTH_URL
-
-    print(f"Request URL: {api_url}")
-    print(f"Consumer Key: {consumer_key[:20]}...")
-    print(f"Consumer Secret: {consumer_secret[:20]}...")
-
-    response = requests.get(
-        api_url,
-        auth=HTTPBasicAuth(consumer_key, consumer_secret),
-        timeout=30
+    client = get_daraja_client()
+    config = client.config
+
+    print(f"Request URL: {config.oauth_url}")
+    print(f"Consumer Key: {config.consumer_key[:20]}...")
+    print(f"Consumer Secret: {config.consumer_secret[:20]}...")
+
+    response = client.request(
+        "oauth",
+        "GET",
+        config.oauth_url,
+        auth=(config.consumer_key, config.consumer_secret),
     )
 
     print(f"\nResponse Status: {response.status_code}")
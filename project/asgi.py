@@ -3,6 +3,10 @@ ASGI config for project project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Serve it with an ASGI server (e.g. ``uvicorn project.asgi:application``) so the
+async ``repay_loan`` view does not tie up a worker thread. It only enqueues an
+MpesaPaymentJob; the STK pushes are sent by ``manage.py mpesa_worker``.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
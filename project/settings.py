@@ -50,8 +50,29 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'app.middleware.QueryInstrumentationMiddleware',
 ]
 
+# Per-request SQL counts, timings and N+1 warnings (X-SQL-* headers and a log line)
+SQL_INSTRUMENTATION = DEBUG
+# A query shape run this many times in one request is reported as a likely N+1
+SQL_REPEATED_QUERY_THRESHOLD = 3
+# Queries allowed per view (URL name); "default" applies to views not listed
+SQL_QUERY_BUDGETS = {
+    "default": 20,
+    "borrower": 8,
+    "lender": 7,
+    "my_loans": 8,
+    "approved_loans": 6,
+    "transaction_history": 8,
+    # Loan, ledger transfer, schedule and lender stats writes in one transaction
+    "fund_loan": 30,
+}
+# Test mode: a view over its budget raises QueryBudgetExceeded instead of logging a warning
+SQL_QUERY_BUDGET_ENFORCE = False
+# Rows per page on the keyset-paginated list views (loans, requests, notifications, history)
+LIST_PAGE_SIZE = 20
+
 ROOT_URLCONF = 'project.urls'
 
 TEMPLATES = [
@@ -88,18 +109,52 @@ DATABASES = {
         # }
     }
 }
+# Partial indexes (e.g. unread notifications) are skipped on MySQL; a composite index covers those queries there
+SILENCED_SYSTEM_CHECKS = ["models.W037"]
+# Shared cache so every gunicorn worker sees the same M-Pesa token, locks and counters.
+# Create the table once with: python manage.py createcachetable
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'django_cache',
+    }
+}
+# Payment-path logging: level and sampling of INFO/DEBUG lines (WARNING+ is always kept)
+MPESA_LOG_LEVEL = "INFO"
+MPESA_LOG_SAMPLE_RATE = 1.0
+
 LOGGING = {
     'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'correlation_id': {'()': 'app.mpesa.log.CorrelationIdFilter'},
+        'sampling': {'()': 'app.mpesa.log.SamplingFilter', 'rate': MPESA_LOG_SAMPLE_RATE},
+        'redact': {'()': 'app.mpesa.log.RedactingFilter'},
+    },
+    'formatters': {
+        'json': {'()': 'app.mpesa.log.JsonFormatter'},
+    },
     'handlers': {
         'console': {
             'class': 'logging.StreamHandler',
         },
+        'payments': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json',
+            # Order matters: sampled-out records are dropped before redaction runs
+            'filters': ['correlation_id', 'sampling', 'redact'],
+        },
     },
     'loggers': {
         'django.db.backends': {
             'handlers': ['console'],
             'level': 'DEBUG',
         },
+        'app': {
+            'handlers': ['payments'],
+            'level': MPESA_LOG_LEVEL,
+            'propagate': False,
+        },
     },
 }
 
@@ -110,7 +165,9 @@ LOGGING = {
 # M-PESA SANDBOX CONFIGURATION
 # ============================================
 
-MPESA_ENV = "sandbox"
+MPESA_ENV = "sandbox"  # "sandbox", "production", or "simulator" for the local stand-in
+# Base URL of `python manage.py mpesa_simulator` when MPESA_ENV = "simulator"
+MPESA_SIMULATOR_URL = "http://127.0.0.1:8900"
 # Consumer info
 MPESA_CONSUMER_KEY = 'crJeen9qbKwwzFgSgjJuxoDg8agVvDhQ2LAF8o6hDzuMnTzp'  # Replace with your actual key
 MPESA_CONSUMER_SECRET = '2GW86tmbUcV9adZLDBxLn03AwjA30tZOZA6MO85L6GNSGYRURruX1jvggZUUH8t2'
@@ -123,6 +180,37 @@ MPESA_AUTH_URL = "https://sandbox.safaricom.co.ke/oauth/v1/generate?grant_type=c
 MPESA_STK_PUSH_URL = "https://sandbox.safaricom.co.ke/mpesa/stkpush/v1/processrequest"
 # 🔥 IMPORTANT: Update this EVERY TIME ngrok gives you a new link
 MPESA_CALLBACK_URL = "https://webhook.site/mpesa/callback/"
+# Refresh the OAuth token this many seconds before Daraja's expires_in
+MPESA_TOKEN_REFRESH_MARGIN = 120
+# Pooled Daraja HTTP client
+MPESA_HTTP_POOL_SIZE = 10
+MPESA_HTTP_RETRIES = 2  # retries on 5xx, with exponential backoff + jitter
+MPESA_HTTP_RETRY_BACKOFF = 0.5
+# Per-endpoint (connect, read) timeouts in seconds
+MPESA_TIMEOUTS = {
+    "oauth": (3.05, 10),
+    "stk_push": (3.05, 30),
+    "stk_query": (3.05, 15),
+}
+# Connection pool of the asyncio Daraja client used by mpesa_worker and mpesa_reconcile
+MPESA_ASYNC_POOL_SIZE = 100
+# Outbound STK push job queue (python manage.py mpesa_worker)
+MPESA_JOB_MAX_ATTEMPTS = 5
+MPESA_JOB_RETRY_BACKOFF = 15  # seconds, doubled on every attempt
+MPESA_JOB_MAX_BACKOFF = 600
+MPESA_JOB_LEASE_SECONDS = 120  # renewed while the worker runs; a job whose lease lapses is re-claimed
+# STK push token bucket per shortcode, shared through the cache. Pushes over the
+# limit wait for a slot instead of failing with HTTP 429.
+MPESA_STK_RATE = 5.0  # pushes per second
+MPESA_STK_BURST = 10
+
+# Circuit breaker per Daraja endpoint (OAuth, STK push, STK query)
+MPESA_BREAKER_FAILURE_THRESHOLD = 5  # consecutive failures that open the breaker
+MPESA_BREAKER_WINDOW = 60  # seconds a failure streak is remembered
+MPESA_BREAKER_RESET_TIMEOUT = 30  # seconds open before a single probe request is let through
+# STK query reconciler (python manage.py mpesa_reconcile)
+MPESA_RECONCILE_FIRST_POLL = 60  # seconds to wait for the callback before the first query
+MPESA_CHECKOUT_EXPIRY = 24 * 60 * 60  # stop polling and mark the checkout expired after this
 
 
 
@@ -0,0 +1,14 @@
+# Settings for running benchmarks and management-command checks on SQLite,
+# e.g. python manage.py bench_callbacks --settings=project.settings_bench
+
+from .settings import *  # noqa: F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'bench.sqlite3',
+    }
+}
+
+# Logging every SQL statement would dominate the timings
+LOGGING['loggers'].pop('django.db.backends', None)